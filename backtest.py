@@ -0,0 +1,139 @@
+#!/bin/env python3
+
+import click
+import csv
+import logging
+import os
+import time
+
+import coinlendingbot.Configuration as Config
+import coinlendingbot.Data as Data
+from coinlendingbot import Sweep
+from coinlendingbot.Backtest import Backtest
+from coinlendingbot.ExchangeSimulator import MarketHistory
+from coinlendingbot.fakeexchange.Market import PRICES, DEFAULT_PRICE
+
+
+def parse_prices(prices):
+    parsed = {}
+    for price in prices:
+        cur, value = price.split('=')
+        parsed[cur.strip().upper()] = float(value)
+    return parsed
+
+
+def load_market_data(market_data, currencies, balance, prices):
+    """
+    Returns the recorded history and the balances at the start, the balance split equally among the currencies
+    """
+    currencies = [c.strip().upper() for c in currencies.split(',') if c.strip()] or Config.get_all_currencies()
+    history = MarketHistory.load(market_data, Config.get_exchange(), currencies)
+    if not history.books:
+        raise click.ClickException("No market data of {} found in {}".format(", ".join(currencies), market_data))
+    balances = {cur: balance / len(history.books) / prices.get(cur, PRICES.get(cur, DEFAULT_PRICE))
+                for cur in history.books}
+    return history, balances
+
+
+def market_data_options(command):
+    options = [
+        click.option('-c', '--config', default='default.cfg', type=click.File(),
+                     help='Configuration to backtest (Default: default.cfg)'),
+        click.option('-m', '--market-data',
+                     default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'market_data'),
+                     type=click.Path(exists=True, file_okay=False),
+                     help='Directory of the MarketAnalysis databases (Default: market_data)'),
+        click.option('--currencies', default='', help='Currencies to lend, comma separated (Default: all recorded)'),
+        click.option('--balance', default=10000.0,
+                     help='USD value of the balance at the start, split among the currencies'),
+        click.option('--price', multiple=True,
+                     help='USD price of a currency as CUR=PRICE, repeatable (Default: built-in)'),
+        click.option('--days', default=0.0,
+                     help='Days to backtest from the start of the recording (Default: all of it)')
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+@click.group()
+def cli():
+    """
+    Backtests the lending strategy of a configuration against the market data recorded by MarketAnalysis
+    """
+
+
+@cli.command()
+@market_data_options
+@click.option('-v', '--verbose', is_flag=True, help='Log the lending of every round')
+def run(config, market_data, currencies, balance, price, days, verbose):
+    """
+    Lends a balance against the recorded offer books with the strategy of the configuration
+    """
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.WARNING,
+                        format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    Config.init(config, Data)
+    prices = parse_prices(price)
+    started = time.time()
+    history, balances = load_market_data(market_data, currencies, balance, prices)
+    loaded = time.time()
+    results = Backtest(Config, history, balances, prices, days).run()
+    click.echo("{:<6} {:>16} {:>14} {:>14} {:>7} {:>10} {:>7} {:>9}".format(
+        "cur", "balance", "earned", "accrued", "loans", "avg rate", "lent", "yearly"))
+    for r in results:
+        click.echo("{:<6} {:>16.8f} {:>14.8f} {:>14.8f} {:>7} {:>9.4f}% {:>6.1f}% {:>8.2f}%".format(
+            r["currency"], r["balance"], r["earned"], r["accrued"], r["loans"], r["average_rate"] * 100,
+            r["lent"] * 100, r["yearly_rate"] * 100))
+    click.echo("loaded in {:.1f} s, backtested in {:.1f} s".format(loaded - started, time.time() - loaded))
+
+
+@cli.command()
+@market_data_options
+@click.option('-p', '--param', 'params', multiple=True, required=True,
+              help='[SECTION.]option=value,value,... or, for --random, option=min:max. Repeatable')
+@click.option('--random', 'samples', default=0, help='Backtest this many random variants instead of the grid')
+@click.option('--seed', default=None, type=int, help='Seed of the random search')
+@click.option('-w', '--workers', default=0, help='Worker processes (Default: one per CPU)')
+@click.option('--top', default=20, help='Variants to show (Default: 20)')
+@click.option('-o', '--output', type=click.File('w'), help='Write all results to this CSV file')
+def sweep(config, market_data, currencies, balance, price, days, params, samples, seed, workers, top, output):
+    """
+    Backtests variants of the configuration in parallel and ranks them by the yearly rate of the whole balance
+    """
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    config_text = config.read()
+    config.seek(0)
+    Config.init(config, Data)
+    prices = parse_prices(price)
+    try:
+        parameters = dict(Sweep.parse_parameter(param, config_text) for param in params)
+        variants = Sweep.random_variants(parameters, samples, seed) if samples else Sweep.grid(parameters)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex))
+    started = time.time()
+    history, balances = load_market_data(market_data, currencies, balance, prices)
+    ranked = Sweep.run(config_text, history, balances, variants, prices, days, workers or None)
+    names = [option for section, option in parameters.keys()]
+    click.echo("{:>4} {:>9}  {}".format("rank", "yearly", "  ".join("{:>12}".format(n) for n in names)))
+    for rank, r in enumerate(ranked[:top], 1):
+        values = [r["variant"][key] for key in parameters.keys()]
+        yearly = "{:>8.2f}%".format(r["yearly_rate"] * 100) if r["error"] is None else "{:>9}".format("failed")
+        click.echo("{:>4} {}  {}".format(rank, yearly, "  ".join("{:>12}".format(v) for v in values)))
+    for r in ranked:
+        if r["error"]:
+            click.echo("failed {}: {}".format(r["variant"], r["error"]))
+    click.echo("{} variants in {:.1f} s".format(len(variants), time.time() - started))
+    if output:
+        writer = csv.writer(output)
+        columns = ["currency", "earned", "accrued", "loans", "average_rate", "lent", "currency_yearly_rate", "error"]
+        writer.writerow(["rank", "yearly_rate"] + names + columns)
+        for rank, r in enumerate(ranked, 1):
+            values = [r["variant"][key] for key in parameters.keys()]
+            for c in r["results"] or [{}]:
+                writer.writerow([rank, r["yearly_rate"]] + values + [
+                    c.get("currency"), c.get("earned"), c.get("accrued"), c.get("loans"), c.get("average_rate"),
+                    c.get("lent"), c.get("yearly_rate"), r["error"]])
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,209 @@
+"""
+Backtest of the lending strategy against the offer books recorded by MarketAnalysis
+"""
+
+import heapq
+import logging
+
+import numpy
+
+import coinlendingbot.Data as Data
+import coinlendingbot.Lending as Lending
+import coinlendingbot.MaxToLend as MaxToLend
+from coinlendingbot.fakeexchange.Market import PRICES, DEFAULT_PRICE, FEE
+
+
+class NullLog(object):
+    """
+    Stands in for the web log, the backtest shows nothing there
+    """
+
+    def __getattr__(self, name):
+        return self._ignore
+
+    @staticmethod
+    def _ignore(*args, **kwargs):
+        pass
+
+
+class Backtest(object):
+    """
+    Runs the rounds of the bot against recorded offer books. Every round returns the loans due, fills the offers of
+    the previous round once the recorded best offer rate rose above them, cancels the others and lends the available
+    balances with Lending.lend_cur, so gapMode, spreadlend, xdays and maxtolend act like in the bot.
+    The backtest is the exchange API and the MarketAnalysis of Lending, the rate suggestions are calculated for the
+    whole recording at once. Lending keeps its state in the module, so only one backtest runs per process.
+    """
+
+    def __init__(self, cfg, history, balances, prices=None, days=None, suggestions_cache=None):
+        """
+        :param cfg: The Configuration module, initialised with the bot configuration to test
+        :param history: The MarketHistory to lend against
+        :param balances: The lending balance of every currency at the start, {currency: amount}
+        :param prices: USD prices of the currencies to convert the gaps of gapMode RawBTC, {currency: price}
+        :param days: The days to backtest from the start of the recording, all of it by default
+        :param suggestions_cache: A dict keeping the rate suggestions for backtests with the same analysis settings
+        """
+        self.logger = logging.getLogger(__name__)
+        self.cfg = cfg
+        self.history = history
+        self.currencies = sorted(cur for cur in balances if cur in history.books)
+        self.start_time = history.start_time()
+        self.end_time = history.end_time()
+        if days:
+            self.end_time = min(self.end_time, self.start_time + days * 86400)
+        self.now = self.start_time
+        self.last_round = self.start_time
+        self.balances = {cur: float(balances[cur]) for cur in self.currencies}
+        self.available = dict(self.balances)
+        self.lent = {cur: 0.0 for cur in self.currencies}
+        self.offers = {cur: [] for cur in self.currencies}
+        self.loans = []
+        self.next_id = 0
+        self.stats = {cur: {"loans": 0, "earned": 0.0, "volume": 0.0, "rate_volume": 0.0, "lent_seconds": 0.0}
+                      for cur in self.currencies}
+        prices = dict(prices or {})
+        self.usd_prices = {cur: float(prices.get(cur, PRICES.get(cur, DEFAULT_PRICE)))
+                           for cur in self.currencies + ['BTC']}
+        self.ticker = {'BTC_' + cur: {'last': '{:.8f}'.format(self.usd_prices[cur] / self.usd_prices['BTC'])}
+                       for cur in self.currencies}
+        if cfg.has_option('BOT', 'endDate'):
+            self.logger.warning("endDate is ignored by the backtest")
+            cfg.config.remove_option('BOT', 'endDate')
+
+        log = NullLog()
+        Data.init(self, log)
+        MaxToLend.init(cfg, log)
+        self.suggestions = {}
+        analysis = None
+        if cfg.has_option('MarketAnalysis', 'analyseCurrencies'):
+            from coinlendingbot.MarketAnalysis import MarketAnalysis
+            analysis = MarketAnalysis(cfg, self)
+        notify_conf = {'notify_summary_minutes': 0, 'notify_new_loans': False, 'notify_xday_threshold': False}
+        Lending.init(cfg, self, log, Data, MaxToLend, False, self if analysis else None, notify_conf)
+        if analysis:
+            for cur in self.currencies:
+                if cur not in Lending.currencies_to_analyse:
+                    continue
+                key = (cur, Lending.analysis_method, analysis.lending_style, analysis.percentile_seconds,
+                       analysis.MACD_short_win_seconds, analysis.MACD_long_win_seconds,
+                       analysis.daily_min_multiplier, analysis.data_tolerance)
+                if suggestions_cache is not None and key in suggestions_cache:
+                    self.suggestions[cur] = suggestions_cache[key]
+                    continue
+                times, rates, amounts = history.books[cur]
+                suggestions = analysis.get_rate_suggestions(times, rates[:, 0], Lending.analysis_method)
+                # float like the clock, comparing mixed types would convert the whole array on every lookup
+                times = (suggestions.index.values.astype('int64') // 10 ** 9).astype(float)
+                self.suggestions[cur] = (times, suggestions.values)
+                if suggestions_cache is not None:
+                    suggestions_cache[key] = self.suggestions[cur]
+
+    def run(self):
+        """
+        Lends from the start to the end of the recording and returns the results of every currency
+        """
+        self.logger.info("Backtesting {} from {} to {}".format(", ".join(self.currencies), int(self.start_time),
+                                                               int(self.end_time)))
+        while self.now < self.end_time:
+            self._settle()
+            usable = 0
+            for cur in self.currencies:
+                usable += self._lend(cur)
+            Lending.set_sleep_time(usable)
+            sleep_time = Lending.get_sleep_time()
+            for cur in self.currencies:
+                self.stats[cur]["lent_seconds"] += self.lent[cur] * min(sleep_time, self.end_time - self.now)
+            self.last_round = self.now
+            self.now += sleep_time
+        self.now = self.end_time
+        self._settle()
+        return self.results()
+
+    def _settle(self):
+        while self.loans and self.loans[0][0] <= self.now:
+            end, loan_id, cur, amount, rate, days = heapq.heappop(self.loans)
+            earned = amount * rate * days * (1 - FEE)
+            self.lent[cur] -= amount
+            self.available[cur] += amount + earned
+            self.stats[cur]["earned"] += earned
+        for cur in self.currencies:
+            for rate, amount, days in self.offers[cur]:
+                filled = self.history.first_rate_above(cur, self.last_round, self.now, rate)
+                if filled is None:
+                    self.available[cur] += amount
+                    continue
+                self.next_id += 1
+                heapq.heappush(self.loans, (filled + days * 86400, self.next_id, cur, amount, rate, days))
+                self.lent[cur] += amount
+                self.stats[cur]["loans"] += 1
+                self.stats[cur]["volume"] += amount * days
+                self.stats[cur]["rate_volume"] += amount * days * rate
+            self.offers[cur] = []
+
+    def _lend(self, cur):
+        total_lent = {cur: '{:.8f}'.format(self.lent[cur])}
+        lending_balances = {cur: '{:.8f}'.format(max(self.available[cur], 0))}
+        while True:
+            try:
+                return Lending.lend_cur(cur, total_lent, lending_balances, self.ticker)
+            except StopIteration:
+                # lend again with the raised request limit, like Lending.lend_all. The limit ends up above the
+                # levels of the recording, which stops it.
+                pass
+
+    def results(self):
+        """
+        Returns [{"currency", "balance", "earned", "accrued", "loans", "average_rate", "lent", "yearly_rate"}, ...],
+        accrued is the interest of the loans still running at the end. Rates are daily rates.
+        """
+        seconds = max(self.now - self.start_time, 1)
+        accrued = {cur: 0.0 for cur in self.currencies}
+        for end, loan_id, cur, amount, rate, days in self.loans:
+            accrued[cur] += amount * rate * (self.now - (end - days * 86400)) / 86400 * (1 - FEE)
+        results = []
+        for cur in self.currencies:
+            stats = self.stats[cur]
+            balance = self.balances[cur]
+            results.append({
+                "currency": cur,
+                "balance": balance,
+                "earned": stats["earned"],
+                "accrued": accrued[cur],
+                "loans": stats["loans"],
+                "average_rate": stats["rate_volume"] / stats["volume"] if stats["volume"] else 0.0,
+                "lent": stats["lent_seconds"] / (balance * seconds) if balance else 0.0,
+                "yearly_rate": (stats["earned"] + accrued[cur]) / balance * 365 * 86400 / seconds if balance else 0.0
+            })
+        return results
+
+    # Exchange API used by Lending, MarketAnalysis and Data
+
+    def return_loan_orders(self, currency, limit=0):
+        levels = self.history.levels(currency, self.now)
+        if limit:
+            levels = levels[:int(limit)]
+        return {"offers": [{"rate": '{:.8f}'.format(rate), "amount": '{:.8f}'.format(amount), "rangeMin": 2,
+                            "rangeMax": 2} for rate, amount in levels],
+                "demands": []}
+
+    def return_available_account_balances(self, account):
+        return {account: {cur: '{:.8f}'.format(amount) for cur, amount in self.available.items() if amount > 0}}
+
+    def create_loan_offer(self, currency, amount, duration, auto_renew, lending_rate):
+        amount = float(amount)
+        self.available[currency] -= amount
+        self.offers[currency].append((float(lending_rate), amount, int(duration)))
+        self.next_id += 1
+        return {"success": 1, "message": "Loan order placed.", "orderID": self.next_id}
+
+    # MarketAnalysis used by Lending
+
+    def get_rate_suggestion(self, cur, rates=None, method='percentile'):
+        if cur not in self.suggestions:
+            return 0
+        times, suggestions = self.suggestions[cur]
+        index = numpy.searchsorted(times, self.now, side='right') - 1
+        if index < 0 or numpy.isnan(suggestions[index]):
+            return 0
+        return float(suggestions[index])
@@ -9,13 +9,17 @@ import threading
 import logging
 
 from coinlendingbot.ExchangeApi import ExchangeApi
-from coinlendingbot.ExchangeApi import ApiError
+from coinlendingbot.ExchangeApi import ApiError, ApiTimeoutError, RateLimitError, ServerError
 from coinlendingbot.Bitfinex2Poloniex import Bitfinex2Poloniex
 from coinlendingbot.RingBuffer import RingBuffer
 from coinlendingbot.websocket import ExchangeWsClient
+import coinlendingbot.Nonce as Nonce
 
 
 class Bitfinex(ExchangeApi):
+    WRITE_ENDPOINTS = ('offer/new', 'offer/cancel', 'transfer')
+    LENDING_HISTORY_PER_CURRENCY = True
+
     def __init__(self, cfg, weblog):
         super(Bitfinex, self).__init__(cfg, weblog)
         Bitfinex2Poloniex.all_currencies = self.all_currencies
@@ -25,17 +29,31 @@ class Bitfinex(ExchangeApi):
         self.default_req_period = 1000  # milliseconds, 1000 = 60/min
         self.req_period = self.default_req_period
         self.req_time_log = RingBuffer(self.req_per_period)
-        self.url = 'https://api.bitfinex.com'
+        self.request_tracker = self.create_request_tracker()
+        self.retry_policy = self.create_retry_policy()
+        # the URLs can point to a stand-in exchange, see fakeexchange.py
+        self.url = self.cfg.get('BITFINEX', 'url', 'https://api.bitfinex.com')
+        self.ws_url = self.cfg.get('BITFINEX', 'wsUrl', '') or None
         self.apiVersion = 'v1'
         self.symbols = []
+        self.ticker_demand = {}
+        self.ticker_pairs = set()
+        # freshly subscribed pairs, return_ticker() waits once for their first update
+        self.ticker_waiting = set()
+        self.ticker_failed = set()
         self.timeout = int(self.cfg.get("BOT", "timeout", 30, 1, 180))
         self._init_websocket()
 
     def _init_websocket(self):
-        self.websocket = ExchangeWsClient('BITFINEX')
+        self.websocket = ExchangeWsClient('BITFINEX', self.ws_url)
+        record_file = self.cfg.get("BITFINEX", "wsRecordFile", "")
+        if record_file:
+            self.websocket.record(record_file)
         self.websocket.start()
-        for pair in self._get_symbols():
-            self.websocket.subscribe_ticker(pair)
+        if self.apiKey and self.apiSecret:
+            # wallets, offers and credits are served from the authenticated channel while connected
+            self.websocket.authenticate(self.apiKey, self.apiSecret)
+        # ticker channels are subscribed on demand, see set_ticker_demand()
 
     @property
     def _nonce(self):
@@ -43,7 +61,7 @@ class Bitfinex(ExchangeApi):
         Returns a nonce
         Used in authentication
         """
-        return str(int(time.time() * 100000))
+        return str(Nonce.next_nonce())
 
     def limit_request_rate(self):
         super(Bitfinex, self).limit_request_rate()
@@ -83,10 +101,11 @@ class Bitfinex(ExchangeApi):
             if r.status_code != 200:
                 statusCode = int(r.status_code)
                 if statusCode == 502 or statusCode in range(520, 530, 1):
-                    raise ApiError('(1) API Error {}: The web server reported a bad gateway or gateway timeout error.'
-                                   .format(statusCode))
+                    raise ServerError('(1) API Error {}: The web server reported a bad gateway or gateway timeout '
+                                      'error.'.format(statusCode))
                 elif statusCode == 429:
                     self.increase_request_timer()
+                    raise RateLimitError('(2) API Error {}: {}'.format(statusCode, r.text))
                 raise ApiError('(2) API Error {}: {}'.format(statusCode, r.text))
 
             # Check in case something has gone wrong and the timer is too big
@@ -97,6 +116,7 @@ class Bitfinex(ExchangeApi):
             ex.message = "{0} requesting {1}".format(ex, self.url + request)
             raise ex
 
+    @ExchangeApi.retried
     @ExchangeApi.synchronized
     def _post(self, command, payload=None, verify=True):
         # keep the request per minute limit
@@ -106,15 +126,18 @@ class Bitfinex(ExchangeApi):
         payload['request'] = '/{}/{}'.format(self.apiVersion, command)
         payload['nonce'] = self._nonce
         signed_payload = self._sign_payload(payload)
-        return self._request('post', payload['request'], signed_payload, verify)
+        with self.track_request(command):
+            return self._request('post', payload['request'], signed_payload, verify)
 
+    @ExchangeApi.retried
     @ExchangeApi.synchronized
     def _get(self, command):
         # keep the request per minute limit
         self.limit_request_rate()
 
         request = '/{}/{}'.format(self.apiVersion, command)
-        return self._request('get', request)
+        with self.track_request(command):
+            return self._request('get', request)
 
     def _get_symbols(self):
         """
@@ -136,11 +159,51 @@ class Bitfinex(ExchangeApi):
 
         return self.symbols
 
+    def _couple_symbol(self, couple):
+        """
+        Returns the symbol of a couple (e.g. "BTC_ETH" -> "ethbtc") or None if it isn't traded
+        """
+        ref, cur = couple.lower().split('_')
+        for symbol in [cur + ref, ref + cur]:
+            if symbol in self._get_symbols():
+                return symbol
+        return None
+
+    def set_ticker_demand(self, consumer, couples):
+        self.ticker_demand[consumer] = set(couples)
+        pairs = set()
+        for demand in self.ticker_demand.values():
+            pairs.update([self._couple_symbol(c) for c in demand])
+        pairs.discard(None)
+        pairs -= self.ticker_failed
+        for pair in pairs - self.ticker_pairs:
+            self.websocket.subscribe_ticker(pair)
+            self.ticker_waiting.add(pair)
+        for pair in self.ticker_pairs - pairs:
+            self.websocket.unsubscribe_ticker(pair)
+            self.ticker_waiting.discard(pair)
+        if pairs != self.ticker_pairs:
+            self.logger.info("Ticker subscriptions: {}".format(sorted(pairs)))
+            self.ticker_pairs = pairs
+
+    def _drop_failed_tickers(self):
+        failed = {pair for pair in self.ticker_pairs if pair.upper() in self.websocket.return_ticker_errors()}
+        for pair in failed:
+            self.logger.warning("Ticker subscription of {} failed, not using it anymore".format(pair))
+            self.websocket.unsubscribe_ticker(pair)
+        self.ticker_failed |= failed
+        self.ticker_pairs -= failed
+        self.ticker_waiting -= failed
+
     def return_open_loan_offers(self):
         """
         Returns active loan offers
         https://bitfinex.readme.io/v1/reference#rest-auth-offers
         """
+        funding_offers = self.websocket.return_funding_offers()
+        if funding_offers is not None:
+            return Bitfinex2Poloniex.convertWsOpenLoanOffers(funding_offers)
+
         bfx_resp = self._post('offers')
         resp = Bitfinex2Poloniex.convertOpenLoanOffers(bfx_resp)
 
@@ -157,6 +220,10 @@ class Bitfinex(ExchangeApi):
         Returns own active loan offers
         https://bitfinex.readme.io/v1/reference#rest-auth-offers
         """
+        funding_credits = self.websocket.return_funding_credits()
+        if funding_credits is not None:
+            return Bitfinex2Poloniex.convertWsActiveLoans(funding_credits)
+
         bfx_resp = self._post('credits')
         resp = Bitfinex2Poloniex.convertActiveLoans(bfx_resp)
 
@@ -166,7 +233,17 @@ class Bitfinex(ExchangeApi):
         """
         The ticker is a high level overview of the state of the market
         """
-        bfx_ticker = self.websocket.return_ticker()
+        # wait once for the first update of freshly subscribed pairs
+        deadline = time.time() + self.timeout
+        while self.ticker_waiting and time.time() < deadline:
+            self._drop_failed_tickers()
+            self.ticker_waiting = {pair for pair in self.ticker_waiting
+                                   if pair.upper() not in self.websocket.return_ticker()}
+            if self.ticker_waiting:
+                time.sleep(0.1)
+        self.ticker_waiting = set()
+        self._drop_failed_tickers()
+        bfx_ticker = dict(self.websocket.return_ticker())
         ticker = Bitfinex2Poloniex.convertTicker(bfx_ticker)
         self.logger.debug('ticker: {}'.format(ticker))
         return ticker
@@ -176,6 +253,12 @@ class Bitfinex(ExchangeApi):
         Returns own balances sorted by account
         https://bitfinex.readme.io/v1/reference#rest-auth-wallet-balances
         """
+        wallets = self.websocket.return_wallets()
+        if wallets is not None:
+            balances = Bitfinex2Poloniex.convertWsAccountBalances(wallets, account)
+            self.logger.debug("accout:{} result:{}".format(account, balances))
+            return balances
+
         bfx_resp = self._post('balances')
         balances = Bitfinex2Poloniex.convertAccountBalances(bfx_resp, account)
         self.logger.debug("accout:{} result:{}".format(account, balances))
@@ -186,6 +269,9 @@ class Bitfinex(ExchangeApi):
         Cancels an offer
         https://bitfinex.readme.io/v1/reference#rest-auth-cancel-offer
         """
+        if self.websocket.is_authenticated():
+            return self._cancel_loan_offer_ws(order_number)
+
         payload = {
             "offer_id": order_number,
         }
@@ -205,6 +291,21 @@ class Bitfinex(ExchangeApi):
 
         return {"success": success, "message": message}
 
+    def _cancel_loan_offer_ws(self, order_number):
+        """
+        Cancels an offer over the authenticated websocket
+        https://docs.bitfinex.com/v2/reference#ws-input-offer-cancel
+        """
+        confirmation = self.websocket.cancel_funding_offer(order_number, self.timeout)
+        if confirmation is None:
+            raise ApiTimeoutError("Canceling offer {} timed out on websocket".format(order_number))
+        if confirmation['status'] != "SUCCESS":
+            return {"success": 0, "message": "Error canceling offer: {}".format(confirmation['text'])}
+        offer = confirmation['funding_offer']
+        return {"success": 1,
+                "message": "Loan offer canceled ({:.4f} @ {:.4f}%).".format(float(offer['amount']),
+                                                                            float(offer['rate']) * 100)}
+
     def create_loan_offer(self, currency, amount, duration, auto_renew, lending_rate):
         """
         Creates a loan offer for a given currency.
@@ -220,6 +321,9 @@ class Bitfinex(ExchangeApi):
         }
 
         try:
+            if self.websocket.is_authenticated():
+                return self._create_loan_offer_ws(currency, amount, duration, lending_rate)
+
             bfx_resp = self._post('offer/new', payload)
             plx_resp = {"success": 0, "message": "Error", "orderID": 0}
             if bfx_resp['id']:
@@ -235,12 +339,29 @@ class Bitfinex(ExchangeApi):
                     usd_min = 50
                     cur_min = usd_min
                     if currency != 'USD':
-                        cur_min = usd_min / float(self.return_ticker()['USD_' + currency]['lowestAsk'])
+                        self.set_ticker_demand('create_loan_offer', ['USD_' + currency])
+                        try:
+                            cur_min = usd_min / float(self.return_ticker()['USD_' + currency]['lowestAsk'])
+                        finally:
+                            self.set_ticker_demand('create_loan_offer', [])
 
                     raise Exception("Error create_loan_offer: Amount must be at least " + str(cur_min) + " " + currency)
                 else:
                     raise e
 
+    def _create_loan_offer_ws(self, currency, amount, duration, lending_rate):
+        """
+        Creates a loan offer over the authenticated websocket, it doesn't use up the REST request limit
+        https://docs.bitfinex.com/v2/reference#ws-input-offer-new
+        """
+        rate = '{:.10f}'.format(round(float(lending_rate), 10))
+        confirmation = self.websocket.create_funding_offer(currency, amount, rate, int(duration), self.timeout)
+        if confirmation is None:
+            raise ApiTimeoutError("Creating loan offer timed out on websocket")
+        if confirmation['status'] != "SUCCESS":
+            raise ApiError(confirmation['text'])
+        return {"success": 1, "message": "Loan order placed.", "orderId": confirmation['funding_offer']['id']}
+
     def return_balances(self):
         """
         Returns balances of exchange wallet
@@ -276,7 +397,7 @@ class Bitfinex(ExchangeApi):
 
         return plx_resp
 
-    def return_lending_history(self, start, stop, limit=500):
+    def return_lending_history(self, start, stop, limit=500, currency=None):
         """
         Retrieves balance ledger entries. Search funding payments in it and returns
         it as history.
@@ -284,7 +405,7 @@ class Bitfinex(ExchangeApi):
         """
         self.logger.debug("Start:{} Stop:{} Limit:{}".format(start, stop, limit))
         history = []
-        for curr in self.all_currencies:
+        for curr in [currency] if currency else self.all_currencies:
             payload = {
                 "currency": curr,
                 "since": str(start),
@@ -65,6 +65,55 @@ class Bitfinex2Poloniex(object):
 
         return plxOffers
 
+    @staticmethod
+    def convertWsOpenLoanOffers(bfxOffers):
+        '''
+        Convert from websocket funding offers to "returnOpenLoanOffers"
+        '''
+        plxOffers = {}
+        for offer in bfxOffers:
+            if offer['currency'] not in Bitfinex2Poloniex.all_currencies:
+                continue
+            if offer['currency'] not in plxOffers:
+                plxOffers[offer['currency']] = []
+
+            # positive amounts are lend offers, rates are daily already
+            if offer['amount'] > 0:
+                plxOffers[offer['currency']].append({
+                    "id": offer['id'],
+                    "rate": str(offer['rate']),
+                    "amount": str(offer['amount']),
+                    "duration": offer['period'],
+                    "autoRenew": 0,
+                    "date": Bitfinex2Poloniex.convertTimestamp(offer['mts_created'] / 1000.0)
+                })
+
+        return plxOffers
+
+    @staticmethod
+    def convertWsActiveLoans(bfxCredits):
+        '''
+        Convert from websocket funding credits to "returnActiveLoans"
+        '''
+        plxOffers = {}
+        plxOffers['provided'] = []
+        plxOffers['used'] = []
+        for credit in bfxCredits:
+            # side -1 means we are the borrower
+            if credit['currency'] not in Bitfinex2Poloniex.all_currencies or credit['side'] == -1:
+                continue
+            plxOffers['provided'].append({
+                "id": credit['id'],
+                "currency": credit['currency'],
+                "rate": str(credit['rate']),
+                "amount": str(credit['amount']),
+                "duration": credit['period'],
+                "autoRenew": 0,
+                "date": Bitfinex2Poloniex.convertTimestamp((credit['mts_opening'] or credit['mts_created']) / 1000.0)
+            })
+
+        return plxOffers
+
     @staticmethod
     def convertLoanOrders(bfxLendbook):
         '''
@@ -122,6 +171,34 @@ class Bitfinex2Poloniex(object):
 
         return balances
 
+    @staticmethod
+    def convertWsAccountBalances(bfxWallets, account=''):
+        '''
+        Converts from websocket wallets to 'returnAvailableAccountBalances'
+        '''
+        accountMap = {
+            'margin': 'margin',
+            'funding': 'lending',
+            'exchange': 'exchange'
+        }
+
+        if (account == ''):
+            balances = {'margin': {}, 'lending': {}, 'exchange': {}}
+        else:
+            balances = {account: {}}
+
+        for wallet_type in bfxWallets:
+            if wallet_type not in accountMap or (account != '' and accountMap[wallet_type] != account):
+                continue
+            for currency, wallet in bfxWallets[wallet_type].items():
+                currency = currency.upper()
+                if currency not in Bitfinex2Poloniex.all_currencies:
+                    continue
+                if float(wallet['balance']) > 0:
+                    balances[accountMap[wallet_type]][currency] = str(wallet['available'])
+
+        return balances
+
     @staticmethod
     def convertTicker(bfxTicker):
         '''
@@ -0,0 +1,116 @@
+"""
+Clock service the bot reads the time from and sleeps on. The real clock is used unless a simulation or a test
+sets an accelerated or manually stepped one with set_clock.
+"""
+
+import datetime
+import threading
+import time as _time
+
+
+class RealClock(object):
+    """
+    Wall time
+    """
+
+    def time(self):
+        return _time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _time.sleep(seconds)
+
+
+class AcceleratedClock(object):
+    """
+    Time running factor times faster than wall time, from start (Default: now)
+    """
+
+    def __init__(self, factor, start=None):
+        if factor <= 0:
+            raise ValueError("The factor of an accelerated clock must be positive, not {}".format(factor))
+        self.factor = float(factor)
+        self.origin = _time.time()
+        self.start = self.origin if start is None else float(start)
+
+    def time(self):
+        return self.start + (_time.time() - self.origin) * self.factor
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _time.sleep(seconds / self.factor)
+
+
+class ManualClock(object):
+    """
+    Time standing still until stepped with advance. Sleeping in the thread driving the clock, the one which
+    created it, advances it and returns at once, unless auto_advance is off. Sleeping in any other thread waits
+    until the clock has been advanced past the end of the sleep.
+    """
+
+    def __init__(self, start=None, auto_advance=True):
+        self.now = _time.time() if start is None else float(start)
+        self.auto_advance = auto_advance
+        self.driver = threading.current_thread()
+        self.condition = threading.Condition()
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        with self.condition:
+            self.now += seconds
+            self.condition.notify_all()
+
+    def set_time(self, now):
+        with self.condition:
+            self.now = max(self.now, float(now))
+            self.condition.notify_all()
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        if self.auto_advance and threading.current_thread() is self.driver:
+            self.advance(seconds)
+            return
+        with self.condition:
+            end = self.now + seconds
+            while self.now < end:
+                self.condition.wait()
+
+
+clock = RealClock()
+
+
+def set_clock(new_clock):
+    """
+    Sets the clock used by the bot, returns the previous one
+    """
+    global clock
+    previous = clock
+    clock = new_clock
+    return previous
+
+
+def get_clock():
+    return clock
+
+
+def time():
+    return clock.time()
+
+
+def sleep(seconds):
+    clock.sleep(seconds)
+
+
+def utcnow():
+    return datetime.datetime.utcfromtimestamp(clock.time())
+
+
+def now():
+    return datetime.datetime.fromtimestamp(clock.time())
+
+
+def today():
+    return datetime.date.fromtimestamp(clock.time())
@@ -202,6 +202,9 @@ def get_notification_config():
     notify_summary_minutes = get('notifications', 'notify_summary_minutes')
     notify_conf['notify_summary_minutes'] = 0 if notify_summary_minutes == 'False' else int(notify_summary_minutes)
 
+    notify_conf['notify_digest_seconds'] = float(get('notifications', 'notify_digest_seconds', 5, 0, 3600))
+    notify_conf['notify_queue_size'] = int(get('notifications', 'notify_queue_size', 100, 1, 10000))
+
     if notify_conf['email']:
         for conf in ['email_login_address', 'email_login_password', 'email_smtp_server', 'email_smtp_port',
                      'email_to_addresses', 'email_smtp_starttls']:
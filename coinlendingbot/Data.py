@@ -3,6 +3,9 @@ from decimal import Decimal
 from urllib.request import urlopen
 import json
 
+import coinlendingbot.Clock as Clock
+import coinlendingbot.Metrics as Metrics
+
 api = None
 log = None
 
@@ -26,7 +29,7 @@ def get_max_duration(end_date, context):
     if not end_date:
         return ""
     try:
-        now_time = datetime.date.today()
+        now_time = Clock.today()
         config_date = map(int, end_date.split(','))
         end_time = datetime.date(*config_date)  # format YEAR,MONTH,DAY all ints, also used splat operator
         diff_days = (end_time - now_time).days
@@ -57,6 +60,7 @@ def get_total_lent():
             crypto_lent_rate = item_rate_float * item_float
             total_lent[item["currency"]] = crypto_lent_sum
             rate_lent[item["currency"]] = crypto_lent_rate
+    Metrics.set_gauges('lent_amount', 'currency', {cur: float(amount) for cur, amount in total_lent.items()})
     return [total_lent, rate_lent]
 
 
@@ -64,7 +68,7 @@ def timestamp():
     '''
     Returns timestamp in UTC
     '''
-    return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    return Clock.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
 
 def stringify_total_lent(total_lent, rate_lent):
@@ -78,8 +82,11 @@ def stringify_total_lent(total_lent, rate_lent):
 
 
 def update_conversion_rates(output_currency, json_output_enabled):
-    if json_output_enabled:
+    if not json_output_enabled:
+        api.set_ticker_demand('conversion', [])
+    else:
         total_lent = get_lending_currencies()
+        api.set_ticker_demand('conversion', ['BTC_' + cur for cur in total_lent + [output_currency] if cur != 'BTC'])
         ticker_response = api.return_ticker()
         output_currency_found = False
         # Set this up now in case we get an exception later and don't have a currency to use
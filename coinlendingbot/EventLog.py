@@ -0,0 +1,155 @@
+"""
+The events of the bot shown in the log of the web page: offers, cancels, errors, rates too low to lend and plain
+messages. They are kept as records, indexed by currency and time, and rendered to text only when shown.
+"""
+
+import bisect
+import datetime
+import threading
+
+# event types
+LOG = 'log'
+ERROR = 'error'
+OFFER = 'offer'
+CANCEL = 'cancel'
+NOT_LENDING = 'not_lending'
+TYPES = (LOG, ERROR, OFFER, CANCEL, NOT_LENDING)
+
+
+class Event(object):
+    __slots__ = ('id', 'time', 'type', 'currency', 'amount', 'rate', 'min_rate', 'days', 'message', '_text')
+
+    def __init__(self, event_id, time, event_type, message='', currency=None, amount=None, rate=None,
+                 min_rate=None, days=None):
+        self.id = event_id
+        self.time = time
+        self.type = event_type
+        self.message = message
+        self.currency = currency
+        self.amount = amount
+        self.rate = rate
+        self.min_rate = min_rate
+        self.days = days
+        self._text = None
+
+    def text(self):
+        """
+        Returns the line of the log, rendered on the first call
+        """
+        if self._text is None:
+            timestamp = datetime.datetime.fromtimestamp(self.time).strftime('%Y-%m-%d %H:%M:%S')
+            if self.type == OFFER:
+                line = '{0} Placing {1} {2} at {3}% for {4} days... {5}'.format(
+                    timestamp, self.amount, self.currency, float(self.rate) * 100, self.days, self.message)
+            elif self.type == CANCEL:
+                line = '{0} Canceling {1} order... {2}'.format(timestamp, self.currency, self.message)
+            elif self.type == NOT_LENDING:
+                line = '{0} Not lending {1} due to rate below {2:.4f}% (actual: {3:.4f}%)'.format(
+                    timestamp, self.currency, self.min_rate * 100, self.rate * 100)
+            elif self.type == ERROR:
+                line = '{0} Error {1}'.format(timestamp, self.message)
+            else:
+                line = '{0} {1}'.format(timestamp, self.message)
+            self._text = line.replace("\n", ' | ')
+        return self._text
+
+    def to_dict(self):
+        result = {"id": self.id, "time": self.time, "type": self.type, "text": self.text()}
+        for key in ('currency', 'amount', 'rate', 'min_rate', 'days'):
+            value = getattr(self, key)
+            if value is not None:
+                result[key] = value if key == 'currency' else float(value)
+        if self.message:
+            result["message"] = self.message
+        return result
+
+
+class Index(object):
+    """
+    Events in the order they were added, with their ids and times for bisecting
+    """
+
+    def __init__(self):
+        self.events = []
+        self.ids = []
+        self.times = []
+
+    def append(self, event):
+        self.events.append(event)
+        self.ids.append(event.id)
+        self.times.append(event.time)
+
+    def drop_before(self, first_id):
+        start = bisect.bisect_left(self.ids, first_id)
+        del self.events[:start]
+        del self.ids[:start]
+        del self.times[:start]
+
+
+class EventLog(object):
+    """
+    Keeps the last size events. Dropping the oldest events is deferred until size more have come, so adding an event
+    costs O(1) on average.
+    """
+
+    def __init__(self, size):
+        self.size = int(size)
+        self.lock = threading.Lock()
+        self.all = Index()
+        self.currencies = {}
+        self.count = 0
+
+    def add(self, event_type, time, message='', currency=None, amount=None, rate=None, min_rate=None, days=None):
+        with self.lock:
+            self.count += 1
+            event = Event(self.count, time, event_type, message, currency, amount, rate, min_rate, days)
+            self.all.append(event)
+            if currency is not None:
+                self.currencies.setdefault(currency, Index()).append(event)
+            if len(self.all.events) >= 2 * self.size:
+                self._drop_old()
+            return event
+
+    def _first_id(self):
+        return self.count - self.size + 1
+
+    def _drop_old(self):
+        first_id = self._first_id()
+        self.all.drop_before(first_id)
+        for currency, index in list(self.currencies.items()):
+            index.drop_before(first_id)
+            if not index.events:
+                del self.currencies[currency]
+
+    def latest(self, count=None):
+        """
+        Returns the last count events, the oldest first
+        """
+        count = self.size if count is None else min(count, self.size)
+        with self.lock:
+            return self.all.events[len(self.all.events) - count:] if count > 0 else []
+
+    def query(self, currency=None, event_type=None, since=None, until=None, before=None, limit=50):
+        """
+        Returns up to limit events, the newest first, of currency and event_type with since <= time <= until and an
+        id below before. To page through the events, pass the id of the last event returned as before.
+        """
+        with self.lock:
+            index = self.all if currency is None else self.currencies.get(currency)
+            if index is None:
+                return []
+            start = bisect.bisect_left(index.ids, self._first_id())
+            if since is not None:
+                start = max(start, bisect.bisect_left(index.times, since))
+            end = len(index.events)
+            if before is not None:
+                end = min(end, bisect.bisect_left(index.ids, before))
+            if until is not None:
+                end = min(end, bisect.bisect_right(index.times, until))
+            result = []
+            for i in range(end - 1, start - 1, -1):
+                if event_type is None or index.events[i].type == event_type:
+                    result.append(index.events[i])
+                    if len(result) >= limit:
+                        break
+            return result
@@ -4,7 +4,17 @@ Exchange API Base class
 
 from abc import ABC, abstractmethod
 import calendar
+import http.client
+import socket
 import time
+import urllib.error
+from contextlib import contextmanager
+
+import requests
+
+import coinlendingbot.Clock as Clock
+import coinlendingbot.Metrics as Metrics
+from coinlendingbot import RequestTracker
 
 
 class ExchangeApi(ABC):
@@ -28,6 +38,20 @@ class ExchangeApi(ABC):
 
         return new_method
 
+    @staticmethod
+    def retried(method):
+        """ Retries an instance method requesting the endpoint given as first argument by self.retry_policy """
+
+        def new_method(self, endpoint, *arg, **kws):
+            return self.retry_policy.call(endpoint, method, self, endpoint, *arg, **kws)
+
+        return new_method
+
+    # endpoints changing the account, they aren't retried after failures leaving open whether they were executed
+    WRITE_ENDPOINTS = ()
+    # whether return_lending_history fetches the history of one currency at a time
+    LENDING_HISTORY_PER_CURRENCY = False
+
     def __init__(self, cfg, weblog):
         """
         Constructor
@@ -38,16 +62,56 @@ class ExchangeApi(ABC):
         self.apiSecret = self.cfg.get("API", "secret", None)
         self.all_currencies = self.cfg.get_all_currencies()
 
+    def create_request_tracker(self):
+        """
+        Returns a tracker of the requests against the limit of the request limiter, call after setting it up
+        """
+        limit = self.req_per_period * 1000.0 / self.default_req_period if self.default_req_period else 0
+        warning_level = float(self.cfg.get('API', 'rateLimitWarning', 80, 10, 100)) / 100
+        return RequestTracker.RequestTracker(limit, warning_level)
+
+    def create_retry_policy(self):
+        """
+        Returns the retry policy of the requests configured in [API]
+        """
+        from coinlendingbot.RetryPolicy import RetryPolicy
+        return RetryPolicy(retries=int(self.cfg.get('API', 'retries', 3, 0, 10)),
+                           delay=float(self.cfg.get('API', 'retryDelay', 1, 0.1, 60)),
+                           breaker_failures=int(self.cfg.get('API', 'circuitBreakerFailures', 5, 1, 100)),
+                           breaker_seconds=float(self.cfg.get('API', 'circuitBreakerSeconds', 60, 1, 3600)),
+                           write_endpoints=self.WRITE_ENDPOINTS)
+
+    @contextmanager
+    def track_request(self, endpoint):
+        """
+        Times a request to endpoint and attributes it to the caller set with RequestTracker.caller. Failures are
+        raised as the ApiError telling what went wrong, see classify_error.
+        """
+        caller = RequestTracker.get_caller()
+        self.request_tracker.record(endpoint, caller)
+        try:
+            with Metrics.api_call(endpoint, caller):
+                yield
+        except Exception as ex:
+            error = classify_error(ex)
+            if isinstance(error, RateLimitError):
+                self.request_tracker.record_rate_limited(caller)
+            if error is ex:
+                raise
+            raise error from ex
+
     @abstractmethod
     def limit_request_rate(self):
-        now = time.time() * 1000  # milliseconds
+        now = Clock.time() * 1000  # milliseconds
         # Start throttling only when the queue is full
         if len(self.req_time_log) == self.req_per_period:
             time_since_oldest_req = now - self.req_time_log[0]
             if time_since_oldest_req < self.req_period:
                 sleep = (self.req_period - time_since_oldest_req) / 1000
                 self.req_time_log.append(now + self.req_period - time_since_oldest_req)
-                time.sleep(sleep)
+                started = time.perf_counter()
+                Clock.sleep(sleep)
+                Metrics.limiter_wait(time.perf_counter() - started)
                 return
 
         self.req_time_log.append(now)
@@ -73,6 +137,12 @@ class ExchangeApi(ABC):
         Returns the ticker for all markets.
         """
 
+    def set_ticker_demand(self, consumer, couples):
+        """
+        Declares the couples (e.g. "BTC_ETH") a consumer reads from return_ticker(). Replaces the
+        consumer's previous demand. Exchanges streaming the ticker subscribe only demanded couples.
+        """
+
     @abstractmethod
     def return_balances(self):
         """
@@ -97,11 +167,12 @@ class ExchangeApi(ABC):
         """
 
     @abstractmethod
-    def return_lending_history(self, start, stop, limit=500):
+    def return_lending_history(self, start, stop, limit=500, currency=None):
         """
         Returns lending history within a time range specified by the "start" and
         "end" POST parameters as UNIX timestamps. "limit" may also be specified
-        to limit the number of rows returned. Sample output:
+        to limit the number of rows returned. With LENDING_HISTORY_PER_CURRENCY
+        "currency" limits it to one currency, otherwise it is ignored. Sample output:
 
         [{ "id": 175589553, "currency": "BTC", "rate": "0.00057400", "amount": "0.04374404",
          "duration": "0.47610000", "interest": "0.00001196",
@@ -158,4 +229,81 @@ class ExchangeApi(ABC):
 
 
 class ApiError(Exception):
+    def __init__(self, *args):
+        super(ApiError, self).__init__(*args)
+        self.message = str(args[0]) if args else ''
+
+
+class TransientApiError(ApiError):
+    """
+    A failure which can go away by itself, the request can be retried
+    """
+
+
+class ApiTimeoutError(TransientApiError):
+    pass
+
+
+class ConnectionFailedError(TransientApiError):
     pass
+
+
+class ServerError(TransientApiError):
+    """
+    The exchange answered with a 5xx status
+    """
+
+
+class RateLimitError(TransientApiError):
+    """
+    The exchange rejected the request for exceeding its request limit, an HTTP 429
+    """
+
+
+class AuthenticationError(ApiError):
+    """
+    The exchange rejected the API key, hint tells what to check
+    """
+
+    def __init__(self, message, hint):
+        super(AuthenticationError, self).__init__(message)
+        self.hint = hint
+
+
+class CircuitOpenError(ApiError):
+    """
+    The endpoint failed too often in a row, it isn't requested for a while
+    """
+
+
+AUTHENTICATION_HINTS = [
+    ('Invalid API key', "Are your API keys correct? No quotation. Just plain keys."),
+    ('Nonce must be greater', "Are you reusing the API key in multiple applications? "
+                              "Use a unique key for every application."),
+    ('Permission denied', "Are you using IP filter on the key?")
+]
+
+
+def classify_error(ex):
+    """
+    Returns the ApiError subclass matching an exception of a request, ex itself if none matches
+    """
+    if isinstance(ex, ApiError) and type(ex) is not ApiError:
+        return ex
+    message = str(getattr(ex, 'message', '') or ex)
+    response = getattr(ex, 'response', None)
+    status = getattr(ex, 'code', None) or getattr(response, 'status_code', None)
+    for text, hint in AUTHENTICATION_HINTS:
+        if text in message:
+            return AuthenticationError(message, hint)
+    if status == 429 or 'Error 429' in message:
+        return RateLimitError(message)
+    if isinstance(ex, (requests.Timeout, socket.timeout)) or 'timed out' in message:
+        return ApiTimeoutError(message)
+    if isinstance(status, int) and 500 <= status < 600:
+        return ServerError(message)
+    if isinstance(ex, urllib.error.HTTPError):
+        return ex
+    if isinstance(ex, (requests.ConnectionError, urllib.error.URLError, ConnectionError, http.client.BadStatusLine)):
+        return ConnectionFailedError(message)
+    return ex
@@ -0,0 +1,290 @@
+"""
+Simulated exchange running on a virtual clock, for fast dry runs and backtests
+"""
+
+import logging
+import os
+import sqlite3 as sqlite
+import threading
+from datetime import datetime
+
+import numpy
+
+import coinlendingbot.Clock as Clock
+from coinlendingbot.ExchangeApi import ExchangeApi
+from coinlendingbot.ExchangeApi import ApiError
+from coinlendingbot.RingBuffer import RingBuffer
+from coinlendingbot.fakeexchange.Market import Market, MarketError
+from coinlendingbot.fakeexchange.FakeRestServer import PoloniexHandler
+
+
+class MarketHistory(object):
+    """
+    Offer books recorded by MarketAnalysis, as arrays of times, rates and amounts per currency
+    """
+    # MarketAnalysis fills missing levels with this rate
+    MISSING_RATE = 5.0
+
+    def __init__(self, books):
+        self.books = books
+
+    @staticmethod
+    def load(db_dir, exchange, currencies):
+        books = {}
+        for cur in currencies:
+            db_path = os.path.join(db_dir, '{0}-{1}.db'.format(exchange, cur))
+            if not os.path.isfile(db_path):
+                continue
+            db_con = sqlite.connect(db_path)
+            columns = [row[1] for row in db_con.execute("PRAGMA table_info(loans)")]
+            levels = len([c for c in columns if c.startswith('rate')])
+            query = "SELECT unixtime, {0} FROM loans ORDER BY unixtime;".format(
+                ", ".join("rate{0}, amnt{0}".format(level) for level in range(levels)))
+            rows = numpy.array(db_con.execute(query).fetchall(), dtype=float)
+            db_con.close()
+            if len(rows):
+                books[cur] = (rows[:, 0], rows[:, 1::2], rows[:, 2::2])
+        return MarketHistory(books)
+
+    def save(self, directory):
+        """
+        Saves the books as .npy arrays, which processes can share memory mapped with load_arrays
+        """
+        for cur, (times, rates, amounts) in self.books.items():
+            for name, array in [('times', times), ('rates', rates), ('amounts', amounts)]:
+                numpy.save(os.path.join(directory, '{0}-{1}.npy'.format(cur, name)), numpy.ascontiguousarray(array))
+
+    @staticmethod
+    def load_arrays(directory, currencies, mmap_mode='r'):
+        books = {}
+        for cur in currencies:
+            if os.path.isfile(os.path.join(directory, '{0}-times.npy'.format(cur))):
+                books[cur] = tuple(numpy.load(os.path.join(directory, '{0}-{1}.npy'.format(cur, name)),
+                                              mmap_mode=mmap_mode) for name in ['times', 'rates', 'amounts'])
+        return MarketHistory(books)
+
+    def start_time(self):
+        return min(times[0] for times, rates, amounts in self.books.values())
+
+    def end_time(self):
+        return max(times[-1] for times, rates, amounts in self.books.values())
+
+    def levels(self, cur, now):
+        """
+        Returns the recorded offers [(rate, amount), ...] at now
+        """
+        if cur not in self.books:
+            return []
+        times, rates, amounts = self.books[cur]
+        index = numpy.searchsorted(times, now, side='right') - 1
+        if index < 0:
+            return []
+        return [(rate, amount) for rate, amount in zip(rates[index].tolist(), amounts[index].tolist())
+                if rate != MarketHistory.MISSING_RATE]
+
+    def max_rate(self, cur, since, now):
+        """
+        Returns the highest best offer rate recorded after since up to now, None without a record.
+        Offers below it have been taken by borrowers.
+        """
+        if cur not in self.books:
+            return None
+        times, rates, amounts = self.books[cur]
+        first = max(numpy.searchsorted(times, since, side='right') - 1, 0)
+        last = numpy.searchsorted(times, now, side='right')
+        best_rates = rates[first:last, 0]
+        best_rates = best_rates[best_rates != MarketHistory.MISSING_RATE]
+        if len(best_rates) == 0:
+            return None
+        return float(best_rates.max())
+
+    def first_rate_above(self, cur, since, now, rate):
+        """
+        Returns the first time after since up to now an offer at rate placed at since was taken, None if it wasn't.
+        It's taken once the best offer rate rose above it, an offer undercutting the best one is taken together with
+        the best one: once the best rate rose above the one at since.
+        """
+        if cur not in self.books:
+            return None
+        times, rates, amounts = self.books[cur]
+        first = numpy.searchsorted(times, since, side='right')
+        last = numpy.searchsorted(times, now, side='right')
+        if first > 0 and rates[first - 1, 0] != MarketHistory.MISSING_RATE:
+            rate = max(rate, rates[first - 1, 0])
+        best_rates = rates[first:last, 0]
+        above = numpy.flatnonzero((best_rates > rate) & (best_rates != MarketHistory.MISSING_RATE))
+        if len(above) == 0:
+            return None
+        return float(times[first + above[0]])
+
+
+class ReplayMarket(Market):
+    """
+    Market showing the recorded offer books, own offers fill once the recorded best offer rate rose above them
+    """
+
+    def __init__(self, history, currencies, **kwargs):
+        self.recording = history
+        super(ReplayMarket, self).__init__(currencies, **kwargs)
+
+    def _refresh_book(self, currency):
+        self.books[currency]["offers"] = {
+            (rate, 2): {"rate": rate, "amount": amount, "duration": 2}
+            for rate, amount in self.recording.levels(currency, self.clock())}
+        self.books[currency]["demands"] = {}
+
+    def step(self):
+        with self.lock:
+            now = self.clock()
+            since = self.last_step
+            self.last_step = now
+            for cur in self.currencies:
+                self._refresh_book(cur)
+                top_rate = self.recording.max_rate(cur, since, now)
+                if top_rate is None:
+                    continue
+                for offer_id, offer in list(self.offers.items()):
+                    if offer["currency"] == cur and offer["rate"] < top_rate:
+                        self._fill(offer_id, offer["amount"])
+            self._return_loans(now)
+
+
+class ExchangeSimulator(ExchangeApi):
+    """
+    In-process exchange matching the own offers against synthetic demand or the recorded books of
+    MarketAnalysis. Loans accrue interest and return after their duration on a simulated clock, which
+    it sets as the clock of the bot, so a month of rounds runs in seconds. Answers like Poloniex.
+    """
+
+    def __init__(self, cfg, weblog):
+        # no API keys needed, so the base constructor isn't used
+        self.cfg = cfg
+        self.weblog = weblog
+        self.all_currencies = self.cfg.get_all_currencies()
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.RLock()
+        self.req_per_period = 1
+        self.default_req_period = 0
+        self.req_period = self.default_req_period
+        self.req_time_log = RingBuffer(self.req_per_period)
+        self.request_tracker = self.create_request_tracker()
+        demand = self.cfg.get('SIMULATOR', 'demand', 'synthetic').lower()
+        days = float(self.cfg.get('SIMULATOR', 'days', 30, 1, 3650))
+        seed = int(self.cfg.get('SIMULATOR', 'seed', 0)) or None
+        balance = float(self.cfg.get('SIMULATOR', 'balance', 10000, 0))
+        speed = float(self.cfg.get('SIMULATOR', 'speed', 0, 0, 1000000))
+        if demand == 'replay':
+            db_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'market_data')
+            history = MarketHistory.load(self.cfg.get('SIMULATOR', 'marketData', db_dir),
+                                         self.cfg.get_exchange(), self.all_currencies)
+            if not history.books:
+                raise ApiError("No recorded market data found to replay, run MarketAnalysis first")
+            self.clock = self.create_clock(speed, history.start_time())
+            self.end_time = min(self.clock.time() + days * 86400, history.end_time())
+            self.market = ReplayMarket(history, self.all_currencies, seed=seed, clock=self.clock.time,
+                                       balance_usd=balance)
+        elif demand == 'synthetic':
+            self.clock = self.create_clock(speed)
+            self.end_time = self.clock.time() + days * 86400
+            self.market = Market(self.all_currencies, seed=seed, clock=self.clock.time, balance_usd=balance)
+        else:
+            raise ApiError("Invalid [SIMULATOR] demand: {}, use synthetic or replay".format(demand))
+        self.handler = PoloniexHandler(self.market)
+        # the bot, its plugins and the exchange all live on the simulated time
+        Clock.set_clock(self.clock)
+        self.start_time = self.clock.time()
+        days = (self.end_time - self.start_time) / 86400
+        self.logger.info("Simulating {:.1f} days of {} demand".format(days, demand))
+
+    @staticmethod
+    def create_clock(speed, start=None):
+        """
+        Returns a clock running speed times faster than wall time, a stepped one sleeping returns at once for 0
+        """
+        if speed:
+            return Clock.AcceleratedClock(speed, start)
+        return Clock.ManualClock(start)
+
+    def limit_request_rate(self):
+        pass
+
+    def increase_request_timer(self):
+        pass
+
+    def decrease_request_timer(self):
+        pass
+
+    def reset_request_timer(self):
+        pass
+
+    @ExchangeApi.synchronized
+    def _query(self, command, params=None):
+        params = dict(params or {}, command=command)
+        with self.track_request(command):
+            self.market.step()
+            try:
+                if command in ['returnTicker', 'returnLoanOrders']:
+                    return self.handler.public(params)
+                return self.handler.trading(params)
+            except MarketError as ex:
+                raise ApiError("{} Requesting {}".format(ex, command))
+
+    def is_finished(self):
+        return self.clock.time() >= self.end_time
+
+    def summary(self):
+        """
+        Returns a text summarizing the interest earned and the current balances
+        """
+        history = self.market.lending_history(self.start_time, self.clock.time(), limit=None)
+        days = (self.clock.time() - self.start_time) / 86400
+        lines = ["Simulated {:.1f} days, {} loans returned".format(days, len(history))]
+        for cur in self.all_currencies:
+            earned = sum(h["earned"] for h in history if h["currency"] == cur)
+            lent = sum(h["amount"] * h["duration"] for h in history if h["currency"] == cur)
+            total = self.market.total_balances("lending")[cur]
+            lines.append("{}: earned {:.8f}, average daily rate {:.4f}%, lending balance {:.8f}".format(
+                cur, earned, earned / lent * 100 if lent else 0, total))
+        return "\n".join(lines)
+
+    def return_ticker(self):
+        return self._query('returnTicker')
+
+    def return_balances(self):
+        return self._query('returnBalances')
+
+    def return_available_account_balances(self, account):
+        balances = self._query('returnAvailableAccountBalances', {"account": account})
+        if isinstance(balances, list):
+            balances = {}
+        # the bot reads the account without checking, an account lent out completely stays in the answer
+        balances.setdefault(account, {})
+        return balances
+
+    def return_lending_history(self, start, stop, limit=500, currency=None):
+        return self._query('returnLendingHistory', {'start': start, 'end': stop, 'limit': limit})
+
+    def return_loan_orders(self, currency, limit=0):
+        loan_orders = self._query('returnLoanOrders', {"currency": currency, "limit": limit})
+        loan_orders["update_time"] = datetime.utcfromtimestamp(self.clock.time())
+        return loan_orders
+
+    def return_open_loan_offers(self):
+        loan_offers = self._query('returnOpenLoanOffers')
+        if isinstance(loan_offers, list):
+            loan_offers = {}
+        return loan_offers
+
+    def return_active_loans(self):
+        return self._query('returnActiveLoans')
+
+    def cancel_loan_offer(self, currency, order_number):
+        return self._query('cancelLoanOffer', {"currency": currency, "orderNumber": order_number})
+
+    def create_loan_offer(self, currency, amount, duration, auto_renew, lending_rate):
+        return self._query('createLoanOffer', {"currency": currency, "amount": amount, "duration": duration,
+                                               "autoRenew": auto_renew, "lendingRate": lending_rate})
+
+    def transfer_balance(self, currency, amount, from_account, to_account):
+        return self._query('transferBalance', {'currency': currency, 'amount': amount, 'fromAccount': from_account,
+                                               'toAccount': to_account})
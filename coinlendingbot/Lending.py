@@ -1,9 +1,12 @@
 from decimal import Decimal
 import logging
 import sched
-import time
 import threading
 
+import coinlendingbot.Clock as Clock
+import coinlendingbot.Metrics as Metrics
+from coinlendingbot import RequestTracker
+
 logger = None
 
 Config = None
@@ -96,7 +99,7 @@ def init(cfg, api1, log1, data, maxtolend, dry_run1, analysis, notify_conf1):
     sleep_time = sleep_time_active  # Start with active mode
 
     # create the scheduler thread
-    scheduler = sched.scheduler(time.time, time.sleep)
+    scheduler = sched.scheduler(Clock.time, Clock.sleep)
     if notify_conf['notify_summary_minutes']:
         # Wait 10 seconds before firing the first summary notifcation, then use the config time value for future updates
         scheduler.enter(10, 1, notify_summary, (notify_conf['notify_summary_minutes'] * 60, ))
@@ -120,6 +123,7 @@ def set_sleep_time(usable):
 
 
 def notify_summary(sleep_time):
+    RequestTracker.set_caller('notifications')
     try:
         log.notify(Data.stringify_total_lent(*Data.get_total_lent()), notify_conf)
     except Exception as ex:
@@ -130,6 +134,7 @@ def notify_summary(sleep_time):
 
 def notify_new_loans(sleep_time):
     global loans_provided
+    RequestTracker.set_caller('notifications')
     try:
         new_provided = api.return_active_loans()['provided']
         if loans_provided:
@@ -189,6 +194,7 @@ def create_lend_offer(currency, amt, rate):
             days = str(days_remaining)
     if not dry_run:
         msg = api.create_loan_offer(currency, amt, days, 0, rate)
+        Metrics.increment('offers_placed_total', currency=currency)
         if days == xdays and notify_conf['notify_xday_threshold']:
             text = "{0} {1} loan placed for {2} days at a rate of {3:.4f}%".format(amt, currency, days, rate * 100)
             log.notify(text, notify_conf)
@@ -214,14 +220,16 @@ def cancel_all():
         else:
             cur_sum = float(get_min_loan_size(CUR)) + 1
         if cur_sum >= float(get_min_loan_size(CUR)):
-            for offer in loan_offers[CUR]:
-                if not dry_run:
-                    try:
-                        msg = api.cancel_loan_offer(CUR, offer['id'])
-                        log.cancelOrder(CUR, msg)
-                    except Exception as ex:
-                        ex.message = ex.message if ex.message else str(ex)
-                        log.log("Error canceling loan offer: {0}".format(ex.message))
+            with Metrics.span('currency', phase='cancel', currency=CUR):
+                for offer in loan_offers[CUR]:
+                    if not dry_run:
+                        try:
+                            msg = api.cancel_loan_offer(CUR, offer['id'])
+                            Metrics.increment('offers_cancelled_total', currency=CUR)
+                            log.cancelOrder(CUR, msg)
+                        except Exception as ex:
+                            ex.message = ex.message if ex.message else str(ex)
+                            log.log("Error canceling loan offer: {0}".format(ex.message))
         else:
             logger.info("Not enough " + CUR + " to lend if bot canceled open orders. Not cancelling.")
 
@@ -240,17 +248,14 @@ def lend_all():
             MaxToLend.amount_to_lend(total_lent[cur], cur, 0, 0)
     usable_currencies = 0
     global sleep_time  # We need global var to edit sleeptime
-    if gap_mode_default == "rawbtc":
-        ticker = api.return_ticker()  # Only call ticker once for all orders
-    else:
-        ticker = False
-        for cur1 in coin_cfg:
-            if "rawbtc" in cur1:
-                ticker = api.return_ticker()
-            break
+    # Only the coins lent in rawbtc gap mode need the ticker, call it once for all orders
+    rawbtc_currencies = [cur for cur in lending_balances if cur != 'BTC' and get_gap_mode(cur) == "rawbtc"]
+    api.set_ticker_demand('lending', ['BTC_' + cur for cur in rawbtc_currencies])
+    ticker = api.return_ticker() if rawbtc_currencies else False
     try:
         for cur in lending_balances:
-            usable_currencies += lend_cur(cur, total_lent, lending_balances, ticker)
+            with Metrics.span('currency', phase='lend', currency=cur):
+                usable_currencies += lend_cur(cur, total_lent, lending_balances, ticker)
     except StopIteration:  # Restart lending if we stop to raise the request limit.
         lend_all()
     set_sleep_time(usable_currencies)
@@ -309,6 +314,8 @@ def get_gap_rate(active_cur, gap, order_book, cur_total_balance, raw=False):
             return max_daily_rate
         gap_sum += float(order_book['volumes'][i])
         i += 1
+    if i == len(order_book['rates']):  # The last offer filled the gap, there is no rate above it
+        return max_daily_rate
     return Decimal(order_book['rates'][i])
 
 
@@ -353,6 +360,14 @@ def construct_orders(cur, cur_active_bal, cur_total_balance, ticker):
     return {'amounts': new_order_amounts, 'rates': new_order_rates}
 
 
+def get_gap_mode(cur):
+    if cur in coin_cfg:
+        cfg = coin_cfg[cur]
+        if cfg.get('gapmode', False) and cfg.get('gapbottom', False) and cfg.get('gaptop', False):
+            return cfg['gapmode']
+    return gap_mode_default
+
+
 def get_gap_mode_rates(cur, cur_active_bal, cur_total_balance, ticker):
     global gap_mode_default, gap_bottom_default, gap_top_default  # To be able to change them later if needed.
     gap_mode, gap_bottom, gap_top = gap_mode_default, gap_bottom_default, gap_top_default
@@ -1,36 +1,185 @@
 # coding=utf-8
 import datetime
-import io
+import hashlib
 import json
-import time
+import logging
+import os
+import tempfile
+import threading
 
+import coinlendingbot.Clock as Clock
 import coinlendingbot.Configuration as Config
-from coinlendingbot.RingBuffer import RingBuffer
-from coinlendingbot.Notify import send_notification
+import coinlendingbot.EventLog as EventLog
+import coinlendingbot.Notify as Notify
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFileWriter(object):
+    """
+    Writes the latest body passed to write in a thread of its own, so the disk never holds up the bot. A body with
+    the hash of the last written one is skipped. The file is replaced by renaming a temporary file over it, so
+    readers never see it half written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = None
+        self.writing = False
+        self.writtenHash = None
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def write(self, body):
+        with self.condition:
+            self.pending = body
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='JsonFileWriter')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                body = self.pending
+                self.pending = None
+                self.writing = True
+            try:
+                digest = hashlib.sha1(body).digest()
+                if digest != self.writtenHash:
+                    self.replace(body)
+                    self.writtenHash = digest
+            except (IOError, OSError) as ex:
+                logger.error("Failed to write {0}: {1}".format(self.path, ex))
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def replace(self, body):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self.path), dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            # mkstemp creates it readable by the owner only
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def flush(self, timeout=10):
+        """
+        Waits up to timeout seconds for the pending body to be written
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending is None and not self.writing, timeout)
 
 
 class JsonOutput(object):
+    """
+    The status of the bot. publish serializes it once per change into a snapshot for the /api/status endpoint of the
+    web server, passes the changes to the listeners, and writes it to file if one is configured, at most every
+    jsonfileinterval seconds.
+    """
+
     def __init__(self, file, logLimit, exchange=''):
         self.jsonOutputFile = file
+        self.fileWriter = JsonFileWriter(file) if file else None
+        self.fileInterval = float(Config.get('BOT', 'jsonfileinterval', 0, 0, 86400))
+        self.lastFileWrite = None
+        self.snapshotLock = threading.Lock()
+        self.version = 0
+        self.body = b'{}'
+        self.listeners = []
+        self.publishedLogCount = 0
+        self.publishedParts = {}
+        self.publishedCoins = {}
         self.jsonOutput = {}
         self.clearStatusValues()
-        self.jsonOutputLog = RingBuffer(logLimit)
+        self.events = EventLog.EventLog(logLimit)
+        self.lastUpdate = None
+        self.daysRemainingMsg = ''
         self.jsonOutput['exchange'] = exchange
         self.jsonOutput['label'] = Config.get("BOT", "label", "Lending Bot")
 
     def status(self, status, time, days_remaining_msg):
-        self.jsonOutput["last_update"] = time + days_remaining_msg
+        # the time is formatted when published
+        self.lastUpdate = time
+        self.daysRemainingMsg = days_remaining_msg
         self.jsonOutput["last_status"] = status
 
     def printline(self, line):
-        line = line.replace("\n", ' | ')
-        self.jsonOutputLog.append(line)
+        self.events.add(EventLog.LOG, Clock.time(), line)
+
+    def subscribe(self, listener):
+        """
+        Calls listener(version, delta) on every change of the published status, see delta
+        """
+        self.listeners.append(listener)
+
+    def publish(self):
+        if self.lastUpdate is not None:
+            self.jsonOutput["last_update"] = datetime.datetime.fromtimestamp(self.lastUpdate).strftime(
+                '%Y-%m-%d %H:%M:%S') + self.daysRemainingMsg
+        self.jsonOutput["log"] = [event.text() for event in self.events.latest()]
+        body = json.dumps(self.jsonOutput, ensure_ascii=True).encode('ascii')
+        with self.snapshotLock:
+            changed = body != self.body
+            if changed:
+                self.version += 1
+                self.body = body
+            version = self.version
+        if changed and self.listeners:
+            delta = self.delta(version)
+            for listener in self.listeners:
+                listener(version, delta)
+        if self.fileWriter:
+            now = Clock.time()
+            if self.lastFileWrite is None or now - self.lastFileWrite >= self.fileInterval:
+                self.lastFileWrite = now
+                self.fileWriter.write(body)
 
-    def writeJsonFile(self):
-        with io.open(self.jsonOutputFile, 'w', encoding='utf-8') as f:
-            self.jsonOutput["log"] = self.jsonOutputLog.get()
-            f.write(json.dumps(self.jsonOutput, ensure_ascii=True, sort_keys=True))
-            f.close()
+    def delta(self, version):
+        """
+        Returns the changes to the status since the last published version: the new log lines, the values replaced
+        in "set", the coins changed in "coins" and the coins gone in "removedCoins"
+        """
+        log = self.jsonOutput["log"]
+        count = self.events.count
+        new_lines = min(count - self.publishedLogCount, len(log))
+        self.publishedLogCount = count
+        parts = {}
+        for key, value in self.jsonOutput.items():
+            if key not in ("log", "raw_data"):
+                parts[key] = json.dumps(value, ensure_ascii=True)
+        coins = {coin: json.dumps(values, ensure_ascii=True) for coin, values in self.jsonOutputCoins.items()}
+        delta = {"version": version,
+                 "log": log[len(log) - new_lines:] if new_lines else [],
+                 "logLimit": self.events.size,
+                 "set": {key: self.jsonOutput[key] for key, part in parts.items()
+                         if self.publishedParts.get(key) != part},
+                 "coins": {coin: self.jsonOutputCoins[coin] for coin, part in coins.items()
+                           if self.publishedCoins.get(coin) != part},
+                 "removedCoins": [coin for coin in self.publishedCoins if coin not in coins]}
+        self.publishedParts = parts
+        self.publishedCoins = coins
+        return delta
+
+    def snapshot(self):
+        """
+        Returns the version of the status, counting its changes, and the status as JSON bytes
+        """
+        with self.snapshotLock:
+            return self.version, self.body
+
+    def close(self):
+        if self.fileWriter:
+            self.fileWriter.flush()
 
     def addSectionLog(self, section, key, value):
         if section not in self.jsonOutput:
@@ -65,30 +214,26 @@ class Logger(object):
 
     @staticmethod
     def timestamp():
-        ts = time.time()
+        ts = Clock.time()
         return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
 
     def log(self, msg):
-        log_message = "{0} {1}".format(self.timestamp(), msg)
-        self.output.printline(log_message)
+        self.output.events.add(EventLog.LOG, Clock.time(), msg)
         self.refreshStatus()
 
     def log_error(self, msg):
-        log_message = "{0} Error {1}".format(self.timestamp(), msg)
-        self.output.printline(log_message)
+        self.output.events.add(EventLog.ERROR, Clock.time(), msg)
         self.refreshStatus()
 
     def offer(self, amt, cur, rate, days, msg):
-        line = self.timestamp() + ' Placing ' + str(amt) + ' ' + str(cur) + ' at ' + str(
-            float(rate) * 100) + '% for ' + days + ' days... ' + self.digestApiMsg(msg)
-        self.output.printline(line)
+        self.output.events.add(EventLog.OFFER, Clock.time(), self.digestApiMsg(msg), str(cur), amount=amt, rate=rate,
+                               days=days)
         if self.compactLog:
             self.output.statusValue(cur, 'log', '')
         self.refreshStatus()
 
     def cancelOrder(self, cur, msg):
-        line = self.timestamp() + ' Canceling ' + str(cur) + ' order... ' + self.digestApiMsg(msg)
-        self.output.printline(line)
+        self.output.events.add(EventLog.CANCEL, Clock.time(), self.digestApiMsg(msg), str(cur))
         self.refreshStatus()
 
     def notLending(self, cur, minRate, actRate):
@@ -97,8 +242,7 @@ class Logger(object):
                                     '{:s} Not lending due to rate below {:.4f}% (actual: {:.4f}%)'
                                     .format(self.timestamp(), (minRate * 100), (actRate * 100)))
         else:
-            self.log('Not lending {:s} due to rate below {:.4f}% (actual: {:.4f}%)'
-                     .format(cur, (minRate * 100), (actRate * 100)))
+            self.output.events.add(EventLog.NOT_LENDING, Clock.time(), currency=cur, rate=actRate, min_rate=minRate)
 
         self.refreshStatus()
 
@@ -107,7 +251,7 @@ class Logger(object):
             self._lent = lent
         if days_remaining != '':
             self._daysRemaining = days_remaining
-        self.output.status(self._lent, self.timestamp(), self._daysRemaining)
+        self.output.status(self._lent, Clock.time(), self._daysRemaining)
 
     def addSectionLog(self, section, key, value):
         self.output.addSectionLog(section, key, value)
@@ -119,9 +263,16 @@ class Logger(object):
         self.output.outputCurrency(key, value)
 
     def persistStatus(self):
-        self.output.writeJsonFile()
+        self.output.publish()
         self.output.clearStatusValues()
 
+    def close(self):
+        """
+        Waits for the status file to be written and the notifications to be sent
+        """
+        self.output.close()
+        Notify.flush()
+
     @staticmethod
     def digestApiMsg(msg):
         m = ""
@@ -138,4 +289,4 @@ class Logger(object):
     @staticmethod
     def notify(msg, notify_conf):
         if notify_conf['enable_notifications']:
-            send_notification(msg, notify_conf)
+            Notify.dispatch(msg, notify_conf)
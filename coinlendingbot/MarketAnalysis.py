@@ -1,16 +1,17 @@
 import logging
 import os
 import threading
-import time
 import traceback
 from datetime import datetime
 import pandas as pd
-import sqlite3 as sqlite
 from sqlite3 import Error
 import numpy
 
-from coinlendingbot.ExchangeApi import ApiError
+from coinlendingbot.ExchangeApi import RateLimitError
+import coinlendingbot.Clock as Clock
 import coinlendingbot.Configuration as Config
+import coinlendingbot.Storage as Storage
+from coinlendingbot import RequestTracker
 from coinlendingbot.Data import truncate
 
 # Improvements
@@ -83,7 +84,6 @@ class MarketAnalysis(object):
         for cur in self.currencies_to_analyse:
             db_con = self.create_connection(cur)
             self.create_rate_table(db_con, self.recorded_levels)
-            db_con.close()
         self.run_threads()
         self.run_del_threads()
 
@@ -119,7 +119,7 @@ class MarketAnalysis(object):
                 ex.message = ex.message if ex.message else str(ex)
                 self.logger.error("Error in MarketAnalysis: {0}\n".format(ex.message)
                                   + traceback.format_exc())
-            time.sleep(self.delete_thread_sleep)
+            Clock.sleep(self.delete_thread_sleep)
 
     def update_market_thread(self, cur, levels=None):
         """
@@ -131,6 +131,7 @@ class MarketAnalysis(object):
         """
         if levels is None:
             levels = self.recorded_levels
+        RequestTracker.set_caller('analysis')
         db_con = self.create_connection(cur)
         update_time = datetime.utcfromtimestamp(0)
         while True:
@@ -150,16 +151,16 @@ class MarketAnalysis(object):
                     market_data.append('0')  # Percentile field not being filled yet.
                     self.insert_into_db(db_con, market_data)
 
-            except ApiError as ex:
-                if '429' in str(ex):
-                    self.logger.warning("Caught ERR_RATE_LIMIT, sleeping capture and increasing request delay. " +
-                                        "Current {0}ms".format(self.api.req_period))
-                    time.sleep(130)
+            except RateLimitError:
+                # the retries didn't get through, the exchange banned the IP for a while
+                self.logger.warning("Caught ERR_RATE_LIMIT, sleeping capture and increasing request delay. " +
+                                    "Current {0}ms".format(self.api.req_period))
+                Clock.sleep(130)
             except Exception as ex:
                 self.logger.error("Error in returning data from exchange: {} : {}".format(ex, raw_data))
                 self.logger.debug(traceback.format_exc())
 
-            time.sleep(0.5)
+            Clock.sleep(0.5)
 
     def insert_into_db(self, db_con, market_data, levels=None):
             if levels is None:
@@ -168,11 +169,10 @@ class MarketAnalysis(object):
             for level in range(levels):
                 insert_sql += "rate{0}, amnt{0}, ".format(level)
             insert_sql += "percentile) VALUES ({0});".format(','.join(market_data))  # percentile = 0
-            with db_con:
-                try:
-                    db_con.execute(insert_sql)
-                except Exception as ex:
-                    self.logger.error("Error inserting market data into DB: {}".format(ex))
+            try:
+                db_con.execute(insert_sql)
+            except Exception as ex:
+                self.logger.error("Error inserting market data into DB: {}".format(ex))
 
     def delete_old_data(self, db_con, seconds):
         """
@@ -182,11 +182,9 @@ class MarketAnalysis(object):
         :param cur: The currency (database) to remove data from
         :param seconds: The time in seconds of the oldest data to be kept
         """
-        del_time = int(time.time()) - seconds
-        with db_con:
-            query = "DELETE FROM loans WHERE unixtime < {0};".format(del_time)
-            cursor = db_con.cursor()
-            cursor.execute(query)
+        del_time = int(Clock.time()) - seconds
+        query = "DELETE FROM loans WHERE unixtime < {0};".format(del_time)
+        db_con.execute(query)
 
     @staticmethod
     def get_day_difference(date_time):  # Will be a number of seconds since epoch
@@ -197,7 +195,7 @@ class MarketAnalysis(object):
         :return: The number of days that have elapsed since date_time
         """
         date1 = datetime.fromtimestamp(float(date_time))
-        now = datetime.utcnow()
+        now = Clock.utcnow()
         diff_days = (now - date1).days
         return diff_days
 
@@ -213,7 +211,7 @@ class MarketAnalysis(object):
         # Request more data from the DB than we need to allow for skipped seconds
         request_seconds = int(seconds * 1.1)
         full_list = Config.get_all_currencies()
-        if isinstance(cur, sqlite.Connection):
+        if isinstance(cur, Storage.Database):
             db_con = cur
         else:
             if cur not in full_list:
@@ -223,7 +221,7 @@ class MarketAnalysis(object):
             db_con = self.create_connection(cur)
 
         price_levels = ['rate0']
-        rates = self.get_rates_from_db(db_con, from_date=time.time() - request_seconds, price_levels=price_levels)
+        rates = self.get_rates_from_db(db_con, from_date=Clock.time() - request_seconds, price_levels=price_levels)
         if len(rates) == 0:
             return []
 
@@ -300,6 +298,35 @@ class MarketAnalysis(object):
             self.logger.error("{}\n{}\n{}".format(error_msg, ex, traceback.format_exc()))
             return 0
 
+    def get_rate_suggestions(self, times, rates, method='percentile'):
+        """
+        Vectorized get_rate_suggestion for backtests, calculates the suggestion for every second of a recording at
+        once from the rates recorded before it.
+
+        :param times: The recorded unix times, ascending
+        :param rates: The recorded best rates (rate0)
+        :param method: The method by which you want to calculate the suggestions.
+
+        :return: A pandas Series of the suggested rates indexed by the resampled times
+        """
+        df = pd.DataFrame({'time': pd.to_datetime(numpy.asarray(times), unit='s'), 'rate0': numpy.asarray(rates)})
+        # Resample into 1 second intervals like get_rate_list, so windows of n seconds are n values long
+        rate0 = df.resample('1s', on='time').rate0.mean().ffill()
+        window = int(self.get_analysis_seconds(method) * 1.1)
+        percentile = rate0.rolling(window, min_periods=1).quantile(self.lending_style / 100.0)
+        suggestions = numpy.trunc(percentile.values * 1e6) / 1e6
+        if method == 'MACD':
+            short_rate = rate0.rolling(self.MACD_short_win_seconds, min_periods=1).mean().values
+            long_rate = rate0.rolling(self.MACD_long_win_seconds, min_periods=1).mean().values
+            last_rate = rate0.values
+            macd_rate = numpy.where(short_rate > long_rate, numpy.where(last_rate < short_rate, short_rate, last_rate),
+                                    long_rate) * self.daily_min_multiplier
+            # Falls back to the percentile while there isn't enough data, like get_MACD_rate
+            records = rate0.rolling(window, min_periods=1).count().values
+            enough = records >= self.get_analysis_seconds('MACD') * (self.data_tolerance / 100)
+            suggestions = numpy.where(enough, numpy.trunc(macd_rate * 1e6) / 1e6, suggestions)
+        return pd.Series(suggestions, index=rate0.index)
+
     @staticmethod
     def percentile(N, percent, key=lambda x: x):
         """
@@ -367,19 +394,18 @@ class MarketAnalysis(object):
 
     def create_connection(self, cur, db_path=None, db_type='sqlite3'):
         """
-        Create a connection to the sqlite DB. This will create a new file if one doesn't exist.  We can use :memory:
-        here for db_path if we don't want to store the data on disk
+        Get the shared connection to the sqlite DB, see Storage. This will create a new file if one doesn't exist.
+        We can use :memory: here for db_path if we don't want to store the data on disk
 
         :param cur: The currency (database) in the DB
         :param db_path: DB directory
-        :return: Connection object or None
+        :return: Storage.Database object or None
         """
         if db_path is None:
             prefix = Config.get_exchange()
             db_path = os.path.join(self.db_dir, '{0}-{1}.db'.format(prefix, cur))
         try:
-            con = sqlite.connect(db_path)
-            return con
+            return Storage.open_db(db_path, 'market_analysis')
         except Error as ex:
             self.logger.error(ex.message)
 
@@ -391,16 +417,13 @@ class MarketAnalysis(object):
         :param cur: The currency being stored in the DB. There's a table for each currency.
         :param levels: The depth of offered rates to store
         """
-        with db_con:
-            cursor = db_con.cursor()
-            create_table_sql = "CREATE TABLE IF NOT EXISTS loans (id INTEGER PRIMARY KEY AUTOINCREMENT," + \
-                               "unixtime integer(4) not null default (strftime('%s','now')),"
-            for level in range(levels):
-                create_table_sql += "rate{0} FLOAT, ".format(level)
-                create_table_sql += "amnt{0} FLOAT, ".format(level)
-            create_table_sql += "percentile FLOAT);"
-            cursor.execute("PRAGMA journal_mode=wal")
-            cursor.execute(create_table_sql)
+        create_table_sql = "CREATE TABLE IF NOT EXISTS loans (id INTEGER PRIMARY KEY AUTOINCREMENT," + \
+                           "unixtime integer(4) not null default (strftime('%s','now')),"
+        for level in range(levels):
+            create_table_sql += "rate{0} FLOAT, ".format(level)
+            create_table_sql += "amnt{0} FLOAT, ".format(level)
+        create_table_sql += "percentile FLOAT);"
+        db_con.execute(create_table_sql)
 
     def get_rates_from_db(self, db_con, from_date=None, price_levels=['rate0']):
         """
@@ -411,11 +434,8 @@ class MarketAnalysis(object):
         :param from_date: The earliest data you want, specified in unix time (seconds since epoch)
         :price_level: We record multiple price levels in the DB, the best offer being rate0
         """
-        with db_con:
-            cursor = db_con.cursor()
-            query = "SELECT unixtime, {0} FROM loans ".format(",".join(price_levels))
-            if from_date is not None:
-                query += "WHERE unixtime > {0}".format(from_date)
-            query += ";"
-            cursor.execute(query)
-            return cursor.fetchall()
+        query = "SELECT unixtime, {0} FROM loans ".format(",".join(price_levels))
+        if from_date is not None:
+            query += "WHERE unixtime > {0}".format(from_date)
+        query += ";"
+        return db_con.query(query)
@@ -0,0 +1,289 @@
+"""
+Timing spans of the bot aggregated into histograms, and counters and gauges, for the status JSON, the logs and the
+/metrics endpoint of the web server
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds, the last bucket counts everything above
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+histograms = {}
+counters = {}
+gauges = {}
+# functions returning [(labels, value), ...] of a gauge, evaluated when the metrics are read
+gauge_callbacks = {}
+lock = threading.Lock()
+local = threading.local()
+
+
+def _thread_cpu_time():
+    return time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+
+
+# CPU seconds of the calling thread. time.thread_time is new in Python 3.7, before it the clock is read directly
+# where the platform has it, else the CPU time of the whole process is taken.
+if hasattr(time, 'thread_time'):
+    _thread_time = time.thread_time
+elif hasattr(time, 'CLOCK_THREAD_CPUTIME_ID'):
+    _thread_time = _thread_cpu_time
+else:
+    _thread_time = time.process_time
+
+
+class Histogram(object):
+    """
+    Counts of observed values per bucket, with their sum and maximum
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimates the q quantile, interpolating in the bucket holding it
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean": round(self.sum / self.count, 4) if self.count else 0.0,
+                "p50": round(self.quantile(0.5), 4), "p90": round(self.quantile(0.9), 4),
+                "p99": round(self.quantile(0.99), 4), "max": round(self.max, 4)}
+
+
+class Span(object):
+    """
+    Times a block: wall time, time waiting for exchange APIs and the request limiter, and CPU time of the thread.
+    Spans opened inside it are kept as its children.
+    """
+
+    def __init__(self, name, breakdown, labels):
+        self.name = name
+        self.breakdown = breakdown
+        self.labels = labels
+        self.children = []
+        self.seconds = self.api_seconds = self.limiter_seconds = self.cpu_seconds = 0.0
+
+    def __enter__(self):
+        counters = _counters()
+        self.parent = counters.spans[-1] if counters.spans else None
+        counters.spans.append(self)
+        self.started = time.perf_counter()
+        self.cpu_started = _thread_time()
+        self.api_started = counters.api
+        self.limiter_started = counters.limiter
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        counters = _counters()
+        counters.spans.pop()
+        self.seconds = time.perf_counter() - self.started
+        self.cpu_seconds = _thread_time() - self.cpu_started
+        self.api_seconds = counters.api - self.api_started
+        self.limiter_seconds = counters.limiter - self.limiter_started
+        observe(self.name + '_seconds', self.seconds, **self.labels)
+        if self.breakdown:
+            observe(self.name + '_api_seconds', self.api_seconds, **self.labels)
+            observe(self.name + '_limiter_seconds', self.limiter_seconds, **self.labels)
+            observe(self.name + '_cpu_seconds', self.cpu_seconds, **self.labels)
+        if self.parent is not None:
+            self.parent.children.append(self)
+        return False
+
+    def label(self):
+        return ",".join(str(value) for key, value in sorted(self.labels.items())) or self.name
+
+
+def _counters():
+    if not hasattr(local, 'spans'):
+        local.spans = []
+        local.api = 0.0
+        local.limiter = 0.0
+    return local
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with lock:
+        if key not in histograms:
+            histograms[key] = Histogram()
+        histograms[key].observe(value)
+
+
+def increment(name, value=1, **labels):
+    key = _key(name, labels)
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def get_counter(name, **labels):
+    with lock:
+        return counters.get(_key(name, labels), 0)
+
+
+def set_gauges(name, label, values):
+    """
+    Replaces all values of the gauge name by values, a dict {label value: value}
+    """
+    with lock:
+        for key in [key for key in gauges if key[0] == name]:
+            del gauges[key]
+        for label_value, value in values.items():
+            gauges[_key(name, {label: label_value})] = value
+
+
+def register_gauge(name, callback):
+    """
+    Registers a function returning the values of the gauge name as [(labels, value), ...]
+    """
+    with lock:
+        gauge_callbacks[name] = callback
+
+
+def get_histogram(name, **labels):
+    with lock:
+        return histograms.get(_key(name, labels))
+
+
+def span(name, breakdown=False, **labels):
+    """
+    Returns a context manager timing the block into the histogram name_seconds with the labels. With breakdown the
+    API, limiter and CPU time of the block go to name_api_seconds, name_limiter_seconds and name_cpu_seconds.
+    """
+    return Span(name, breakdown, labels)
+
+
+@contextmanager
+def api_call(endpoint, caller=None):
+    """
+    Times a request to the exchange, counting it per endpoint, status and caller if given
+    """
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        yield
+        status = 'ok'
+    finally:
+        seconds = time.perf_counter() - started
+        _counters().api += seconds
+        observe('api_seconds', seconds, endpoint=endpoint)
+        if caller:
+            increment('api_requests_total', caller=caller, endpoint=endpoint, status=status)
+        else:
+            increment('api_requests_total', endpoint=endpoint, status=status)
+
+
+def limiter_wait(seconds):
+    """
+    Records the time the request limiter made a request wait
+    """
+    _counters().limiter += seconds
+    observe('limiter_wait_seconds', seconds)
+
+
+def summary():
+    """
+    Returns the summaries of all histograms, keyed by name{label=value,...}
+    """
+    result = {}
+    with lock:
+        for (name, labels), histogram in histograms.items():
+            key = name
+            if labels:
+                key += "{" + ",".join("{}={}".format(k, v) for k, v in labels) + "}"
+            result[key] = histogram.summary()
+    return result
+
+
+def _prometheus_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels]
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in escaped) + "}"
+
+
+def prometheus(prefix='lendingbot_'):
+    """
+    Returns all metrics in the text format of Prometheus. The values are copied under the lock and formatted
+    after, so a scrape doesn't hold up the bot.
+    """
+    with lock:
+        counter_items = sorted(counters.items())
+        gauge_items = list(gauges.items())
+        callbacks = list(gauge_callbacks.items())
+        histogram_items = sorted((key, (list(h.buckets), list(h.counts), h.sum, h.count))
+                                 for key, h in histograms.items())
+    for name, callback in callbacks:
+        try:
+            gauge_items += [(_key(name, labels), value) for labels, value in callback()]
+        except Exception:
+            continue
+    lines = []
+    typed = set()
+
+    def type_line(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE {}{} {}".format(prefix, name, kind))
+
+    for (name, labels), value in counter_items:
+        type_line(name, 'counter')
+        lines.append("{}{}{} {}".format(prefix, name, _prometheus_labels(labels), value))
+    for (name, labels), value in sorted(gauge_items):
+        type_line(name, 'gauge')
+        lines.append("{}{}{} {}".format(prefix, name, _prometheus_labels(labels), value))
+    for (name, labels), (buckets, counts, total, count) in histogram_items:
+        type_line(name, 'histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + ['+Inf'], counts):
+            cumulative += bucket_count
+            lines.append("{}{}_bucket{} {}".format(prefix, name, _prometheus_labels(labels, [('le', bound)]),
+                                                   cumulative))
+        lines.append("{}{}_sum{} {}".format(prefix, name, _prometheus_labels(labels), total))
+        lines.append("{}{}_count{} {}".format(prefix, name, _prometheus_labels(labels), count))
+    return "\n".join(lines) + "\n"
+
+
+def describe(round_span):
+    """
+    Returns a line for the log on where the time of a span went
+    """
+    return "{:.3f}s (api {:.3f}s, limiter {:.3f}s, cpu {:.3f}s): {}".format(
+        round_span.seconds, round_span.api_seconds, round_span.limiter_seconds, round_span.cpu_seconds,
+        ", ".join("{} {:.3f}s".format(child.label(), child.seconds) for child in round_span.children))
+
+
+def reset():
+    with lock:
+        histograms.clear()
+        counters.clear()
+        gauges.clear()
+        gauge_callbacks.clear()
@@ -0,0 +1,20 @@
+"""
+Nonces of the requests signed with an API key. The exchange rejects a nonce not above the last one of the key, so
+the REST and the websocket requests take them from here, on one scale and strictly increasing.
+"""
+
+import threading
+import time
+
+lock = threading.Lock()
+last = 0
+
+
+def next_nonce():
+    """
+    Returns the next nonce, the microseconds since the epoch or one above the last nonce
+    """
+    global last
+    with lock:
+        last = max(last + 1, int(time.time() * 1000000))
+        return last
@@ -2,28 +2,24 @@ from urllib.parse import urlencode
 from urllib.request import urlopen, Request
 from urllib.error import HTTPError
 import json
+import logging
+import queue
 import smtplib
+import threading
 try:
     from irc import client
     IRC_LOADED = True
 except ImportError:
     IRC_LOADED = False
 
+import coinlendingbot.Metrics as Metrics
+
 IRC_CLIENT = None
 IRC_SERVER = None
-
-
-# Slack post data needs to be encoded in UTF-8
-def encoded_dict(in_dict):
-    out_dict = {}
-    for k, v in in_dict.iteritems():
-        if isinstance(v, unicode):
-            v = v.encode('utf8')
-        elif isinstance(v, str):
-            # Must be encoded in UTF-8
-            v.decode('utf8')
-        out_dict[k] = v
-    return out_dict
+# the dispatcher of dispatch, created on the first notification and again when the configuration changes
+dispatcher = None
+dispatcher_lock = threading.Lock()
+logger = logging.getLogger(__name__)
 
 
 class NotificationException(Exception):
@@ -41,7 +37,8 @@ def check_urlib_response(response, platform):
 def post_to_slack(msg, channels, token):
     for channel in channels:
         post_data = {'text': msg, 'channel': channel, 'token': token}
-        enc_post_data = urlencode(encoded_dict(post_data))
+        # post data needs to be encoded in UTF-8
+        enc_post_data = urlencode(post_data).encode('utf-8')
         url = 'https://{}/api/{}'.format('slack.com', 'chat.postMessage')
         response = urlopen(url, enc_post_data)
         check_urlib_response(response, 'slack')
@@ -52,47 +49,89 @@ def post_to_telegram(msg, chat_ids, bot_id):
         post_data = {"chat_id": chat_id, "text": msg}
         url = "https://api.telegram.org/bot" + bot_id + "/sendMessage"
         try:
-            response = urlopen(url, urlencode(post_data))
+            response = urlopen(url, urlencode(post_data).encode('utf-8'))
             check_urlib_response(response, 'telegram')
         except HTTPError as e:
             msg = "Your bot id is probably configured incorrectly"
             raise NotificationException("{0}\n{1}".format(e, msg))
 
 
-def send_email(msg, email_login_address, email_login_password, email_smtp_server, email_smtp_port,
-               email_to_addresses, email_smtp_starttls):
-    subject = 'Lending bot'
+class Mailer(object):
+    """
+    Sends emails over one SMTP connection, kept open between them. A connection closed by the server is opened
+    again once.
+    """
 
-    email_text = "\r\n".join(["From: {0}".format(email_login_address),
-                              "To: {0}".format(", ".join(email_to_addresses)),
-                              "Subject: {0}".format(subject),
-                              "",
-                              "{0}".format(msg)
-                              ])
+    def __init__(self, email_login_address, email_login_password, email_smtp_server, email_smtp_port,
+                 email_to_addresses, email_smtp_starttls):
+        self.login_address = email_login_address
+        self.login_password = email_login_password
+        self.smtp_server = email_smtp_server
+        self.smtp_port = email_smtp_port
+        self.to_addresses = email_to_addresses
+        self.starttls = email_smtp_starttls
+        self.server = None
 
-    try:
-        if email_smtp_starttls:
-            server = smtplib.SMTP(email_smtp_server, email_smtp_port)
+    def connect(self):
+        if self.starttls:
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
             server.ehlo()
             server.starttls()
         else:
-            server = smtplib.SMTP_SSL(email_smtp_server, email_smtp_port)
+            server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
         server.ehlo()
-        server.login(email_login_address, email_login_password)
-        server.sendmail(email_login_address, email_to_addresses, email_text)
-        server.close()
-    except Exception as e:
-        print("Could not send email, got error {0}".format(e))
-        raise NotificationException(e)
+        server.login(self.login_address, self.login_password)
+        self.server = server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except smtplib.SMTPException:
+                pass
+            self.server = None
+
+    def send(self, msg):
+        subject = 'Lending bot'
+
+        email_text = "\r\n".join(["From: {0}".format(self.login_address),
+                                  "To: {0}".format(", ".join(self.to_addresses)),
+                                  "Subject: {0}".format(subject),
+                                  "",
+                                  "{0}".format(msg)
+                                  ])
+
+        try:
+            reconnected = self.server is None
+            if reconnected:
+                self.connect()
+            try:
+                self.server.sendmail(self.login_address, self.to_addresses, email_text)
+            except smtplib.SMTPServerDisconnected:
+                if reconnected:
+                    raise
+                self.connect()
+                self.server.sendmail(self.login_address, self.to_addresses, email_text)
+        except Exception as e:
+            self.server = None
+            print("Could not send email, got error {0}".format(e))
+            raise NotificationException(e)
+
+
+def send_email(msg, email_login_address, email_login_password, email_smtp_server, email_smtp_port,
+               email_to_addresses, email_smtp_starttls):
+    mailer = Mailer(email_login_address, email_login_password, email_smtp_server, email_smtp_port,
+                    email_to_addresses, email_smtp_starttls)
+    mailer.send(msg)
+    mailer.close()
 
 
 def post_to_pushbullet(msg, token, deviceid):
     post_data = {'body': msg, 'device_iden': deviceid, 'title': 'Poloniex Bot', 'type': 'note'}
-    opener = urllib2.build_opener()
-    req = Request('https://api.pushbullet.com/v2/pushes', data=json.dumps(post_data),
-                          headers={'Content-Type': 'application/json', 'Access-Token': token})
+    req = Request('https://api.pushbullet.com/v2/pushes', data=json.dumps(post_data).encode('utf-8'),
+                  headers={'Content-Type': 'application/json', 'Access-Token': token})
     try:
-        opener.open(req)
+        urlopen(req)
     except Exception as e:
         print("Could not send pushbullet, got error {0}".format(e))
         raise NotificationException(e)
@@ -100,19 +139,30 @@ def post_to_pushbullet(msg, token, deviceid):
 
 def post_to_irc(msg, host, port, nick, ident, realname, target):
     """
-    Log into an IRC server and send a message to a channel.
+    Log into an IRC server and send a message to a channel. The connection is kept for the next message.
     """
     global IRC_CLIENT, IRC_SERVER
     if IRC_CLIENT is None:
         IRC_CLIENT = client.Reactor()
         IRC_SERVER = IRC_CLIENT.server()
 
-    IRC_SERVER.connect(host, port, nick)
-    if client.is_channel(target):
-        IRC_SERVER.join(target)
+    # read what came in meanwhile, a dropped connection is only noticed reading
+    IRC_CLIENT.process_once(0)
+    if not IRC_SERVER.is_connected():
+        IRC_SERVER.connect(host, port, nick)
+        if client.is_channel(target):
+            IRC_SERVER.join(target)
     IRC_SERVER.privmsg(target, msg)
 
 
+def service_irc():
+    """
+    Answers the PINGs of the IRC server, so it keeps the connection open between messages
+    """
+    if IRC_CLIENT is not None:
+        IRC_CLIENT.process_once(0)
+
+
 def send_notification(_msg, notify_conf):
     nc = notify_conf
     msg = _msg if ('notify_prefix' not in nc) else "{} {}".format(nc['notify_prefix'], _msg)
@@ -132,3 +182,173 @@ def send_notification(_msg, notify_conf):
                         nc['irc_target'])
         else:
             print("IRC module not available, please run 'pip install irc'")
+
+
+class Channel(object):
+    """
+    Sends the notifications of one platform in a thread of its own. The notifications queued within digest_seconds
+    of the first one are sent together as one digest. Up to queue_size notifications wait, further ones are dropped.
+    Without notifications, idle is called every idle_seconds, to keep a connection alive.
+    """
+
+    def __init__(self, name, send, queue_size=100, digest_seconds=5, idle=None, idle_seconds=10):
+        self.name = name
+        self.send = send
+        self.digest_seconds = digest_seconds
+        self.idle = idle
+        self.idle_seconds = idle_seconds
+        self.queue = queue.Queue(queue_size)
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='Notify-' + name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, msg):
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            logger.warning("Dropped a {0} notification, {1} are waiting".format(self.name, self.queue.qsize()))
+            Metrics.increment('notifications_dropped_total', channel=self.name)
+
+    def take(self):
+        """
+        Returns the next notification and the ones coming within digest_seconds
+        """
+        while True:
+            try:
+                messages = [self.queue.get(timeout=self.idle_seconds if self.idle else None)]
+                break
+            except queue.Empty:
+                try:
+                    self.idle()
+                except Exception as ex:
+                    logger.error("Failed to keep the {0} connection: {1}".format(self.name, ex))
+        # a closing channel doesn't wait for the digest
+        if messages[0] is not None:
+            self.closed.wait(self.digest_seconds)
+        while True:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def run(self):
+        while True:
+            taken = self.take()
+            # None is queued by close, after the last notification
+            messages = [msg for msg in taken if msg is not None]
+            if not messages:
+                for unused in taken:
+                    self.queue.task_done()
+                if None in taken:
+                    return
+                continue
+            if len(messages) == 1:
+                msg = messages[0]
+            else:
+                msg = "{0} notifications:\n\n{1}".format(len(messages), "\n-------\n".join(messages))
+            try:
+                self.send(msg)
+                Metrics.increment('notifications_sent_total', len(messages), channel=self.name)
+            except Exception as ex:
+                logger.error("Failed to send {0} notification: {1}".format(self.name, ex))
+                Metrics.increment('notifications_failed_total', len(messages), channel=self.name)
+            finally:
+                for unused in taken:
+                    self.queue.task_done()
+            if None in taken:
+                return
+
+    def flush(self, timeout):
+        with self.queue.all_tasks_done:
+            self.queue.all_tasks_done.wait_for(lambda: not self.queue.unfinished_tasks, timeout)
+
+    def close(self, timeout):
+        """
+        Sends the queued notifications at once and waits up to timeout seconds for the thread to stop
+        """
+        self.closed.set()
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Closing the {0} channel with {1} notifications waiting"
+                           .format(self.name, self.queue.qsize()))
+        self.thread.join(timeout)
+
+
+class Dispatcher(object):
+    """
+    Sends notifications to the platforms of notify_conf, each platform by a Channel of its own, so a slow platform
+    holds up neither the bot nor the other platforms
+    """
+
+    def __init__(self, notify_conf):
+        # a copy, so a changed configuration is told apart from the one the channels were made for
+        nc = dict(notify_conf)
+        self.notify_conf = nc
+        self.channels = []
+        self.mailer = None
+        if nc['email']:
+            self.mailer = Mailer(nc['email_login_address'], nc['email_login_password'], nc['email_smtp_server'],
+                                 nc['email_smtp_port'], nc['email_to_addresses'], nc['email_smtp_starttls'])
+            self.add_channel('email', self.mailer.send)
+        if nc['slack']:
+            self.add_channel('slack', lambda msg: post_to_slack(msg, nc['slack_channels'], nc['slack_token']))
+        if nc['telegram']:
+            self.add_channel('telegram',
+                             lambda msg: post_to_telegram(msg, nc['telegram_chat_ids'], nc['telegram_bot_id']))
+        if nc['pushbullet']:
+            self.add_channel('pushbullet',
+                             lambda msg: post_to_pushbullet(msg, nc['pushbullet_token'], nc['pushbullet_deviceid']))
+        if nc['irc']:
+            if IRC_LOADED:
+                self.add_channel('irc', lambda msg: post_to_irc(msg, nc['irc_host'], nc['irc_port'], nc['irc_nick'],
+                                                                nc['irc_ident'], nc['irc_realname'], nc['irc_target']),
+                                 service_irc)
+            else:
+                print("IRC module not available, please run 'pip install irc'")
+
+    def add_channel(self, name, send, idle=None):
+        self.channels.append(Channel(name, send, self.notify_conf.get('notify_queue_size', 100),
+                                     self.notify_conf.get('notify_digest_seconds', 5), idle))
+
+    def notify(self, _msg):
+        nc = self.notify_conf
+        msg = _msg if ('notify_prefix' not in nc) else "{} {}".format(nc['notify_prefix'], _msg)
+        for channel in self.channels:
+            channel.put(msg)
+
+    def flush(self, timeout=30):
+        """
+        Waits up to timeout seconds for every channel to send its notifications
+        """
+        for channel in self.channels:
+            channel.flush(timeout)
+
+    def close(self, timeout=30):
+        """
+        Sends the queued notifications and stops the channels
+        """
+        for channel in self.channels:
+            channel.close(timeout)
+        # the connection is only closed once no thread can use it anymore
+        if self.mailer is not None and not any(channel.thread.is_alive() for channel in self.channels):
+            self.mailer.close()
+
+
+def dispatch(msg, notify_conf):
+    """
+    Queues msg for the platforms of notify_conf and returns at once
+    """
+    global dispatcher
+    with dispatcher_lock:
+        if dispatcher is None or dispatcher.notify_conf != notify_conf:
+            if dispatcher is not None:
+                dispatcher.close()
+            dispatcher = Dispatcher(notify_conf)
+        dispatcher.notify(msg)
+
+
+def flush(timeout=30):
+    if dispatcher is not None:
+        dispatcher.flush(timeout)
@@ -1,4 +1,5 @@
 from coinlendingbot.plugins import *
+from coinlendingbot import RequestTracker
 
 config = None
 api = None
@@ -14,7 +15,8 @@ def init_plugin(plugin_name):
         """
     klass = globals()[plugin_name]  # type: Plugin
     instance = klass(config, api, log, notify_conf)
-    instance.on_bot_init()
+    with RequestTracker.caller(plugin_name):
+        instance.on_bot_init()
     return instance
 
 
@@ -44,14 +46,17 @@ def init(cfg, api1, log1, notify_conf1):
 
 def after_lending():
     for plugin in plugins:
-        plugin.after_lending()
+        with RequestTracker.caller(plugin.__class__.__name__):
+            plugin.after_lending()
 
 
 def before_lending():
     for plugin in plugins:
-        plugin.before_lending()
+        with RequestTracker.caller(plugin.__class__.__name__):
+            plugin.before_lending()
 
 
 def on_bot_exit():
     for plugin in plugins:
-        plugin.on_bot_stop()
+        with RequestTracker.caller(plugin.__class__.__name__):
+            plugin.on_bot_stop()
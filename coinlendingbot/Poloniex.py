@@ -13,7 +13,8 @@ import urllib
 import coinlendingbot.Configuration as Config
 from coinlendingbot.RingBuffer import RingBuffer
 from coinlendingbot.ExchangeApi import ExchangeApi
-from coinlendingbot.ExchangeApi import ApiError
+from coinlendingbot.ExchangeApi import ApiError, RateLimitError, ServerError
+from coinlendingbot.websocket import ExchangeWsClient
 
 
 def post_process(before):
@@ -31,6 +32,9 @@ def post_process(before):
 
 
 class Poloniex(ExchangeApi):
+    WRITE_ENDPOINTS = ('buy', 'sell', 'cancelOrder', 'createLoanOffer', 'cancelLoanOffer', 'toggleAutoRenew',
+                       'transferBalance', 'withdraw')
+
     def __init__(self, cfg, weblog):
         super(Poloniex, self).__init__(cfg, weblog)
         self.logger = logging.getLogger(__name__)
@@ -38,10 +42,34 @@ class Poloniex(ExchangeApi):
         self.default_req_period = 1000  # milliseconds
         self.req_period = self.default_req_period
         self.req_time_log = RingBuffer(self.req_per_period)
+        self.request_tracker = self.create_request_tracker()
+        self.retry_policy = self.create_retry_policy()
         self.lock = threading.RLock()
         self.timeout = int(Config.get("BOT", "timeout", 30, 1, 180))
-        self.url_public = 'https://poloniex.com/public'
-        self.url_private = 'https://poloniex.com/tradingApi'
+        # the URLs can point to a stand-in exchange, see fakeexchange.py
+        url = self.cfg.get('POLONIEX', 'url', 'https://poloniex.com')
+        self.url_public = url + '/public'
+        self.url_private = url + '/tradingApi'
+        self.ws_url = self.cfg.get('POLONIEX', 'wsUrl', '') or None
+        # the push API has no lending book channel, so loan orders are shared between callers for a short time
+        self.loan_orders_cache_seconds = float(self.cfg.get('POLONIEX', 'loanOrdersCacheSeconds', 1, 0, 60))
+        self.loan_orders = {}
+        self.loan_orders_lock = threading.Lock()
+        self._init_websocket()
+
+    def _init_websocket(self):
+        self.websocket = ExchangeWsClient('POLONIEX', self.ws_url)
+        ticker = self.api_query("returnTicker")
+        self.websocket.set_currency_pairs({ticker[pair]['id']: pair for pair in ticker})
+        # the push channel has no snapshot, it only sends the pairs that changed
+        self.websocket.seed_ticker(ticker)
+        self.ticker_pairs = set(ticker)
+        record_file = self.cfg.get("POLONIEX", "wsRecordFile", "")
+        if record_file:
+            self.websocket.record(record_file)
+        self.websocket.start()
+        for pair in ticker:
+            self.websocket.subscribe_ticker(pair)
 
     def limit_request_rate(self):
         super(Poloniex, self).limit_request_rate()
@@ -55,12 +83,18 @@ class Poloniex(ExchangeApi):
     def reset_request_timer(self):
         super(Poloniex, self).reset_request_timer()
 
+    @ExchangeApi.retried
     @ExchangeApi.synchronized
     def api_query(self, command, req=None):
         # keep the 6 request per sec limit
         self.limit_request_rate()
 
         def _read_response(resp):
+            if resp.status_code == 429:
+                raise RateLimitError('API Error 429: {}'.format(resp.text[:200]))
+            if resp.status_code >= 500:
+                raise ServerError('API Error {}: The web server reported a bad gateway or gateway timeout error.'
+                                  .format(resp.status_code))
             resp_data = resp.json()
             if 'error' in resp_data:
                 raise ApiError(resp_data['error'])
@@ -69,75 +103,85 @@ class Poloniex(ExchangeApi):
         if req is None:
             req = {}
 
-        try:
-            payload = {
-                "timeout": self.timeout
-            }
-            if command == "returnTicker" or command == "return24hVolume":
-                ret = requests.get(self.url_public, params={"command": command})
-                return _read_response(ret)
-            elif command == "returnOrderBook":
-                ret = requests.get(self.url_public,
-                                   params={"command": command, "currencyPair": str(req['currencyPair'])})
-                return _read_response(ret)
-            elif command == "returnMarketTradeHistory":
-                ret = requests.get(self.url_public,
-                                   params={"command": "returnTradeHistory", "currencyPair":  str(req['currencyPair'])})
-                return _read_response(ret)
-            elif command == "returnLoanOrders":
-                params = {
-                    "command": command,
-                    "currency": str(req['currency'])
-                }
-                if req['limit'] > 0:
-                    params["limit"] = req["limit"]
-                ret = requests.get(self.url_public, params)
-                return _read_response(ret)
-            else:
-                payload["url"] = self.url_private
-                payload["data"] = {
-                    "command": command,
-                    "nonce": int(time.time() * 1000)
-                }
-
-                sign = hmac.new(self.apiSecret.encode('utf-8'),
-                                urllib.parse.urlencode(payload["data"]).encode('utf-8'),
-                                hashlib.sha512).hexdigest()
-
-                payload["headers"] = {
-                    'Sign': sign,
-                    'Key': self.apiKey.encode('utf8')
-                }
-
-                ret = requests.post(**payload)
-                json_ret = _read_response(ret)
-                return post_process(json_ret)
-
-            # Check in case something has gone wrong and the timer is too big
-            self.reset_request_timer()
-
-        except urllib.error.HTTPError as ex:
-            raw_polo_response = ex.read()
+        with self.track_request(command):
             try:
-                data = json.loads(raw_polo_response)
-                polo_error_msg = data['error']
-            except Exception:
-                if hasattr(ex, 'code') and (ex.code == 502 or ex.code in range(520, 527, 1)):
-                    # 502 and 520-526 Bad Gateway so response is likely HTML from Cloudflare
-                    polo_error_msg = 'API Error ' + str(ex.code) + \
-                                     ': The web server reported a bad gateway or gateway timeout error.'
-                elif hasattr(ex, 'code') and (ex.code == 429):
-                    self.increase_request_timer()
+                payload = {
+                    "timeout": self.timeout
+                }
+                if command == "returnTicker" or command == "return24hVolume":
+                    ret = requests.get(self.url_public, params={"command": command})
+                    return _read_response(ret)
+                elif command == "returnOrderBook":
+                    ret = requests.get(self.url_public,
+                                       params={"command": command, "currencyPair": str(req['currencyPair'])})
+                    return _read_response(ret)
+                elif command == "returnMarketTradeHistory":
+                    ret = requests.get(self.url_public, params={"command": "returnTradeHistory",
+                                                                "currencyPair": str(req['currencyPair'])})
+                    return _read_response(ret)
+                elif command == "returnLoanOrders":
+                    params = {
+                        "command": command,
+                        "currency": str(req['currency'])
+                    }
+                    if req['limit'] > 0:
+                        params["limit"] = req["limit"]
+                    ret = requests.get(self.url_public, params)
+                    return _read_response(ret)
                 else:
-                    polo_error_msg = raw_polo_response
-            ex.message = "{0} Requesting {1}.  Poloniex reports: '{2}'".format(ex, command, polo_error_msg)
-            raise ex
-        except Exception as ex:
-            ex.message = "{0} Requesting {1}".format(ex, command)
-            raise
+                    payload["url"] = self.url_private
+                    payload["data"] = {
+                        "command": command,
+                        "nonce": int(time.time() * 1000)
+                    }
+                    payload["data"].update(req)
+
+                    sign = hmac.new(self.apiSecret.encode('utf-8'),
+                                    urllib.parse.urlencode(payload["data"]).encode('utf-8'),
+                                    hashlib.sha512).hexdigest()
+
+                    payload["headers"] = {
+                        'Sign': sign,
+                        'Key': self.apiKey.encode('utf8')
+                    }
+
+                    ret = requests.post(**payload)
+                    json_ret = _read_response(ret)
+                    return post_process(json_ret)
+
+                # Check in case something has gone wrong and the timer is too big
+                self.reset_request_timer()
+
+            except urllib.error.HTTPError as ex:
+                raw_polo_response = ex.read()
+                try:
+                    data = json.loads(raw_polo_response)
+                    polo_error_msg = data['error']
+                except Exception:
+                    if hasattr(ex, 'code') and (ex.code == 502 or ex.code in range(520, 527, 1)):
+                        # 502 and 520-526 Bad Gateway so response is likely HTML from Cloudflare
+                        polo_error_msg = 'API Error ' + str(ex.code) + \
+                                         ': The web server reported a bad gateway or gateway timeout error.'
+                    elif hasattr(ex, 'code') and (ex.code == 429):
+                        self.increase_request_timer()
+                    else:
+                        polo_error_msg = raw_polo_response
+                ex.message = "{0} Requesting {1}.  Poloniex reports: '{2}'".format(ex, command, polo_error_msg)
+                raise ex
+            except Exception as ex:
+                ex.message = "{0} Requesting {1}".format(ex, command)
+                raise
 
     def return_ticker(self):
-        return self.api_query("returnTicker")
+        """
+        Returns the ticker pushed by the websocket, REST is only used while it isn't connected
+        or a pair is missing.
+        """
+        ticker = dict(self.websocket.return_ticker()) if self.websocket.is_connected() else {}
+        if len(ticker) == 0 or not self.ticker_pairs.issubset(ticker):
+            return self.api_query("returnTicker")
+        return {pair: {key: value for key, value in entry.items() if key not in ('pair', 'update_time')}
+                for pair, entry in ticker.items()}
 
     def return24h_volume(self):
         return self.api_query("return24hVolume")
@@ -185,7 +229,7 @@ class Poloniex(ExchangeApi):
     def return_active_loans(self):
         return self.api_query('returnActiveLoans')
 
-    def return_lending_history(self, start, stop, limit=500):
+    def return_lending_history(self, start, stop, limit=500, currency=None):
         return self.api_query('returnLendingHistory', {'start': start, 'end': stop, 'limit': limit})
 
     # Returns your trade history for a given market, specified by the "currencyPair" POST parameter
@@ -252,8 +296,21 @@ class Poloniex(ExchangeApi):
         return self.api_query('withdraw', {"currency": currency, "amount": amount, "address": address})
 
     def return_loan_orders(self, currency, limit=0):
+        with self.loan_orders_lock:
+            cached = self.loan_orders.get(currency)
+        if cached is not None:
+            cached_limit, loan_orders = cached
+            age = (datetime.utcnow() - loan_orders["update_time"]).total_seconds()
+            if age < self.loan_orders_cache_seconds and (cached_limit == 0 or 0 < limit <= cached_limit):
+                if limit == 0:
+                    return loan_orders
+                return {"offers": loan_orders["offers"][:limit], "demands": loan_orders["demands"][:limit],
+                        "update_time": loan_orders["update_time"]}
+
         loan_orders = self.api_query('returnLoanOrders', {"currency": currency, "limit": limit})
         loan_orders["update_time"] = datetime.utcnow()
+        with self.loan_orders_lock:
+            self.loan_orders[currency] = (limit, loan_orders)
         return loan_orders
 
     # Toggles the auto renew setting for the specified orderNumber
@@ -0,0 +1,116 @@
+"""
+Attributes the requests to the exchange to their callers and tracks their rate against the limit of the exchange
+"""
+
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import coinlendingbot.Clock as Clock
+
+# seconds the rate is averaged over
+WINDOW = 10
+# seconds between two warnings
+WARNING_INTERVAL = 60
+
+local = threading.local()
+logger = logging.getLogger(__name__)
+
+
+def set_caller(name):
+    """
+    Attributes the requests of the current thread to name
+    """
+    local.caller = name
+
+
+@contextmanager
+def caller(name):
+    """
+    Attributes the requests of the block to name
+    """
+    previous = getattr(local, 'caller', None)
+    local.caller = name
+    try:
+        yield
+    finally:
+        local.caller = previous
+
+
+def get_caller():
+    return getattr(local, 'caller', None) or threading.current_thread().name
+
+
+class RequestTracker(object):
+    """
+    Counts the requests per caller and endpoint and warns once the rate over the last WINDOW seconds comes close
+    to the limit, before the exchange bans the bot
+    """
+
+    def __init__(self, requests_per_second, warning_level=0.8):
+        self.limit = requests_per_second
+        self.warning_level = warning_level
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.totals = {}
+        self.rate_limited = {}
+        self.last_warning = None
+
+    def record(self, endpoint, name=None):
+        name = name or get_caller()
+        now = Clock.time()
+        with self.lock:
+            self.recent.append((now, name))
+            self.totals[(name, endpoint)] = self.totals.get((name, endpoint), 0) + 1
+            self._expire(now)
+            usage = self._usage()
+            warn = usage >= self.warning_level and (self.last_warning is None
+                                                    or now - self.last_warning >= WARNING_INTERVAL)
+            if warn:
+                self.last_warning = now
+                callers = self._recent_callers()
+        if warn:
+            logger.warning("Requests at {:.0%} of the limit of {:g} per second over the last {} s, by {}. "
+                           "The exchange may ban the bot.".format(usage, self.limit, WINDOW, ", ".join(
+                               "{} {}".format(name, count) for name, count in callers)))
+
+    def record_rate_limited(self, name=None):
+        name = name or get_caller()
+        with self.lock:
+            self.rate_limited[name] = self.rate_limited.get(name, 0) + 1
+
+    def _expire(self, now):
+        while self.recent and self.recent[0][0] <= now - WINDOW:
+            self.recent.popleft()
+
+    def _usage(self):
+        if not self.limit:
+            return 0.0
+        return len(self.recent) / float(WINDOW) / self.limit
+
+    def _recent_callers(self):
+        counts = {}
+        for unused, name in self.recent:
+            counts[name] = counts.get(name, 0) + 1
+        return sorted(counts.items(), key=lambda item: -item[1])
+
+    def summary(self):
+        """
+        Returns the rate and the headroom to the limit, with the requests per caller and endpoint, for the status
+        """
+        with self.lock:
+            self._expire(Clock.time())
+            usage = self._usage()
+            callers = {}
+            for name, count in self._recent_callers():
+                callers[name] = {"rate": round(count / float(WINDOW), 3), "requests": 0, "endpoints": {}}
+            for (name, endpoint), count in self.totals.items():
+                entry = callers.setdefault(name, {"rate": 0.0, "requests": 0, "endpoints": {}})
+                entry["requests"] += count
+                entry["endpoints"][endpoint] = count
+            for name, count in self.rate_limited.items():
+                callers.setdefault(name, {"rate": 0.0, "requests": 0, "endpoints": {}})["rate_limited"] = count
+            return {"limit": self.limit, "rate": round(len(self.recent) / float(WINDOW), 3),
+                    "usage": round(usage, 3), "headroom": round(max(1 - usage, 0), 3) if self.limit else None,
+                    "callers": callers}
@@ -0,0 +1,119 @@
+"""
+Retries of failed exchange requests with jittered exponential backoff, and a circuit breaker per endpoint
+"""
+
+import logging
+import random
+import threading
+
+import coinlendingbot.Clock as Clock
+import coinlendingbot.Metrics as Metrics
+from coinlendingbot.ExchangeApi import ApiError, TransientApiError, RateLimitError, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker(object):
+    """
+    Opens after failures transient failures in a row, an open breaker lets no request through for cooldown
+    seconds. After that requests go through again, the first failure opens it again.
+    """
+
+    def __init__(self, failures, cooldown):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+
+    def allow(self, now):
+        return self.opened is None or now - self.opened >= self.cooldown
+
+    def remaining(self, now):
+        return max(self.opened + self.cooldown - now, 0) if self.opened is not None else 0
+
+    def success(self):
+        self.failures = 0
+        self.opened = None
+
+    def failure(self, now):
+        """
+        Returns True if the failure opened the breaker
+        """
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.opened = now
+            return True
+        return False
+
+
+class RetryPolicy(object):
+    """
+    Retries requests failing with a TransientApiError. Requests to write_endpoints change the account, they are
+    retried only when the exchange surely didn't execute them: when it rejected them for the rate limit.
+    """
+
+    def __init__(self, retries=3, delay=1.0, max_delay=30.0, rate_limit_delay=10.0, breaker_failures=5,
+                 breaker_seconds=60, write_endpoints=(), seed=None):
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.rate_limit_delay = rate_limit_delay
+        self.breaker_failures = breaker_failures
+        self.breaker_seconds = breaker_seconds
+        self.write_endpoints = set(write_endpoints)
+        self.random = random.Random(seed)
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def retryable(self, endpoint, ex):
+        if endpoint in self.write_endpoints:
+            return isinstance(ex, RateLimitError)
+        return isinstance(ex, TransientApiError)
+
+    def backoff(self, attempt, ex):
+        """
+        Returns the seconds to wait before the retry attempt (0 for the first), doubling with every attempt.
+        Half of it is random, so callers failing together don't retry together.
+        """
+        delay = self.rate_limit_delay if isinstance(ex, RateLimitError) else self.delay
+        delay = min(delay * 2 ** attempt, self.max_delay)
+        return delay / 2 + self.random.uniform(0, delay / 2)
+
+    def call(self, endpoint, function, *args, **kwargs):
+        """
+        Returns function(*args, **kwargs) requesting endpoint, retrying it by the policy
+        """
+        with self.lock:
+            breaker = self.breakers.setdefault(endpoint, CircuitBreaker(self.breaker_failures, self.breaker_seconds))
+        attempt = 0
+        while True:
+            with self.lock:
+                now = Clock.time()
+                if not breaker.allow(now):
+                    raise CircuitOpenError("{} failed {} times in a row, not requesting it for {:.0f} s".format(
+                        endpoint, breaker.failures, breaker.remaining(now)))
+            try:
+                result = function(*args, **kwargs)
+            except TransientApiError as ex:
+                with self.lock:
+                    opened = breaker.failure(Clock.time())
+                if opened:
+                    logger.error("Circuit breaker of {} opened for {} s: {}".format(
+                        endpoint, self.breaker_seconds, ex.message))
+                    Metrics.increment('api_circuit_breaker_opened_total', endpoint=endpoint)
+                if opened or attempt >= self.retries or not self.retryable(endpoint, ex):
+                    raise
+                delay = self.backoff(attempt, ex)
+                attempt += 1
+                logger.warning("{}, retry {} of {} in {:.1f} s".format(ex.message, attempt, self.retries, delay))
+                Metrics.increment('api_retries_total', endpoint=endpoint)
+                Clock.sleep(delay)
+                continue
+            except ApiError:
+                # the exchange answered, it just refused the request
+                with self.lock:
+                    breaker.success()
+                raise
+            with self.lock:
+                breaker.success()
+            return result
@@ -0,0 +1,167 @@
+"""
+The SQLite databases of the bot, one Database per file shared by everything using it. All writes to a file go
+through one writer thread with its own connection, in the order they came, so writers never wait for each other's
+locks. Queries use a pool of read connections, which in WAL mode read alongside the writer.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import coinlendingbot.Metrics as Metrics
+
+# seconds a connection waits for a lock held by another process before failing with "database is locked"
+BUSY_TIMEOUT = 30
+# pages of the cache per connection, negative numbers are KiB
+CACHE_SIZE = -8192
+# read connections kept open per database
+READERS = 4
+PRAGMAS = ("PRAGMA synchronous=NORMAL", "PRAGMA cache_size={0}".format(CACHE_SIZE), "PRAGMA temp_store=MEMORY")
+
+databases = {}
+lock = threading.Lock()
+
+
+class Database(object):
+    """
+    A database file with its writer thread and read connections. An in-memory database has a single connection,
+    used by the writer and the queries in turn.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.memory = path == ':memory:'
+        self.writer = self._connect()
+        if not self.memory:
+            self.writer.execute("PRAGMA journal_mode=WAL")
+        self.memory_lock = threading.RLock()
+        self.readers = queue.LifoQueue()
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._write_loop, name='sqlite writer ' + name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    def _write_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            function, future, queued = job
+            Metrics.observe('sqlite_write_wait_seconds', time.perf_counter() - queued, db=self.name)
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = self._write(function)
+                except BaseException as ex:
+                    future.set_exception(ex)
+                else:
+                    future.set_result(result)
+
+    def _write(self, function):
+        # only readers of an in-memory database share the lock, it is uncontended for a file
+        with Metrics.span('sqlite_write', db=self.name), self.memory_lock, self.writer:
+            return function(self.writer)
+
+    def write(self, function):
+        """
+        Returns function(connection) run by the writer thread in a transaction, committed if it returns and rolled
+        back if it raises
+        """
+        if threading.current_thread() is self.thread:
+            return function(self.writer)
+        future = Future()
+        self.jobs.put((function, future, time.perf_counter()))
+        return future.result()
+
+    def execute(self, sql, parameters=()):
+        """
+        Executes a statement changing the database, returns the number of rows changed
+        """
+        return self.write(lambda connection: connection.execute(sql, parameters).rowcount)
+
+    def executemany(self, sql, parameters):
+        return self.write(lambda connection: connection.executemany(sql, parameters).rowcount)
+
+    @contextmanager
+    def reader(self):
+        """
+        Lends a read connection for the block
+        """
+        if self.memory:
+            with self.memory_lock:
+                yield self.writer
+            return
+        try:
+            connection = self.readers.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+            connection.execute("PRAGMA query_only=1")
+        try:
+            yield connection
+        finally:
+            if self.readers.qsize() < READERS:
+                self.readers.put(connection)
+            else:
+                connection.close()
+
+    def query(self, sql, parameters=()):
+        """
+        Returns all rows of a query
+        """
+        started = time.perf_counter()
+        with self.reader() as connection:
+            rows = connection.execute(sql, parameters).fetchall()
+        Metrics.observe('sqlite_query_seconds', time.perf_counter() - started, db=self.name)
+        return rows
+
+    def query_one(self, sql, parameters=()):
+        """
+        Returns the first row of a query, None without any
+        """
+        rows = self.query(sql, parameters)
+        return rows[0] if rows else None
+
+    def close(self):
+        """
+        Waits for the writes queued and closes the connections
+        """
+        if self.thread.is_alive():
+            self.jobs.put(None)
+            self.thread.join()
+        self.writer.close()
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
+
+
+def open_db(path, name=None):
+    """
+    Returns the Database of the file path, opened on the first call. The metrics of its queries and writes are
+    labelled with name, the file name without extension by default. Every call with ':memory:' opens a new one.
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    if path == ':memory:':
+        return Database(path, name)
+    path = os.path.abspath(path)
+    with lock:
+        if path not in databases:
+            databases[path] = Database(path, name)
+        return databases[path]
+
+
+def close_all():
+    with lock:
+        opened = list(databases.values())
+        databases.clear()
+    for database in opened:
+        database.close()
@@ -0,0 +1,140 @@
+"""
+Parameter sweep backtesting variants of a configuration in a pool of processes
+"""
+
+import configparser
+import io
+import itertools
+import logging
+import multiprocessing
+import random
+import shutil
+import tempfile
+
+import coinlendingbot.Configuration as Config
+import coinlendingbot.Data as Data
+from coinlendingbot.Backtest import Backtest
+from coinlendingbot.ExchangeSimulator import MarketHistory
+
+# State of a worker process, set once by init_worker
+worker = {}
+
+
+def _number(value):
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def parse_parameter(parameter, config_text):
+    """
+    Parses "[SECTION.]option=values" into ((section, option), values). The values are a comma separated list or a
+    range min:max for the random search, which is returned as tuple. Without a section, the section of the
+    configuration having the option is used, BOT if none has it.
+    """
+    name, _, values = parameter.partition('=')
+    section, _, option = name.strip().rpartition('.')
+    if not option or not values.strip():
+        raise ValueError("Invalid parameter {}, use [SECTION.]option=value,value,... or min:max".format(parameter))
+    if not section:
+        parser = configparser.ConfigParser()
+        parser.read_string(config_text)
+        sections = [s for s in parser.sections() if parser.has_option(s, option)]
+        section = sections[0] if sections else 'BOT'
+    if ':' in values:
+        low, high = values.split(':')
+        return (section, option), (_number(low), _number(high))
+    return (section, option), [value.strip() for value in values.split(',')]
+
+
+def grid(parameters):
+    """
+    Returns every combination of the values of the parameters as [{(section, option): value, ...}, ...]
+    """
+    keys = list(parameters.keys())
+    for key in keys:
+        if isinstance(parameters[key], tuple):
+            raise ValueError("The range of {} can only be used by the random search".format(key[1]))
+    return [dict(zip(keys, values)) for values in itertools.product(*[parameters[key] for key in keys])]
+
+
+def random_variants(parameters, count, seed=None):
+    """
+    Returns count variants with a random value of every parameter, ranges of integers give integers
+    """
+    rnd = random.Random(seed)
+    variants = []
+    for _ in range(count):
+        variant = {}
+        for key, values in parameters.items():
+            if not isinstance(values, tuple):
+                variant[key] = rnd.choice(values)
+            elif all(isinstance(value, int) for value in values):
+                variant[key] = rnd.randint(*values)
+            else:
+                variant[key] = round(rnd.uniform(*values), 6)
+        variants.append(variant)
+    return variants
+
+
+def init_worker(config_text, directory, currencies, balances, prices, days):
+    worker["config"] = config_text
+    # memory mapped, all workers share the pages of the history
+    worker["history"] = MarketHistory.load_arrays(directory, currencies)
+    worker["balances"] = balances
+    worker["prices"] = prices
+    worker["days"] = days
+    worker["suggestions"] = {}
+    logging.getLogger('coinlendingbot').setLevel(logging.ERROR)
+
+
+def backtest_variant(task):
+    """
+    Backtests a variant in a worker, returns (index, variant, yearly rate of the whole balance, results, error)
+    """
+    index, variant = task
+    try:
+        Config.config.clear()
+        config_file = io.StringIO(worker["config"])
+        config_file.name = 'variant {}'.format(index)
+        Config.init(config_file, Data)
+        for (section, option), value in variant.items():
+            if not Config.config.has_section(section):
+                Config.config.add_section(section)
+            Config.config.set(section, option, str(value))
+        backtest = Backtest(Config, worker["history"], worker["balances"], worker["prices"], worker["days"],
+                            worker["suggestions"])
+        results = backtest.run()
+    except (Exception, SystemExit) as ex:
+        # an invalid value makes Configuration exit, which would take the worker down
+        return index, variant, None, [], "{}: {}".format(type(ex).__name__, ex)
+    values = {r["currency"]: r["balance"] * backtest.usd_prices[r["currency"]] for r in results}
+    total = sum(values.values())
+    yearly_rate = sum(r["yearly_rate"] * values[r["currency"]] for r in results) / total if total else 0.0
+    return index, variant, yearly_rate, results, None
+
+
+def run(config_text, history, balances, variants, prices=None, days=None, workers=None):
+    """
+    Backtests the variants, dicts {(section, option): value} applied to the configuration, in a pool of workers
+    sharing the history memory mapped. Returns the results ranked by the yearly rate of the whole balance,
+    [{"variant", "yearly_rate", "results", "error"}, ...] with the failed variants last.
+    """
+    directory = tempfile.mkdtemp(prefix='sweep-')
+    try:
+        history.save(directory)
+        pool = multiprocessing.Pool(workers, init_worker,
+                                    (config_text, directory, sorted(history.books), balances, prices, days))
+        try:
+            # one variant per task keeps all workers busy until the end, a backtest outweighs the overhead
+            results = list(pool.imap_unordered(backtest_variant, list(enumerate(variants)), chunksize=1))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    results.sort(key=lambda r: (r[2] is None, -(r[2] or 0), r[0]))
+    return [{"variant": variant, "yearly_rate": yearly_rate, "results": currency_results, "error": error}
+            for index, variant, yearly_rate, currency_results, error in results]
@@ -1,12 +1,237 @@
 # coding=utf-8
+import gzip
+import json
 import logging
+import queue
+import socketserver
 import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import coinlendingbot.Metrics as Metrics
 
 logger = logging.getLogger(__name__)
 server = None
 web_server_ip = "0.0.0.0"
 web_server_port = "8000"
 web_server_template = "www"
+web_server_workers = 256
+web_server_timeout = 30
+# seconds browsers may use static files without asking again, the status and the pages are always revalidated
+STATIC_MAX_AGE = 300
+# paths answered by functions instead of files, see add_route
+routes = {}
+# part of the ETags, so ETags from before a restart of the bot don't match
+boot_id = '{0:x}'.format(int(time.time()))
+
+
+def add_route(path, handler):
+    '''
+    Serves path with handler, a function taking the request headers and the query parameters as a dict and
+    returning (status, headers, body). The body is bytes, or an iterable of bytes sent as they come, until the
+    client disconnects.
+    '''
+    routes[path] = handler
+
+
+def metrics_route(request_headers, query):
+    return 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, Metrics.prometheus().encode('utf-8')
+
+
+def snapshot_route(snapshot):
+    '''
+    Returns a handler serving the JSON of snapshot, a function returning (version, JSON as bytes).
+    The ETag holds the version, so polling an unchanged snapshot is answered with 304 Not Modified,
+    and the body is gzipped once per version for the clients accepting gzip.
+    '''
+    compressed = [(None, None)]
+
+    def handler(request_headers, query):
+        version, body = snapshot()
+        etag = '"{0}-{1}"'.format(boot_id, version)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in [tag.strip() for tag in request_headers.get('If-None-Match', '').split(',')]:
+            return 304, headers, b''
+        headers['Content-Type'] = 'application/json'
+        headers['Vary'] = 'Accept-Encoding'
+        if 'gzip' in request_headers.get('Accept-Encoding', ''):
+            compressed_version, compressed_body = compressed[0]
+            if compressed_version != version:
+                compressed_body = gzip.compress(body)
+                compressed[0] = (version, compressed_body)
+            headers['Content-Encoding'] = 'gzip'
+            body = compressed_body
+        return 200, headers, body
+    return handler
+
+
+add_route('/metrics', metrics_route)
+
+
+def format_event(event, data, event_id=None):
+    '''
+    Returns a Server-Sent Event as bytes, data is a string without line breaks
+    '''
+    message = 'event: {0}\ndata: {1}\n\n'.format(event, data)
+    if event_id is not None:
+        message = 'id: {0}\n'.format(event_id) + message
+    return message.encode('utf-8')
+
+
+class EventClient(object):
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(queue_size)
+        self.dropped = False
+
+
+class EventStream(object):
+    '''
+    Pushes events to the connected clients as Server-Sent Events. Every event is formatted once for all clients.
+    A client falling queue_size events behind is disconnected, its browser reconnects and starts over.
+    '''
+
+    def __init__(self, queue_size=100, heartbeat=15):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.clients = set()
+        self.lock = threading.Lock()
+        Metrics.register_gauge('web_event_clients', lambda: [({}, len(self.clients))])
+
+    def publish(self, event, data, event_id=None):
+        message = format_event(event, data, event_id)
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.queue.put_nowait(message)
+            except queue.Full:
+                self.remove(client)
+                client.dropped = True
+                Metrics.increment('web_event_clients_dropped_total')
+
+    def add(self):
+        client = EventClient(self.queue_size)
+        with self.lock:
+            self.clients.add(client)
+        return client
+
+    def remove(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def events(self, client, first_event):
+        '''
+        Yields first_event, then the events published to client, with a comment every heartbeat seconds
+        to find disconnected clients
+        '''
+        try:
+            yield first_event
+            while not client.dropped:
+                try:
+                    yield client.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield b': heartbeat\n\n'
+        finally:
+            self.remove(client)
+
+
+def status_events_route(snapshot, stream):
+    '''
+    Returns a handler streaming the events of stream, starting with the JSON of snapshot, a function returning
+    (version, JSON as bytes), as event snapshot
+    '''
+    def handler(request_headers, query):
+        # listen before taking the snapshot, so no change after it is missed
+        client = stream.add()
+        version, body = snapshot()
+        first_event = format_event('snapshot', body.decode('ascii'), version)
+        headers = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'}
+        return 200, headers, stream.events(client, first_event)
+    return handler
+
+
+def status_delta_listener(stream):
+    '''
+    Returns a listener of JsonOutput publishing its deltas to stream as event delta
+    '''
+    def listener(version, delta):
+        stream.publish('delta', json.dumps(delta, ensure_ascii=True), version)
+    return listener
+
+
+class BoundedThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''
+    Handles every connection in a thread of its own, at most workers at a time. A connection waits up to timeout
+    seconds for a free worker in the accept loop, then it is closed.
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, handler, workers, timeout):
+        self.workers = threading.BoundedSemaphore(workers)
+        self.worker_timeout = timeout
+        self.active = 0
+        self.active_lock = threading.Lock()
+        socketserver.TCPServer.__init__(self, address, handler)
+        Metrics.register_gauge('web_connections', lambda: [({}, self.active)])
+
+    def process_request(self, request, client_address):
+        if not self.workers.acquire(timeout=self.worker_timeout):
+            Metrics.increment('web_connections_rejected_total')
+            self.shutdown_request(request)
+            return
+        try:
+            socketserver.ThreadingMixIn.process_request(self, request, client_address)
+        except Exception:
+            self.workers.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        with self.active_lock:
+            self.active += 1
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self.active_lock:
+                self.active -= 1
+            self.workers.release()
+
+
+def cache_control(path):
+    '''
+    Returns the Cache-Control header of a static file
+    '''
+    path = path.split('?')[0]
+    if path.endswith('/') or path.endswith('.html') or path.endswith('.json'):
+        return 'no-cache'
+    return 'max-age={0}'.format(STATIC_MAX_AGE)
+
+
+def json_response(status, value):
+    return status, {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}, json.dumps(value).encode('utf-8')
+
+
+def event_log_route(event_log, max_limit=500):
+    '''
+    Returns a handler answering queries of event_log, see EventLog.query, with the parameters currency, type, since,
+    until (seconds since the epoch), before and limit. The answer holds the events and the before of the next page.
+    '''
+    def handler(request_headers, query):
+        try:
+            since = float(query['since']) if 'since' in query else None
+            until = float(query['until']) if 'until' in query else None
+            before = int(query['before']) if 'before' in query else None
+            limit = min(int(query.get('limit', 50)), max_limit)
+        except ValueError as ex:
+            return json_response(400, {"error": str(ex)})
+        if limit < 1:
+            return json_response(400, {"error": "limit must be positive"})
+        currency = query['currency'].upper() if 'currency' in query else None
+        events = event_log.query(currency, query.get('type'), since, until, before, limit)
+        next_before = events[-1].id if len(events) == limit else None
+        return json_response(200, {"events": [event.to_dict() for event in events], "next": next_before})
+    return handler
 
 
 def initialize_web_server(config):
@@ -14,7 +239,7 @@ def initialize_web_server(config):
     Setup the web server, retrieving the configuration parameters
     and starting the web server thread
     '''
-    global web_server_ip, web_server_port, web_server_template
+    global web_server_ip, web_server_port, web_server_template, web_server_workers, web_server_timeout
 
     # Check for custom web server address
     compositeWebServerAddress = config.get('BOT', 'customWebServerAddress', '0.0.0.0').split(":")
@@ -33,6 +258,9 @@ def initialize_web_server(config):
     # Check for custom web server template
     web_server_template = config.get('BOT', 'customWebServerTemplate', 'www')
 
+    web_server_workers = int(config.get('BOT', 'webServerWorkers', 256, 1, 10000))
+    web_server_timeout = float(config.get('BOT', 'webServerTimeout', 30, 1, 3600))
+
     logger.info('Starting WebServer at {0} on port {1} with template {2}'
                 .format(web_server_ip, web_server_port, web_server_template))
 
@@ -46,7 +274,6 @@ def start_web_server():
     Start the web server
     '''
     import http.server as SimpleHTTPServer
-    import socketserver as SocketServer
     import socket
 
     try:
@@ -55,17 +282,70 @@ def start_web_server():
 
         # Do not attempt to fix code warnings in the below class, it is perfect.
         class QuietHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+            # keep connections open for the next request, closing them when idle for the timeout
+            protocol_version = 'HTTP/1.1'
+            timeout = web_server_timeout
+            static = False
+            status = None
+
             # quiet server logs
             def log_message(self, format, *args):
                 return
 
+            def send_response(self, code, message=None):
+                self.status = code
+                SimpleHTTPServer.SimpleHTTPRequestHandler.send_response(self, code, message)
+
+            def end_headers(self):
+                if self.static and self.status in (200, 304):
+                    self.send_header('Cache-Control', cache_control(self.path))
+                SimpleHTTPServer.SimpleHTTPRequestHandler.end_headers(self)
+
+            def do_HEAD(self):
+                self.static = True
+                return SimpleHTTPServer.SimpleHTTPRequestHandler.do_HEAD(self)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                handler = routes.get(url.path)
+                self.static = handler is None
+                if handler is None:
+                    return SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+                try:
+                    status, headers, body = handler(self.headers, dict(parse_qsl(url.query)))
+                except Exception as ex:
+                    logger.error('Failed to serve {0}: {1}'.format(self.path, ex))
+                    self.send_error(500)
+                    return
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if isinstance(body, bytes):
+                    if status != 304:
+                        self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    if status != 304:
+                        self.wfile.write(body)
+                    return
+                self.close_connection = True
+                self.end_headers()
+                try:
+                    for chunk in body:
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                except OSError:
+                    # disconnected, or not reading for the timeout
+                    pass
+                finally:
+                    if hasattr(body, 'close'):
+                        body.close()
+
             # serve from www folder under current working dir
             def translate_path(self, path):
                 return SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(self, '/' + web_server_template + path)
 
         global server
-        SocketServer.TCPServer.allow_reuse_address = True
-        server = SocketServer.TCPServer((host, port), QuietHandler)
+        server = BoundedThreadingServer((host, port), QuietHandler, web_server_workers, web_server_timeout)
         if host == "0.0.0.0":
             # Get all addresses that we could listen on the port specified
             addresses = [i[4][0] for i in socket.getaddrinfo(socket.gethostname().split('.')[0], port)]
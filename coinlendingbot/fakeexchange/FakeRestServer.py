@@ -0,0 +1,263 @@
+"""
+REST endpoints of Poloniex and Bitfinex (v1) served from a Market
+"""
+
+import base64
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from coinlendingbot.fakeexchange.Market import MarketError
+
+
+def _date(timestamp):
+    return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _num(value):
+    return '{:.8f}'.format(value)
+
+
+class FakeRestServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Serves Poloniex at /public and /tradingApi and Bitfinex at /v1/.
+    Every request is delayed by a random latency of 0 to 2 * latency seconds. Requests are answered with
+    429 above rate_limit requests per second (0 disables it) and at random with error_rate probability.
+    """
+    daemon_threads = True
+
+    def __init__(self, market, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, rate_limit=0):
+        super(FakeRestServer, self).__init__((host, port), FakeRestHandler)
+        self.logger = logging.getLogger(__name__)
+        self.market = market
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random()
+        self.request_times = []
+        self.rate_lock = threading.Lock()
+        self.stats = {"requests": 0, "rejected": 0}
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name=self.__class__.__name__, daemon=True)
+        thread.start()
+        return thread
+
+    def reject(self):
+        """
+        Returns True, if the request shall be answered with 429
+        """
+        with self.rate_lock:
+            self.stats["requests"] += 1
+            now = time.time()
+            self.request_times = [t for t in self.request_times if t > now - 1]
+            self.request_times.append(now)
+            rejected = (self.rate_limit and len(self.request_times) > self.rate_limit) or \
+                self.random.random() < self.error_rate
+            if rejected:
+                self.stats["rejected"] += 1
+            return rejected
+
+
+class FakeRestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self._handle(url.path, params)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf8') if length else ''
+        if url.path.startswith('/v1/'):
+            payload = self.headers.get('X-BFX-PAYLOAD')
+            params = json.loads(base64.standard_b64decode(payload).decode('utf8')) if payload else {}
+        else:
+            params = {k: v[0] for k, v in parse_qs(body).items()}
+        self._handle(url.path, params)
+
+    def _handle(self, path, params):
+        server = self.server
+        if server.latency:
+            time.sleep(server.random.uniform(0, 2 * server.latency))
+        if server.reject():
+            self._respond(429, {"error": "Please do not make more than the allowed number of API calls per second."})
+            return
+        try:
+            if path == '/public':
+                self._respond(200, PoloniexHandler(server.market).public(params))
+            elif path == '/tradingApi':
+                self._respond(200, PoloniexHandler(server.market).trading(params))
+            elif path.startswith('/v1/'):
+                status, data = BitfinexHandler(server.market).handle(path[4:], params)
+                self._respond(status, data)
+            else:
+                self._respond(404, {"error": "Not found"})
+        except MarketError as ex:
+            if path.startswith('/v1/'):
+                self._respond(400, {"message": str(ex)})
+            else:
+                self._respond(200, {"error": str(ex)})
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PoloniexHandler(object):
+    def __init__(self, market):
+        self.market = market
+
+    @staticmethod
+    def pair_ids(couples):
+        """
+        Returns the numeric ids the push API uses for the couples
+        """
+        return {couple: pair_id for pair_id, couple in enumerate(sorted(couples), 1)}
+
+    def public(self, params):
+        command = params.get('command')
+        if command == 'returnTicker':
+            ticker = {}
+            pair_ids = self.pair_ids(self.market.couples)
+            for couple, t in self.market.ticker().items():
+                ticker[couple] = {"id": pair_ids[couple], "isFrozen": "0"}
+                ticker[couple].update({k: _num(v) for k, v in t.items()})
+            return ticker
+        if command == 'return24hVolume':
+            return {couple: {couple.split('_')[0]: _num(t["baseVolume"]), couple.split('_')[1]: _num(t["quoteVolume"])}
+                    for couple, t in self.market.ticker().items()}
+        if command == 'returnLoanOrders':
+            book = self.market.loan_orders(params['currency'], int(params.get('limit', 0)))
+            return {side: [{"rate": _num(o["rate"]), "amount": _num(o["amount"]), "rangeMin": 2,
+                            "rangeMax": o["duration"]} for o in book[key]]
+                    for side, key in [("offers", "offers"), ("demands", "demands")]}
+        raise MarketError("Invalid command.")
+
+    def trading(self, params):
+        command = params.get('command')
+        market = self.market
+        if command == 'returnBalances':
+            return {cur: _num(amount) for cur, amount in market.total_balances("exchange").items()}
+        if command == 'returnAvailableAccountBalances':
+            balances = market.available_balances(params.get('account'))
+            return {account: {cur: _num(amount) for cur, amount in balances[account].items()}
+                    for account in balances if balances[account]} or []
+        if command == 'returnOpenLoanOffers':
+            offers = {}
+            for o in market.open_offers():
+                offers.setdefault(o["currency"], []).append({
+                    "id": o["id"], "rate": _num(o["rate"]), "amount": _num(o["amount"]), "duration": o["duration"],
+                    "autoRenew": o["autoRenew"], "date": _date(o["date"])})
+            return offers or []
+        if command == 'returnActiveLoans':
+            return {"provided": [{"id": loan["id"], "currency": loan["currency"], "rate": _num(loan["rate"]),
+                                  "amount": _num(loan["amount"]), "duration": loan["duration"],
+                                  "autoRenew": loan["autoRenew"], "date": _date(loan["date"]),
+                                  "fees": _num(0)} for loan in market.active_loans()],
+                    "used": []}
+        if command == 'returnLendingHistory':
+            history = market.lending_history(float(params.get('start', 0)), float(params.get('end', time.time())),
+                                             int(params.get('limit', 500)))
+            return [{"id": h["id"], "currency": h["currency"], "rate": _num(h["rate"]), "amount": _num(h["amount"]),
+                     "duration": _num(h["duration"]), "interest": _num(h["interest"]), "fee": _num(-h["fee"]),
+                     "earned": _num(h["earned"]), "open": _date(h["open"]), "close": _date(h["close"])}
+                    for h in history]
+        if command == 'createLoanOffer':
+            offer_id = market.create_offer(params['currency'], params['amount'], params['duration'],
+                                           params.get('autoRenew', 0), params['lendingRate'])
+            return {"success": 1, "message": "Loan order placed.", "orderID": offer_id}
+        if command == 'cancelLoanOffer':
+            market.cancel_offer(params['orderNumber'])
+            return {"success": 1, "message": "Loan offer canceled."}
+        if command == 'toggleAutoRenew':
+            return {"success": 1, "message": market.toggle_auto_renew(params['orderNumber'])}
+        if command == 'transferBalance':
+            market.transfer(params['currency'], params['amount'], params['fromAccount'], params['toAccount'])
+            return {"success": 1, "message": "Transferred {} {} from {} to {} account.".format(
+                params['amount'], params['currency'], params['fromAccount'], params['toAccount'])}
+        raise MarketError("Invalid command.")
+
+
+class BitfinexHandler(object):
+    WALLETS = {'deposit': 'lending', 'exchange': 'exchange', 'trading': 'margin'}
+
+    def __init__(self, market):
+        self.market = market
+
+    def handle(self, command, params):
+        market = self.market
+        if command == 'symbols':
+            return 200, sorted(self.symbols(market.couples).keys())
+        if command == 'offers':
+            return 200, [self._offer(o) for o in market.open_offers()]
+        if command == 'credits':
+            return 200, [{"id": loan["id"], "currency": loan["currency"], "rate": str(loan["rate"] * 36500),
+                          "period": loan["duration"], "amount": _num(loan["amount"]), "status": "ACTIVE",
+                          "timestamp": str(loan["date"])} for loan in market.active_loans()]
+        if command == 'balances':
+            balances = []
+            for wallet, account in BitfinexHandler.WALLETS.items():
+                available = market.available_balances(account)[account]
+                for cur, amount in market.total_balances(account).items():
+                    if amount > 1e-8:
+                        balances.append({"type": wallet, "currency": cur.lower(), "amount": _num(amount),
+                                         "available": _num(available.get(cur, 0))})
+            return 200, balances
+        if command == 'offer/new':
+            offer_id = market.create_offer(params['currency'], params['amount'], params['period'], 0,
+                                           float(params['rate']) / 36500)
+            offer = [o for o in market.open_offers() if o["id"] == offer_id]
+            return 200, self._offer(offer[0]) if offer else {"id": offer_id, "is_live": False}
+        if command == 'offer/cancel':
+            return 200, self._offer(market.cancel_offer(params['offer_id']))
+        if command == 'transfer':
+            market.transfer(params['currency'], params['amount'], BitfinexHandler.WALLETS[params['walletfrom']],
+                            BitfinexHandler.WALLETS[params['walletto']])
+            return 200, [{"status": "success", "message": "{} {} transfered from {} to {}".format(
+                params['amount'], params['currency'], params['walletfrom'], params['walletto'])}]
+        if command == 'history':
+            history = market.lending_history(float(params.get('since', 0)), float(params.get('until', time.time())),
+                                             int(params.get('limit', 500)))
+            return 200, [{"currency": h["currency"], "amount": _num(h["earned"]), "balance": _num(0),
+                          "description": "Margin Funding Payment on wallet deposit", "timestamp": str(h["close"])}
+                         for h in history if h["currency"] == params.get('currency')]
+        return 404, {"message": "Unknown command {}".format(command)}
+
+    @staticmethod
+    def symbols(couples):
+        """
+        Returns the symbols (e.g. "ethbtc") of the couples, USD is only traded as base currency
+        """
+        symbols = {}
+        for couple in couples:
+            ref, cur = couple.split('_')
+            if cur != 'USD':
+                symbols[(cur + ref).lower()] = couple
+        return symbols
+
+    @staticmethod
+    def _offer(offer):
+        return {"id": offer["id"], "currency": offer["currency"], "rate": str(offer["rate"] * 36500),
+                "period": offer["duration"], "direction": "lend", "timestamp": str(offer["date"]),
+                "is_live": True, "is_cancelled": False, "original_amount": _num(offer["amount"]),
+                "remaining_amount": _num(offer["amount"]), "executed_amount": _num(0)}
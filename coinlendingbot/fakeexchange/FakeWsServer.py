@@ -0,0 +1,180 @@
+"""
+Websocket channels of Bitfinex (v2 book and ticker) and Poloniex (ticker) served from a Market
+"""
+
+import json
+import logging
+import random
+import time
+from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory
+from twisted.internet.task import LoopingCall
+
+from coinlendingbot.fakeexchange.FakeRestServer import BitfinexHandler, PoloniexHandler
+from coinlendingbot.websocket.ExchangeWsClient import ExchangeWsClient
+
+
+class FakeWsServerProtocol(WebSocketServerProtocol):
+    """
+    Speaks the Bitfinex protocol to clients sending events and the Poloniex one to clients sending commands.
+    The authenticated Bitfinex channel isn't supported, authentication fails so the client uses REST.
+    """
+    CONF_FLAG_CHECKSUM = 131072
+    POLONIEX_TICKER = 1002
+    POLONIEX_HEARTBEAT = 1010
+
+    def __init__(self):
+        super(FakeWsServerProtocol, self).__init__()
+        self.logging = logging.getLogger(__name__)
+        self.channels = {}
+        self.books = {}
+        self.next_chan_id = 0
+        self.checksum = False
+        self.poloniex_ticker = False
+        self.next_due = 0
+
+    def onOpen(self):
+        self.factory.clients.append(self)
+        self._send({"event": "info", "version": 2})
+
+    def onClose(self, wasClean, code, reason):
+        if self in self.factory.clients:
+            self.factory.clients.remove(self)
+
+    def onMessage(self, payload, isBinary):
+        msg = json.loads(payload.decode('utf8'))
+        if not isinstance(msg, dict):
+            return
+        if "command" in msg:
+            self._poloniex_command(msg)
+            return
+        event = msg.get("event")
+        if event == "conf":
+            self.checksum = bool(msg.get("flags", 0) & FakeWsServerProtocol.CONF_FLAG_CHECKSUM)
+            self._send({"event": "conf", "status": "OK", "flags": msg.get("flags", 0)})
+        elif event == "ping":
+            self._send({"event": "pong", "ts": int(time.time() * 1000)})
+        elif event == "auth":
+            self._send({"event": "auth", "status": "FAILED", "chanId": 0, "code": 10100,
+                        "msg": "authentication not supported by the fake exchange"})
+        elif event == "subscribe":
+            self._subscribe(msg)
+        elif event == "unsubscribe":
+            if msg.get("chanId") in self.channels:
+                del self.channels[msg["chanId"]]
+                self.books.pop(msg["chanId"], None)
+                self._send({"event": "unsubscribed", "status": "OK", "chanId": msg["chanId"]})
+            else:
+                self._send({"event": "error", "msg": "unsubscribe: invalid", "code": 10400})
+        else:
+            self._send({"event": "error", "msg": "Unknown event", "code": 10000})
+
+    def _subscribe(self, msg):
+        self.next_chan_id += 1
+        chan_id = self.next_chan_id
+        if msg.get("channel") == "book" and msg.get("symbol", "")[1:] in self.factory.market.currencies:
+            channel = {"event": "subscribed", "channel": "book", "chanId": chan_id, "symbol": msg["symbol"],
+                       "prec": msg.get("prec", "P0"), "freq": msg.get("freq", "F0"), "len": msg.get("length", "25"),
+                       "currency": msg["symbol"][1:]}
+        elif msg.get("channel") == "ticker" and msg.get("symbol", "")[1:] in self.factory.pairs:
+            channel = {"event": "subscribed", "channel": "ticker", "chanId": chan_id, "symbol": msg["symbol"],
+                       "pair": msg["symbol"][1:]}
+        else:
+            self._send({"event": "error", "msg": "symbol: invalid", "code": 10300})
+            return
+        self.channels[chan_id] = channel
+        self._send(channel)
+        self.publish([chan_id])
+
+    def _poloniex_command(self, msg):
+        if msg.get("channel") != FakeWsServerProtocol.POLONIEX_TICKER:
+            return
+        self.poloniex_ticker = msg["command"] == "subscribe"
+        if self.poloniex_ticker:
+            self._send([FakeWsServerProtocol.POLONIEX_TICKER, 1])
+
+    def publish(self, chan_ids=None):
+        """
+        Sends the changes since the last publication, snapshots to channels without one
+        """
+        market = self.factory.market
+        for chan_id in chan_ids or list(self.channels.keys()):
+            channel = self.channels[chan_id]
+            if channel["channel"] == "book":
+                self._publish_book(chan_id, market.loan_orders(channel["currency"]))
+            else:
+                t = self.factory.bitfinex_ticker(channel["pair"])
+                self._send([chan_id, [t["highestBid"], 100.0, t["lowestAsk"], 100.0, 0.0, t["percentChange"],
+                                      t["last"], t["quoteVolume"], t["high24hr"], t["low24hr"]]])
+        if self.poloniex_ticker and chan_ids is None:
+            pair_ids = PoloniexHandler.pair_ids(market.couples)
+            for couple, t in market.ticker().items():
+                self._send([FakeWsServerProtocol.POLONIEX_TICKER, None, [
+                    pair_ids[couple], str(t["last"]), str(t["lowestAsk"]), str(t["highestBid"]),
+                    str(t["percentChange"]), str(t["baseVolume"]), str(t["quoteVolume"]), 0,
+                    str(t["high24hr"]), str(t["low24hr"])]])
+            self._send([FakeWsServerProtocol.POLONIEX_HEARTBEAT])
+
+    def _publish_book(self, chan_id, book):
+        entries = {}
+        for offer in book["offers"]:
+            entries[("asks", offer["rate"], offer["duration"])] = offer["amount"]
+        for demand in book["demands"]:
+            entries[("bids", demand["rate"], demand["duration"])] = -demand["amount"]
+        if chan_id not in self.books:
+            self._send([chan_id, [[rate, period, 1, amount] for (side, rate, period), amount in entries.items()]])
+        else:
+            previous = self.books[chan_id]
+            for key in previous:
+                if key not in entries:
+                    self._send([chan_id, [key[1], key[2], 0, 1 if key[0] == "asks" else -1]])
+            for key, amount in entries.items():
+                if previous.get(key) != amount:
+                    self._send([chan_id, [key[1], key[2], 1, amount]])
+        self.books[chan_id] = entries
+        if self.checksum:
+            self._send([chan_id, "cs", ExchangeWsClient.lendingbook_checksum(self._checksum_book(entries))])
+
+    @staticmethod
+    def _checksum_book(entries):
+        book = {"asks": {}, "bids": {}}
+        for (side, rate, period), amount in entries.items():
+            book[side]["{:.12f}_{:02d}".format(rate, period)] = {"rate": rate, "amount": abs(amount), "period": period}
+        return book
+
+    def _send(self, data):
+        payload = json.dumps(data).encode('utf8')
+        if not self.factory.latency:
+            self.sendMessage(payload)
+            return
+        # keep the order of the messages while delaying them
+        now = time.time()
+        self.next_due = max(self.next_due, now + self.factory.random.uniform(0, 2 * self.factory.latency))
+        self.factory.reactor.callLater(self.next_due - now, self.sendMessage, payload)
+
+
+class FakeWsServerFactory(WebSocketServerFactory):
+    """
+    Advances the market every interval seconds and publishes the changes to all clients
+    """
+    protocol = FakeWsServerProtocol
+
+    def __init__(self, market, url=None, interval=1.0, latency=0.0):
+        WebSocketServerFactory.__init__(self, url)
+        self.market = market
+        self.interval = interval
+        self.latency = latency
+        self.random = random.Random()
+        self.clients = []
+        self.pairs = {symbol.upper(): couple for symbol, couple in BitfinexHandler.symbols(market.couples).items()}
+        self.loop = LoopingCall(self.tick)
+
+    def start(self):
+        self.loop.start(self.interval, now=False)
+
+    def tick(self):
+        self.market.step()
+        for client in list(self.clients):
+            client.publish()
+
+    def bitfinex_ticker(self, pair):
+        return self.market.ticker()[self.pairs[pair]]
@@ -0,0 +1,327 @@
+"""
+Synthetic lending market with one account, used by the fake exchange servers
+"""
+
+import logging
+import math
+import random
+import threading
+import time
+
+# Reference prices in USD of the synthetic markets, other currencies get DEFAULT_PRICE
+PRICES = {
+    'USD': 1.0, 'BTC': 8000.0, 'ETH': 500.0, 'BCH': 900.0, 'LTC': 120.0, 'XMR': 150.0, 'XRP': 0.5, 'DASH': 300.0,
+    'DSH': 300.0, 'ETC': 15.0, 'ZEC': 200.0, 'EOS': 10.0, 'OMG': 8.0, 'IOT': 1.0, 'STR': 0.2, 'DOGE': 0.003
+}
+DEFAULT_PRICE = 10.0
+# Part of the interest the exchange keeps
+FEE = 0.15
+
+
+class MarketError(Exception):
+    pass
+
+
+class Market(object):
+    """
+    Keeps the lending book of every currency moving around a daily base rate, lets random demand take the
+    cheapest offers (own ones included), pays back loans with interest and keeps the balances of one account.
+    Rates are daily rates, times are unix timestamps of the clock, which defaults to the wall clock.
+    """
+    BOOK_LEVELS = 25
+
+    def __init__(self, currencies, seed=None, clock=time.time, day_seconds=86400, base_rate=0.0002,
+                 volatility=0.05, demand_per_minute=6, balance_usd=10000):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.RLock()
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.day_seconds = day_seconds
+        self.volatility = volatility
+        self.demand_per_minute = demand_per_minute
+        self.currencies = list(currencies)
+        self.initial_rates = {cur: base_rate * self.random.uniform(0.5, 2) for cur in self.currencies}
+        self.base_rates = dict(self.initial_rates)
+        self.usd_prices = {cur: PRICES.get(cur, DEFAULT_PRICE) for cur in self.currencies + ['USD', 'BTC']}
+        self.couples = self._couples()
+        self.open_prices = {couple: self.price(couple) for couple in self.couples}
+        self.books = {cur: {"offers": {}, "demands": {}} for cur in self.currencies}
+        for cur in self.currencies:
+            self._refresh_book(cur)
+        self.balances = {account: {cur: 0.0 for cur in self.currencies}
+                         for account in ["exchange", "lending", "margin"]}
+        for cur in self.currencies:
+            self.balances["lending"][cur] = balance_usd / len(self.currencies) / self.usd_prices[cur]
+        self.offers = {}
+        self.loans = {}
+        self.history = []
+        self.next_id = 100000
+        self.last_step = self.clock()
+
+    def _couples(self):
+        """
+        Couples in Poloniex notation, "BTC_ETH" is the price of ETH in BTC
+        """
+        couples = []
+        for cur in self.currencies:
+            if cur != 'BTC':
+                couples.append('BTC_' + cur)
+            if cur not in ['USD', 'BTC']:
+                couples.append('USD_' + cur)
+        if 'USD' in self.currencies and 'BTC' in self.currencies:
+            couples.append('USD_BTC')
+        return couples
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def price(self, couple):
+        ref, cur = couple.split('_')
+        return self.usd_prices[cur] / self.usd_prices[ref]
+
+    def ticker(self):
+        with self.lock:
+            ticker = {}
+            for couple in self.couples:
+                price = self.price(couple)
+                ticker[couple] = {
+                    "last": price,
+                    "lowestAsk": price * 1.001,
+                    "highestBid": price * 0.999,
+                    "percentChange": price / self.open_prices[couple] - 1,
+                    "baseVolume": 1000.0,
+                    "quoteVolume": 1000.0 / price,
+                    "high24hr": max(price, self.open_prices[couple]),
+                    "low24hr": min(price, self.open_prices[couple])
+                }
+            return ticker
+
+    def loan_orders(self, currency, limit=0):
+        """
+        Returns the book as {"offers": [...], "demands": [...]}, offers ascending and demands descending by rate.
+        Own offers are part of the book.
+        """
+        with self.lock:
+            book = self._book(currency)
+            if limit:
+                book = {"offers": book["offers"][:limit], "demands": book["demands"][:limit]}
+            return book
+
+    def _book(self, currency):
+        if currency not in self.books:
+            raise MarketError("Invalid currency {}".format(currency))
+        offers = {}
+        for level in list(self.books[currency]["offers"].values()) + \
+                [o for o in self.offers.values() if o["currency"] == currency]:
+            key = (round(level["rate"], 8), level["duration"])
+            if key in offers:
+                offers[key]["amount"] += level["amount"]
+            else:
+                offers[key] = {"rate": key[0], "amount": level["amount"], "duration": key[1]}
+        demands = [dict(d) for d in self.books[currency]["demands"].values()]
+        return {"offers": sorted(offers.values(), key=lambda o: (o["rate"], o["duration"])),
+                "demands": sorted(demands, key=lambda d: (-d["rate"], d["duration"]))}
+
+    def _refresh_book(self, currency):
+        """
+        Moves the synthetic levels: amounts change, some levels vanish and new ones appear around the base rate
+        """
+        base = self.base_rates[currency]
+        amount = 2000.0 / self.usd_prices[currency]
+        for side, sign in [("offers", 1), ("demands", -1)]:
+            levels = self.books[currency][side]
+            for key in list(levels.keys()):
+                if self.random.random() < 0.1:
+                    del levels[key]
+                else:
+                    levels[key]["amount"] *= self.random.uniform(0.8, 1.25)
+            while len(levels) < Market.BOOK_LEVELS:
+                rate = round(base * (1 + sign * self.random.expovariate(10)), 8)
+                if rate <= 0:
+                    continue
+                duration = self.random.choice([2, 2, 2, 7, 30])
+                levels[(rate, duration)] = {"rate": rate, "amount": self.random.expovariate(1 / amount),
+                                            "duration": duration}
+
+    def step(self):
+        """
+        Advances the market to the current time of the clock
+        """
+        with self.lock:
+            now = self.clock()
+            seconds = max(0.0, now - self.last_step)
+            self.last_step = now
+            for cur in self.usd_prices:
+                if cur != 'USD':
+                    self.usd_prices[cur] *= math.exp(self.random.gauss(0, 0.001 * math.sqrt(min(seconds, 3600))))
+            for cur in self.currencies:
+                drift = self.random.gauss(0, self.volatility * math.sqrt(min(seconds, 3600) / 60))
+                # mean reverting random walk around the initial rate
+                reversion = 0.05 * math.log(self.base_rates[cur] / self.initial_rates[cur])
+                self.base_rates[cur] *= math.exp(drift - reversion)
+                self._refresh_book(cur)
+                demands = self._poisson(self.demand_per_minute * seconds / 60)
+                for _ in range(demands):
+                    self._demand(cur, self.base_rates[cur] * math.exp(self.random.gauss(0, 0.3)),
+                                 self.random.expovariate(self.usd_prices[cur] / 1000.0))
+            self._return_loans(now)
+
+    def _poisson(self, mean):
+        if mean > 50:
+            return max(0, int(round(self.random.gauss(mean, math.sqrt(mean)))))
+        count = 0
+        limit = math.exp(-mean)
+        product = self.random.random()
+        while product > limit:
+            count += 1
+            product *= self.random.random()
+        return count
+
+    def _demand(self, currency, rate, amount):
+        """
+        A borrower takes offers up to rate, the cheapest first
+        """
+        candidates = [("book", key, level) for key, level in self.books[currency]["offers"].items()]
+        candidates += [("own", offer_id, offer) for offer_id, offer in self.offers.items()
+                       if offer["currency"] == currency]
+        candidates.sort(key=lambda c: c[2]["rate"])
+        for source, key, level in candidates:
+            if amount <= 0 or level["rate"] > rate:
+                break
+            taken = min(amount, level["amount"])
+            amount -= taken
+            if source == "own":
+                self._fill(key, taken)
+            else:
+                level["amount"] -= taken
+                if level["amount"] <= 1e-8:
+                    del self.books[currency]["offers"][key]
+
+    def _fill(self, offer_id, amount):
+        offer = self.offers[offer_id]
+        loan_id = self._new_id()
+        self.loans[loan_id] = {
+            "id": loan_id,
+            "currency": offer["currency"],
+            "rate": offer["rate"],
+            "amount": amount,
+            "duration": offer["duration"],
+            "autoRenew": offer["autoRenew"],
+            "date": self.clock()
+        }
+        offer["amount"] -= amount
+        if offer["amount"] <= 1e-8:
+            del self.offers[offer_id]
+        self.logger.debug("Filled {:.8f} {} at {:.8f}".format(amount, offer["currency"], offer["rate"]))
+
+    def _return_loans(self, now):
+        for loan_id in list(self.loans.keys()):
+            loan = self.loans[loan_id]
+            if now < loan["date"] + loan["duration"] * self.day_seconds:
+                continue
+            del self.loans[loan_id]
+            days = (now - loan["date"]) / self.day_seconds
+            interest = loan["amount"] * loan["rate"] * days
+            earned = interest * (1 - FEE)
+            self.history.append({
+                "id": loan_id,
+                "currency": loan["currency"],
+                "rate": loan["rate"],
+                "amount": loan["amount"],
+                "duration": days,
+                "interest": interest,
+                "fee": interest - earned,
+                "earned": earned,
+                "open": loan["date"],
+                "close": now
+            })
+            self.balances["lending"][loan["currency"]] += loan["amount"] + earned
+            if loan["autoRenew"]:
+                self.create_offer(loan["currency"], loan["amount"], loan["duration"], 1, loan["rate"])
+
+    def available_balances(self, account=None):
+        """
+        Returns the balances not on order nor lent as {account: {currency: amount}}, zero balances are left out
+        """
+        with self.lock:
+            accounts = [account] if account else list(self.balances.keys())
+            return {acc: {cur: amount for cur, amount in self.balances[acc].items() if amount > 1e-8}
+                    for acc in accounts}
+
+    def total_balances(self, account):
+        """
+        Returns the balances including offers and loans, for the lending account
+        """
+        with self.lock:
+            balances = dict(self.balances[account])
+            if account == "lending":
+                for item in list(self.offers.values()) + list(self.loans.values()):
+                    balances[item["currency"]] += item["amount"]
+            return balances
+
+    def open_offers(self):
+        with self.lock:
+            return [dict(o) for o in self.offers.values()]
+
+    def active_loans(self):
+        with self.lock:
+            return [dict(loan) for loan in self.loans.values()]
+
+    def lending_history(self, start, stop, limit=500):
+        with self.lock:
+            history = [h for h in self.history if start <= h["close"] <= stop]
+            return sorted(history, key=lambda h: h["close"], reverse=True)[:limit]
+
+    def create_offer(self, currency, amount, duration, auto_renew, rate):
+        with self.lock:
+            amount = float(amount)
+            rate = float(rate)
+            if currency not in self.books:
+                raise MarketError("Invalid currency {}".format(currency))
+            if amount <= 0 or rate <= 0:
+                raise MarketError("Invalid amount or rate.")
+            if amount > self.balances["lending"][currency] + 1e-8:
+                raise MarketError("Not enough {} available to offer.".format(currency))
+            self.balances["lending"][currency] -= amount
+            offer_id = self._new_id()
+            self.offers[offer_id] = {
+                "id": offer_id,
+                "currency": currency,
+                "rate": rate,
+                "amount": amount,
+                "duration": int(duration),
+                "autoRenew": int(auto_renew),
+                "date": self.clock()
+            }
+            # a demand above the offered rate takes it at once
+            best_demand = max([d["rate"] for d in self.books[currency]["demands"].values()] or [0])
+            if best_demand >= rate:
+                self._fill(offer_id, amount)
+            return offer_id
+
+    def cancel_offer(self, offer_id):
+        with self.lock:
+            offer = self.offers.pop(int(offer_id), None)
+            if offer is None:
+                raise MarketError("Invalid loan offer number.")
+            self.balances["lending"][offer["currency"]] += offer["amount"]
+            return offer
+
+    def toggle_auto_renew(self, loan_id):
+        with self.lock:
+            item = self.loans.get(int(loan_id)) or self.offers.get(int(loan_id))
+            if item is None:
+                raise MarketError("Invalid order number.")
+            item["autoRenew"] = 1 - item["autoRenew"]
+            return item["autoRenew"]
+
+    def transfer(self, currency, amount, from_account, to_account):
+        with self.lock:
+            amount = float(amount)
+            if from_account not in self.balances or to_account not in self.balances:
+                raise MarketError("Invalid account.")
+            if amount <= 0 or amount > self.balances[from_account].get(currency, 0) + 1e-8:
+                raise MarketError("Not enough {} available.".format(currency))
+            self.balances[from_account][currency] -= amount
+            self.balances[to_account][currency] = self.balances[to_account].get(currency, 0) + amount
@@ -0,0 +1,5 @@
+from coinlendingbot.fakeexchange.Market import Market, MarketError
+from coinlendingbot.fakeexchange.FakeRestServer import FakeRestServer
+from coinlendingbot.fakeexchange.FakeWsServer import FakeWsServerFactory, FakeWsServerProtocol
+
+__all__ = ["Market", "MarketError", "FakeRestServer", "FakeWsServerFactory", "FakeWsServerProtocol"]
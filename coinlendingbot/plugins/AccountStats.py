@@ -1,9 +1,20 @@
 # coding=utf-8
+import coinlendingbot.Clock as Clock
+import coinlendingbot.RequestTracker as RequestTracker
+import coinlendingbot.Storage as Storage
 from coinlendingbot.plugins.Plugin import Plugin
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import sqlite3
 
+DB_PATH = "market_data/loan_history.sqlite3"
 DB_VERSION = 2
 BITCOIN_GENESIS_BLOCK_DATE = "2009-01-03 18:15:05"
+# the history before the start of the bot is fetched in windows of days, by threads, for a few seconds every round,
+# so the offers of the round aren't held up for long
+BACKFILL_WINDOW_DAYS = 30
+BACKFILL_WORKERS = 4
+BACKFILL_ROUND_SECONDS = 5
+BACKFILL_LIMIT = 5000
 DB_DROP = "DROP TABLE IF EXISTS history"
 DB_CREATE = "CREATE TABLE IF NOT EXISTS history(" \
             "id INTEGER NOT NULL, open TIMESTAMP, close TIMESTAMP," \
@@ -15,12 +26,28 @@ DB_INSERT = "INSERT OR REPLACE INTO 'history'" \
             " VALUES (?,?,?,?,?,?,?,?,?,?);"
 DB_GET_LAST_TIMESTAMP = "SELECT max(close) as last_timestamp FROM 'history'"
 DB_GET_FIRST_TIMESTAMP = "SELECT min(close) as first_timestamp FROM 'history'"
-DB_GET_TOTAL_EARNED = "SELECT sum(earned) as total_earned, currency FROM 'history' GROUP BY currency"
-DB_GET_YESTERDAY_EARNINGS = "SELECT sum(earned) as total_earned, currency FROM 'history' " \
-                            "WHERE close BETWEEN datetime('now', 'start of day', '-1 day') " \
-                            "AND datetime('now','start of day') GROUP BY currency"
-DB_GET_TODAYS_EARNINGS = "SELECT sum(earned) as total_earned, currency FROM 'history' " \
-                         "WHERE close > datetime('now','start of day') GROUP BY currency"
+DB_CREATE_INDEXES = ["CREATE INDEX IF NOT EXISTS history_close ON history(close)",
+                     "CREATE INDEX IF NOT EXISTS history_currency_close ON history(currency, close)"]
+# the earnings per currency and day of the history, updated with every loan fetched
+DB_CREATE_DAILY_EARNINGS = "CREATE TABLE IF NOT EXISTS daily_earnings(" \
+                           "currency TEXT NOT NULL, day TEXT NOT NULL, earned NUMBER, loans INTEGER," \
+                           " PRIMARY KEY(currency, day)) WITHOUT ROWID"
+DB_DROP_DAILY_EARNINGS = "DROP TABLE IF EXISTS daily_earnings"
+DB_UPDATE_DAILY_EARNINGS = "INSERT OR REPLACE INTO daily_earnings(currency, day, earned, loans)" \
+                           " SELECT ?, ?, round(SUM(earned), 8), COUNT(*) FROM history" \
+                           " WHERE currency = ? AND close >= ? AND close < date(?, '+1 day')"
+DB_REBUILD_DAILY_EARNINGS = "INSERT OR REPLACE INTO daily_earnings(currency, day, earned, loans)" \
+                            " SELECT currency, date(close), round(SUM(earned), 8), COUNT(*) FROM history" \
+                            " GROUP BY currency, date(close)"
+# how far the history of a stream, all currencies or one, is fetched back. The stream '' is all of them.
+DB_CREATE_BACKFILL = "CREATE TABLE IF NOT EXISTS backfill(" \
+                     "stream TEXT PRIMARY KEY, cursor INTEGER NOT NULL, done INTEGER NOT NULL DEFAULT 0)"
+DB_DROP_BACKFILL = "DROP TABLE IF EXISTS backfill"
+DB_START_BACKFILL = "INSERT OR IGNORE INTO backfill(stream, cursor) VALUES (?, ?)"
+DB_UPDATE_BACKFILL = "UPDATE backfill SET cursor = ?, done = ? WHERE stream = ?"
+DB_GET_BACKFILL = "SELECT stream, cursor FROM backfill WHERE done = 0"
+DB_GET_TOTAL_EARNED = "SELECT sum(earned) as total_earned, currency FROM daily_earnings GROUP BY currency"
+DB_GET_DAY_EARNINGS = "SELECT earned, currency FROM daily_earnings WHERE day = date(?, 'unixepoch')"
 
 
 class AccountStats(Plugin):
@@ -42,68 +69,56 @@ class AccountStats(Plugin):
     def after_lending(self):
         if self.get_db_version() > 0 \
                 and self.last_notification != 0 \
-                and self.last_notification + self.report_interval > sqlite3.time.time():
+                and self.last_notification + self.report_interval > Clock.time():
             return
         self.update_history()
         self.notify_stats()
 
     # noinspection PyAttributeOutsideInit
     def init_db(self):
-        self.db = sqlite3.connect('market_data/loan_history.sqlite3')
-        self.db.execute(DB_CREATE)
-        self.db.commit()
+        self.db = Storage.open_db(DB_PATH, 'account_stats')
+        self.db.write(create_tables)
 
     def check_upgrade(self):
         if 0 < self.get_db_version() < DB_VERSION:
             # drop table and set version to 0 to reinitialize db to new version.
-            self.db.execute(DB_DROP)
-            self.set_db_version(0)
-            self.db.commit()
-            self.db.execute(DB_CREATE)
-            self.db.commit()
+            self.db.write(upgrade_tables)
             self.log.log('Upgraded AccountStats DB  to version ' + str(DB_VERSION))
 
     def update_history(self):
         # timestamps are in UTC
         last_time_stamp = self.get_last_timestamp()
+        now = Clock.time()
 
         if last_time_stamp is None:
-            # no entries means db is empty and needs initialization
-            last_time_stamp = BITCOIN_GENESIS_BLOCK_DATE
-            self.db.execute("PRAGMA user_version = 0")
+            # no entries means db is empty and needs initialization, the history before now is backfilled
+            self.set_db_version(0)
+            self.start_backfill(now)
+        else:
+            self.fetch_history(self.api.create_time_stamp(last_time_stamp), now)
 
-        self.fetch_history(self.api.create_time_stamp(last_time_stamp), sqlite3.time.time())
+        if self.get_db_version() == 0:
+            first_time_stamp = self.get_first_timestamp()
+            # a history backfilled by an older version of the bot goes on from its first loan
+            self.start_backfill(self.api.create_time_stamp(first_time_stamp) if first_time_stamp else now)
+            if HistoryBackfill(self).run(BACKFILL_ROUND_SECONDS):
+                # if we reached here without errors means we managed to fetch all the history, db is ready.
+                self.set_db_version(DB_VERSION)
 
-        # Fetch history in batches, loop to make sure we got everything
-        if (self.get_db_version() == 0) and (self.get_first_timestamp() is not None):
-            last_time_stamp = BITCOIN_GENESIS_BLOCK_DATE
-            loop = True
-            while loop:
-                sqlite3.time.sleep(10)  # delay a bit, try not to annoy exchange
-                first_time_stamp = self.get_first_timestamp()
-                count = self.fetch_history(self.api.create_time_stamp(last_time_stamp),
-                                           self.api.create_time_stamp(first_time_stamp))
-                loop = count != 0
-
-            # if we reached here without errors means we managed to fetch all the history, db is ready.
-            self.set_db_version(DB_VERSION)
+    def start_backfill(self, cursor):
+        streams = self.all_currencies if self.api.LENDING_HISTORY_PER_CURRENCY else ['']
+        self.db.executemany(DB_START_BACKFILL, [(stream, int(cursor)) for stream in streams])
 
     def set_db_version(self, version):
         self.db.execute("PRAGMA user_version = " + str(version))
 
     def get_db_version(self):
-        return self.db.execute("PRAGMA user_version").fetchone()[0]
+        return self.db.query_one("PRAGMA user_version")[0]
 
     def fetch_history(self, first_time_stamp, last_time_stamp):
         history = self.api.return_lending_history(first_time_stamp, last_time_stamp - 1, 5000)
-        loans = []
-        for loan in history:
-            loans.append(
-                [loan['id'], loan['open'], loan['close'], loan['duration'], loan['interest'],
-                 loan['rate'], loan['currency'], loan['amount'], loan['earned'], loan['fee']])
-        self.db.executemany(DB_INSERT, loans)
-        self.db.commit()
-        count = len(loans)
+        self.store_history(history)
+        count = len(history)
         self.log.log('Downloaded ' + str(count) + ' loans history '
                      + sqlite3.datetime.datetime.utcfromtimestamp(first_time_stamp).strftime('%Y-%m-%d %H:%M:%S')
                      + ' to ' + sqlite3.datetime.datetime.utcfromtimestamp(last_time_stamp - 1).strftime(
@@ -112,81 +127,191 @@ class AccountStats(Plugin):
             self.log.log('Last: ' + history[0]['close'] + ' First:' + history[count - 1]['close'])
         return count
 
+    def store_history(self, history, backfill=None):
+        """
+        Stores the loans of history with their daily earnings, and the backfill (cursor, done, stream) of the stream
+        they were fetched for, all in one transaction
+        """
+        loans = []
+        for loan in history:
+            loans.append(
+                [loan['id'], loan['open'], loan['close'], loan['duration'], loan['interest'],
+                 loan['rate'], loan['currency'], loan['amount'], loan['earned'], loan['fee']])
+
+        def store(db):
+            db.executemany(DB_INSERT, loans)
+            update_daily_earnings(db, set((loan[6], str(loan[2])[:10]) for loan in loans))
+            if backfill is not None:
+                db.execute(DB_UPDATE_BACKFILL, backfill)
+        self.db.write(store)
+
     def get_last_timestamp(self):
-        cursor = self.db.execute(DB_GET_LAST_TIMESTAMP)
-        row = cursor.fetchone()
-        cursor.close()
-        return row[0]
+        return self.db.query_one(DB_GET_LAST_TIMESTAMP)[0]
 
     def get_first_timestamp(self):
-        cursor = self.db.execute(DB_GET_FIRST_TIMESTAMP)
-        row = cursor.fetchone()
-        cursor.close()
-        return row[0]
+        return self.db.query_one(DB_GET_FIRST_TIMESTAMP)[0]
 
     def notify_stats(self):
         if (self.get_db_version() == 0) and (self.get_first_timestamp() is not None):
-            # only log an error if there are actually loans in DB
-            self.log.log_error('AccountStats DB isn\'t ready.')
+            # only log an error if there are actually loans in DB, a running backfill logs its progress itself
+            if not self.db.query(DB_GET_BACKFILL):
+                self.log.log_error('AccountStats DB isn\'t ready.')
             return
 
         self.earnings = {}
         output = ''
-
-        # Today's earnings
-        cursor = self.db.execute(DB_GET_TODAYS_EARNINGS)
-        row = cursor.fetchone()
-        if row is not None:
-            while row is not None:
-                if row[1] not in self.all_currencies:
-                    continue
-                output += self.format_value(row[0]) + ' ' + str(row[1]) + ' Today\n'
-                if row[1] not in self.earnings:
-                    self.earnings[row[1]] = {}
-                self.earnings[row[1]]['todayEarnings'] = row[0]
-                row = cursor.fetchone()
-        else:
-            output += 'None Today\n'
-        cursor.close()
-
-        # Yesterday's earnings
-        cursor = self.db.execute(DB_GET_YESTERDAY_EARNINGS)
-        row = cursor.fetchone()
-        if row is not None:
-            while row is not None:
-                if row[1] not in self.all_currencies:
-                    continue
-                output += self.format_value(row[0]) + ' ' + str(row[1]) + ' Yesterday\n'
-                if row[1] not in self.earnings:
-                    self.earnings[row[1]] = {}
-                self.earnings[row[1]]['yesterdayEarnings'] = row[0]
-                row = cursor.fetchone()
-        else:
-            output += 'None Yesterday\n'
-        cursor.close()
-
-        # Total Earnings
-        cursor = self.db.execute(DB_GET_TOTAL_EARNED)
-        row = cursor.fetchone()
-        if row is not None:
-            while row is not None:
-                if row[1] not in self.all_currencies:
-                    continue
-                output += self.format_value(row[0]) + ' ' + str(row[1]) + ' in total\n'
-                if row[1] not in self.earnings:
-                    self.earnings[row[1]] = {}
-                self.earnings[row[1]]['totalEarnings'] = row[0]
-                row = cursor.fetchone()
-        else:
-            output += 'Unknown total earnings.\n'
-        cursor.close()
+        now = Clock.time()
+        output += self.add_earnings(self.db.query(DB_GET_DAY_EARNINGS, (now,)), 'todayEarnings', 'Today',
+                                    'None Today\n')
+        output += self.add_earnings(self.db.query(DB_GET_DAY_EARNINGS, (now - 86400,)), 'yesterdayEarnings',
+                                    'Yesterday', 'None Yesterday\n')
+        output += self.add_earnings(self.db.query(DB_GET_TOTAL_EARNED), 'totalEarnings', 'in total',
+                                    'Unknown total earnings.\n')
 
         if output != '':
-            self.last_notification = sqlite3.time.time()
+            self.last_notification = Clock.time()
             output = 'Earnings:\n----------\n' + output
             self.log.notify(output, self.notify_config)
             self.log.log(output)
 
+    def add_earnings(self, rows, key, label, missing):
+        """
+        Keeps the earnings of the rows (earned, currency) under key, returns them as lines of the notification, or
+        missing without any
+        """
+        output = ''
+        for earned, currency in rows:
+            if currency not in self.all_currencies:
+                continue
+            output += self.format_value(earned) + ' ' + str(currency) + ' ' + label + '\n'
+            self.earnings.setdefault(currency, {})[key] = earned
+        return output or missing
+
     @staticmethod
     def format_value(value):
         return '{0:0.12f}'.format(float(value)).rstrip('0').rstrip('.')
+
+
+class HistoryBackfill(object):
+    """
+    Fetches the lending history backwards from the cursors in table backfill, a window of BACKFILL_WINDOW_DAYS at a
+    time, for every stream: all currencies, or each currency on exchanges with LENDING_HISTORY_PER_CURRENCY.
+    Up to BACKFILL_WORKERS windows are fetched at once, spaced by the request limiter of the exchange, while the
+    plugin thread stores the windows of every stream in order. Every window is committed with the cursor of its
+    stream, so a restarted bot goes on where it stopped.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.api = stats.api
+        self.genesis = stats.api.create_time_stamp(BITCOIN_GENESIS_BLOCK_DATE)
+
+    def window_start(self, cursor):
+        return max(cursor - BACKFILL_WINDOW_DAYS * 86400, self.genesis)
+
+    def fetch_window(self, stream, cursor):
+        """
+        Returns the loans of stream closed in the window before cursor, the start of the window, and whether there
+        are no loans before the window
+        """
+        RequestTracker.set_caller('AccountStats')
+        currency = stream or None
+        start = self.window_start(cursor)
+        end = cursor
+        history = []
+        while True:
+            page = self.api.return_lending_history(start, end - 1, BACKFILL_LIMIT, currency)
+            history += page
+            if len(page) < BACKFILL_LIMIT:
+                break
+            # the window holds more loans than a page, go on before the oldest loan of the page
+            oldest = min(self.api.create_time_stamp(loan['close']) for loan in page)
+            if oldest + 1 >= end:
+                break
+            end = oldest + 1
+        # the history per currency is filtered from a ledger, whose limit counts other entries too, so an empty
+        # window can't tell there are no loans before it
+        finished = start <= self.genesis or (
+            not history and not self.api.LENDING_HISTORY_PER_CURRENCY
+            and not self.api.return_lending_history(self.genesis, start - 1, 1, currency))
+        return history, start, finished
+
+    def run(self, seconds):
+        """
+        Fetches windows until all streams are done, returning True, or for about seconds, returning False
+        """
+        cursors = dict(self.stats.db.query(DB_GET_BACKFILL))
+        if not cursors:
+            return True
+        deadline = Clock.time() + seconds
+        next_cursors = dict(cursors)
+        fetched = {stream: {} for stream in cursors}
+        in_flight = {stream: 0 for stream in cursors}
+        pending = {}
+        with ThreadPoolExecutor(BACKFILL_WORKERS) as pool:
+            try:
+                while True:
+                    while len(pending) < BACKFILL_WORKERS and Clock.time() < deadline:
+                        streams = [stream for stream in cursors if next_cursors[stream] > self.genesis]
+                        if not streams:
+                            break
+                        stream = min(streams, key=lambda name: in_flight[name])
+                        cursor = next_cursors[stream]
+                        pending[pool.submit(self.fetch_window, stream, cursor)] = (stream, cursor)
+                        in_flight[stream] += 1
+                        next_cursors[stream] = self.window_start(cursor)
+                    if not pending:
+                        break
+                    done, unused = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stream, cursor = pending.pop(future)
+                        in_flight[stream] -= 1
+                        if stream in cursors:
+                            fetched[stream][cursor] = future.result()
+                            self.store_windows(stream, cursors, fetched[stream])
+            finally:
+                for future in pending:
+                    future.cancel()
+        return not cursors
+
+    def store_windows(self, stream, cursors, fetched):
+        """
+        Stores the windows fetched for stream that follow its cursor, windows fetched early wait for the ones before
+        """
+        while stream in cursors and cursors[stream] in fetched:
+            history, start, finished = fetched.pop(cursors[stream])
+            self.stats.store_history(history, (start, 1 if finished else 0, stream))
+            self.stats.log.log('Backfilled {0} loans {1}since {2}'.format(
+                len(history), stream + ' ' if stream else '',
+                sqlite3.datetime.datetime.utcfromtimestamp(start).strftime('%Y-%m-%d')))
+            if finished:
+                del cursors[stream]
+            else:
+                cursors[stream] = start
+
+
+def create_tables(db):
+    db.execute(DB_CREATE)
+    for index in DB_CREATE_INDEXES:
+        db.execute(index)
+    db.execute(DB_CREATE_DAILY_EARNINGS)
+    db.execute(DB_CREATE_BACKFILL)
+    if db.execute("SELECT 1 FROM daily_earnings LIMIT 1").fetchone() is None:
+        # the history of a bot without the table yet, or a new one
+        db.execute(DB_REBUILD_DAILY_EARNINGS)
+
+
+def upgrade_tables(db):
+    db.execute(DB_DROP)
+    db.execute(DB_DROP_DAILY_EARNINGS)
+    db.execute(DB_DROP_BACKFILL)
+    db.execute("PRAGMA user_version = 0")
+    create_tables(db)
+
+
+def update_daily_earnings(db, days):
+    """
+    Sums up again the earnings of days, a set of (currency, 'YYYY-MM-DD')
+    """
+    for currency, day in days:
+        db.execute(DB_UPDATE_DAILY_EARNINGS, (currency, day, currency, day, day))
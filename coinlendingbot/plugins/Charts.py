@@ -1,10 +1,15 @@
 # coding=utf-8
+import coinlendingbot.Clock as Clock
+import coinlendingbot.Storage as Storage
+import coinlendingbot.WebServer as WebServer
 from coinlendingbot.plugins.Plugin import Plugin
 import os
 import json
-import sqlite3
 
 DB_PATH = "market_data/loan_history.sqlite3"
+# the first day of the period of a day by resolution
+PERIODS = {'day': "day", 'week': "date(day, '-6 days', 'weekday 1')", 'month': "strftime('%Y-%m-01', day)"}
+
 
 class Charts(Plugin):
 
@@ -13,55 +18,82 @@ class Charts(Plugin):
 
         # If there's no history database, can't use this
         if not os.path.isfile(DB_PATH):
-          self.log.log_error("DB Doesn't Exist. 'AccountStats' plugin must be enabled.")
-          return
+            self.log.log_error("DB Doesn't Exist. 'AccountStats' plugin must be enabled.")
+            return
 
-        self.log.addSectionLog("plugins", "charts", { 'navbar': True })
+        self.log.addSectionLog("plugins", "charts", {'navbar': True})
 
-        self.db = sqlite3.connect('market_data/loan_history.sqlite3')
+        # the earnings per day in table daily_earnings are kept up to date by AccountStats
+        self.db = Storage.open_db(DB_PATH, 'account_stats')
         self.last_dump = 0
         self.dump_interval = int(self.config.get("CHARTS", "DumpInterval", 21600))
         self.history_file = self.config.get("CHARTS", "HistoryFile", "www/history.json")
-
+        WebServer.add_route('/api/charts', self.charts_route)
 
     def before_lending(self):
         return
 
-
     def after_lending(self):
-        if self.get_db_version() > 0 and self.last_dump + self.dump_interval < sqlite3.time.time():
+        if self.get_db_version() > 0 and self.last_dump + self.dump_interval < Clock.time():
             self.dump_history()
-            self.last_dump = sqlite3.time.time()
-
+            self.last_dump = Clock.time()
 
     def get_db_version(self):
-        return self.db.execute("PRAGMA user_version").fetchone()[0]
-
+        return self.db.query_one("PRAGMA user_version")[0]
+
+    @staticmethod
+    def query_history(db, currency=None, since=None, until=None, resolution='day'):
+        """
+        Returns {currency: [[timestamp, earned, running total], ...]} with the earnings per period of resolution,
+        day, week or month, starting with the period holding since. The timestamps are the starts of the periods.
+        """
+        period = PERIODS[resolution]
+        if currency is None:
+            currencies = [row[0] for row in
+                          db.query("SELECT DISTINCT currency FROM daily_earnings ORDER BY currency DESC")]
+        else:
+            currencies = [currency]
+        start = None
+        if since is not None:
+            start = db.query_one("SELECT {0} FROM (SELECT date(?, 'unixepoch') AS day)".format(period), (since,))[0]
+        end = None if until is None else db.query_one("SELECT date(?, 'unixepoch')", (until,))[0]
+        data = {}
+        for coin in currencies:
+            running_total = 0.0
+            if start is not None:
+                running_total = db.query_one("SELECT SUM(earned) FROM daily_earnings WHERE currency = ? AND day < ?",
+                                             (coin, start))[0] or 0.0
+            rows = db.query("SELECT CAST(strftime('%s', {0}) AS INTEGER) ts, round(SUM(earned), 8)"
+                            " FROM daily_earnings WHERE currency = ? AND day >= ? AND day <= ?"
+                            " GROUP BY ts ORDER BY ts".format(period),
+                            (coin, start or '', end or '9999-12-31'))
+            data[coin] = []
+            for ts, earned in rows:
+                running_total += float(earned)
+                data[coin].append([ts, float(earned), round(running_total, 8)])
+        return data
+
+    def charts_route(self, request_headers, query):
+        """
+        Answers /api/charts with the earnings of query_history. The parameters currency, since, until (seconds since
+        the epoch) and resolution are optional.
+        """
+        try:
+            since = int(query['since']) if 'since' in query else None
+            until = int(query['until']) if 'until' in query else None
+        except ValueError as ex:
+            return WebServer.json_response(400, {"error": str(ex)})
+        resolution = query.get('resolution', 'day')
+        if resolution not in PERIODS:
+            return WebServer.json_response(400, {"error": "resolution must be one of " + ", ".join(PERIODS)})
+        currency = query['currency'].upper() if 'currency' in query else None
+        return WebServer.json_response(200, self.query_history(self.db, currency, since, until, resolution))
 
     def dump_history(self):
-
-        cursor = self.db.cursor()
-
-        data = { }
-
-        # Get distinct coins
-        cursor.execute("SELECT DISTINCT currency FROM history ORDER BY currency DESC")
-        for i in cursor:
-            data[i[0]] = []
-
-        # Loop over the coins and get data for each
-        for coin in data:
-            runningTotal = 0.0
-
-            cursor.execute("SELECT strftime('%%s', strftime('%%Y-%%m-%%d 00:00:00', close)) ts, round(SUM(earned), 8) i " \
-                           "FROM history WHERE currency = '%s' GROUP BY ts ORDER BY ts" % (coin));
-            for row in cursor:
-                runningTotal += float(row[1])
-                data[coin].append([ int(row[0]), float(row[1]), float(runningTotal) ])
+        data = self.query_history(self.db)
 
         # Dump data to file
         with open(self.history_file, "w") as hist:
             hist.write(json.dumps(data))
 
         self.log.log("Charts Plugin: History dumped. You can open charts.html.")
-        cursor.close()
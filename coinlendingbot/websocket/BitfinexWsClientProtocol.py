@@ -1,7 +1,11 @@
 from autobahn.twisted.websocket import WebSocketClientProtocol
+import hashlib
+import hmac
 import logging
 import json
 
+import coinlendingbot.Nonce as Nonce
+
 
 class BitfinexWsClientProtocol(WebSocketClientProtocol):
     RESPONSE_CODE = {
@@ -20,13 +24,22 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
         # Info Codes
         "20051": "Stop/Restart Websocket Server",
         "20060": "Entering in Maintenance mode",
-        "20061": "Maintenance ended"
+        "20061": "Maintenance ended",
+        # Error Codes Authentication
+        "10100": "Authentication failure",
+        "10111": "Authentication failure: Invalid payload",
+        "10112": "Authentication failure: Invalid signature",
+        "10113": "Authentication failure: Invalid nonce",
+        "10114": "Authentication failure: Invalid api key"
         }
+    # Configuration flag enabling the checksum messages of order books
+    CONF_FLAG_CHECKSUM = 131072
 
     def __init__(self):
         super(BitfinexWsClientProtocol, self).__init__()
         self.logging = logging.getLogger(__name__)
         self.channels = {}
+        self.resyncing = set()
 
     def onConnect(self, request):
         pass
@@ -34,20 +47,36 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
     def onOpen(self):
         self.logging.info("WS opened")
         self.channels = {}
+        self.resyncing = set()
+        self._send({'event': 'conf', 'flags': BitfinexWsClientProtocol.CONF_FLAG_CHECKSUM})
         self.factory.websocket_opened(self)
         self.ping()
 
     def onClose(self, wasClean, code, reason):
         self.logging.info("WS closed: code {0}, reason: {1}".format(code, reason))
+        self.factory.data_processing('auth', 'closed', {})
         self.factory.websocket_closed()
 
     def onMessage(self, payload, isBinary):
         msg = json.loads(payload.decode('utf8'))
+        self.factory.message_received(self._channel_name(msg), payload)
         if isinstance(msg, dict):
             self._received_event(msg)
         elif isinstance(msg, list):
             self._received_data(msg)
 
+    def _channel_name(self, msg):
+        if not isinstance(msg, list):
+            return "events"
+        if msg[0] == 0:
+            return "auth"
+        channel = self.channels.get(msg[0])
+        if channel is None:
+            return "unknown"
+        if channel["channel"] == "book":
+            return "book:{}".format(channel["currency"])
+        return "{}:{}".format(channel["channel"], channel.get("pair"))
+
     def ping(self):
         self._send({'event': 'ping'})
         self.factory.reactor.callLater(5, self.ping)
@@ -57,6 +86,16 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
         event = msg["event"]
         if event in ["info", "pong"]:
             pass
+        elif event == "conf":
+            if msg.get("status") != "OK":
+                self.logging.error("Configuration response: {}".format(msg))
+        elif event == "auth":
+            if msg["status"] == "OK":
+                self.channels[0] = {"channel": "auth"}
+                self.factory.data_processing('auth', 'authenticated', {})
+            else:
+                self.logging.error("Authentication failed: {}".format(msg))
+                self.factory.data_processing('auth', 'closed', {})
         elif event == "subscribed":
             # New subscribed channels
             self.channels[msg["chanId"]] = msg
@@ -64,8 +103,10 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
             if msg["status"] == "OK":
                 channel = self.channels[msg["chanId"]]["channel"]
                 if channel == "book":
-                    self.factory.data_processing('lendingbook', 'remove',
-                                                 {"symbol": self.channels[msg["chanId"]]["currency"]})
+                    currency = self.channels[msg["chanId"]]["currency"]
+                    # keep the stale book of a resyncing currency until the new snapshot replaces it
+                    if currency not in self.resyncing:
+                        self.factory.data_processing('lendingbook', 'remove', {"symbol": currency})
                 elif channel == "ticker":
                     self.factory.data_processing('ticker', 'remove',
                                                  {"pair": self.channels[msg["chanId"]]["pair"]})
@@ -74,12 +115,18 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
                 self.logging.error("Unsubscribe response: {}".format(msg))
         elif event == "error":
             code = str(msg["code"])
-            self.logging.error("{} {}".format(BitfinexWsClientProtocol.RESPONSE_CODE[code], msg))
+            self.logging.error("{} {}".format(BitfinexWsClientProtocol.RESPONSE_CODE.get(code, "Error"), msg))
+            symbol = msg.get("symbol") or msg.get("pair")
+            if msg.get("channel") == "ticker" and symbol:
+                self.factory.data_processing('ticker', 'error', {"pair": symbol[1:] if symbol[0] == "t" else symbol})
         else:
             self.logging.error("event unknown: {}".format(msg))
 
     def _received_data(self, msg):
         chanId = msg[0]
+        if chanId == 0:
+            self._received_auth_data(msg)
+            return
         if chanId not in self.channels:
             self.logging.error("Channel unknown: {} : {}".format(chanId, msg))
             return
@@ -87,6 +134,8 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
         if isinstance(data, str):
             if data == "hb":
                 self._heart_beat(chanId)
+            elif data == "cs":
+                self._checksum(chanId, msg[2])
         else:
             channel = self.channels[chanId]["channel"]
             if channel == "book":
@@ -94,6 +143,96 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
             elif channel == "ticker":
                 self._update_ticker(self.channels[chanId]["pair"], data)
 
+    def _received_auth_data(self, msg):
+        msg_type = msg[1]
+        if msg_type == "hb":
+            return
+        data = msg[2]
+        if msg_type == "ws":
+            wallets = [self._wallet(w) for w in data]
+            self.factory.data_processing('wallet', 'snapshot', {"wallets": wallets})
+            self._calc_wallets(wallets)
+        elif msg_type == "wu":
+            wallet = self._wallet(data)
+            self.factory.data_processing('wallet', 'update', {"wallet": wallet})
+            self._calc_wallets([wallet])
+        elif msg_type == "fos":
+            self.factory.data_processing('funding_offer', 'snapshot',
+                                         {"funding_offers": [self._funding_offer(o) for o in data]})
+        elif msg_type in ["fon", "fou"]:
+            self.factory.data_processing('funding_offer', 'update', {"funding_offer": self._funding_offer(data)})
+        elif msg_type == "foc":
+            self.factory.data_processing('funding_offer', 'delete', {"funding_offer": self._funding_offer(data)})
+        elif msg_type == "fcs":
+            self.factory.data_processing('funding_credit', 'snapshot',
+                                         {"funding_credits": [self._funding_credit(c) for c in data]})
+        elif msg_type in ["fcn", "fcu"]:
+            self.factory.data_processing('funding_credit', 'update', {"funding_credit": self._funding_credit(data)})
+        elif msg_type == "fcc":
+            self.factory.data_processing('funding_credit', 'delete', {"funding_credit": self._funding_credit(data)})
+        elif msg_type == "n":
+            self._notification(data)
+
+    def _notification(self, data):
+        notify_type = data[1]
+        if notify_type in ["fon-req", "foc-req"]:
+            # confirmation of a request sent by submit_funding_offer / cancel_funding_offer
+            offer = data[4]
+            self.factory.data_processing('request', 'confirmation', {
+                "type": notify_type,
+                "funding_offer": self._funding_offer(offer) if isinstance(offer, list) and offer[1] else None,
+                "status": data[6],
+                "text": data[7]
+            })
+        elif data[6] in ["ERROR", "FAILURE"]:
+            self.logging.error("Notification: {}".format(data))
+
+    @staticmethod
+    def _wallet(data):
+        return {
+            "type": data[0],
+            "currency": data[1],
+            "balance": data[2],
+            "unsettled_interest": data[3],
+            "available": data[4]
+        }
+
+    @staticmethod
+    def _funding_offer(data):
+        return {
+            "id": data[0],
+            "currency": data[1][1:],
+            "mts_created": data[2],
+            "mts_updated": data[3],
+            "amount": data[4],
+            "amount_orig": data[5],
+            "type": data[6],
+            "status": data[10],
+            "rate": data[14],
+            "period": data[15]
+        }
+
+    @staticmethod
+    def _funding_credit(data):
+        return {
+            "id": data[0],
+            "currency": data[1][1:],
+            "side": data[2],
+            "mts_created": data[3],
+            "mts_updated": data[4],
+            "amount": data[5],
+            "status": data[7],
+            "rate": data[11],
+            "period": data[12],
+            "mts_opening": data[13]
+        }
+
+    def _calc_wallets(self, wallets):
+        # The available balance is only sent on request
+        calc = [["wallet_{}_{}".format(w["type"], w["currency"])] for w in wallets if w["available"] is None]
+        if calc:
+            self._send([0, "calc", None, calc])
+
     def _heart_beat(self, chanId):
         channel = self.channels[chanId]["channel"]
         if channel == "book":
@@ -105,27 +244,51 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
                 "pair": self.channels[chanId]["pair"]
             })
 
+    def _checksum(self, chanId, checksum):
+        currency = self.channels[chanId]["currency"]
+        if currency in self.resyncing:
+            # checksums of the old subscription are meaningless until the new snapshot arrived
+            return
+        self.factory.data_processing("lendingbook", "checksum", {
+            "symbol": currency,
+            "checksum": checksum
+        })
+
     def _update_book(self, symbol, data):
-        values = data if isinstance(data[0], list) else [data]
-        for val in values:
-            rate, period, count, amount = val
+        if len(data) == 0 or isinstance(data[0], list):
+            self._snapshot_book(symbol, data)
+            return
+        rate, period, count, amount = data
+        book_entry = "{:.12f}_{:02d}".format(rate, period)
+        side = "bids" if (amount < 0) else "asks"
+        if count:
+            # add / update
+            self.factory.data_processing('lendingbook', 'update', {
+                "symbol": symbol[1:],
+                "entry": book_entry,
+                "side": side,
+                "value": {"rate": rate, "amount": abs(amount), "period": period}
+            })
+        else:
+            # Delete
+            self.factory.data_processing('lendingbook', 'delete', {
+                "symbol": symbol[1:],
+                "entry": book_entry,
+                "side": side
+            })
+
+    def _snapshot_book(self, symbol, data):
+        book = {"asks": {}, "bids": {}}
+        for rate, period, count, amount in data:
             book_entry = "{:.12f}_{:02d}".format(rate, period)
             side = "bids" if (amount < 0) else "asks"
-            if count:
-                # add / update
-                self.factory.data_processing('lendingbook', 'update', {
-                    "symbol": symbol[1:],
-                    "entry": book_entry,
-                    "side": side,
-                    "value": {"rate": rate, "amount": abs(amount), "period": period}
-                })
-            else:
-                # Delete
-                self.factory.data_processing('lendingbook', 'delete', {
-                    "symbol": symbol[1:],
-                    "entry": book_entry,
-                    "side": side
-                })
+            book[side][book_entry] = {"rate": rate, "amount": abs(amount), "period": period}
+        self.resyncing.discard(symbol[1:])
+        self.factory.data_processing('lendingbook', 'snapshot', {
+            "symbol": symbol[1:],
+            "asks": book["asks"],
+            "bids": book["bids"]
+        })
 
     def _update_ticker(self, pair, data):
         self.factory.data_processing('ticker', 'update', {
@@ -146,6 +309,32 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
         self.logging.debug("{}".format(data))
         self.sendMessage(json.dumps(data).encode('utf8'))
 
+    def authenticate(self, api_key, api_secret):
+        nonce = str(Nonce.next_nonce())
+        payload = "AUTH{}".format(nonce)
+        signature = hmac.new(api_secret.encode('utf8'), payload.encode('utf8'), hashlib.sha384).hexdigest()
+        self._send({
+            "event": "auth",
+            "apiKey": api_key,
+            "authSig": signature,
+            "authPayload": payload,
+            "authNonce": nonce,
+            "filter": ["funding", "wallet", "notify"]
+        })
+
+    def submit_funding_offer(self, currency, amount, rate, period):
+        self._send([0, "fon", None, {
+            "type": "LIMIT",
+            "symbol": "f{}".format(currency),
+            "amount": str(amount),
+            "rate": str(rate),
+            "period": int(period),
+            "flags": 0
+        }])
+
+    def cancel_funding_offer(self, offer_id):
+        self._send([0, "foc", None, {"id": offer_id}])
+
     def _find_channel_id(self, symbol):
         symbol_type = 'currency' if len(symbol) == 3 else 'pair'
         for key in self.channels:
@@ -164,6 +353,13 @@ class BitfinexWsClientProtocol(WebSocketClientProtocol):
             "length": "100"
         })
 
+    def resync_lendingbook(self, currency):
+        """
+        Replaces the book of a single currency by a fresh snapshot, keeping the other channels untouched.
+        """
+        self.resyncing.add(currency)
+        self.subscribe_lendingbook(currency)
+
     def unsubscribe_lendingbook(self, currency):
         channelId = self._find_channel_id(currency)
         if channelId:
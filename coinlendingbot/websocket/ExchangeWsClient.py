@@ -1,17 +1,29 @@
+import itertools
 import logging
+import math
+import sys
 import threading
 import time
+import zlib
 from datetime import datetime
+from decimal import Decimal
+from urllib.parse import urlparse
 from twisted.internet import reactor
 from twisted.internet import ssl
 
+import coinlendingbot.Metrics as Metrics
 from coinlendingbot.websocket.WsConfig import WsConfig
+from coinlendingbot.websocket.WsRecorder import WsRecorder
 from coinlendingbot.websocket import ExchangeWsClientFactory
 
 
 class ExchangeWsClient(threading.Thread):
-    def __init__(self, exchange):
+    # seconds between two log entries of the channel statistics
+    STATS_LOG_INTERVAL = 600
+
+    def __init__(self, exchange, ws_url=None):
         self.exchange = exchange
+        self.ws_url = ws_url or WsConfig[exchange]["ws_url"]
 
         super(ExchangeWsClient, self).__init__(name=self.__str__())
 
@@ -19,8 +31,21 @@ class ExchangeWsClient(threading.Thread):
         self.daemon = True
         self.lendingbook = {}
         self.ticker = {}
+        # pairs whose ticker subscription was refused
+        self.ticker_errors = set()
+        self.checksum_failures = {}
+        # state of the authenticated channel, None until the snapshot arrived
+        self.authenticated = False
+        self.wallets = None
+        self.funding_offers = None
+        self.funding_credits = None
+        # requests waiting for their confirmation, by request type and id, oldest first
+        self.pending_requests = {"fon-req": {}, "foc-req": {}}
+        self.requests_lock = threading.Lock()
+        self.request_ids = itertools.count(int(time.time() * 1000))
 
-        self.factory = ExchangeWsClientFactory(self.exchange, self._data_processing)
+        self.factory = ExchangeWsClientFactory(self.exchange, self._data_processing, self.ws_url)
+        Metrics.register_gauge('websocket_book_age_seconds', self.return_book_ages)
 
     def __str__(self):
         return "{}_{}".format(__name__, self.exchange)
@@ -30,10 +55,29 @@ class ExchangeWsClient(threading.Thread):
 
     def run(self):
         self.factory.protocol = WsConfig[self.exchange]["protocol"]
-        reactor.connectSSL(WsConfig[self.exchange]["ws_host"], WsConfig[self.exchange]["ws_port"],
-                           self.factory, ssl.ClientContextFactory())
+        url = urlparse(self.ws_url)
+        if url.scheme == "ws":
+            reactor.connectTCP(url.hostname, url.port or 80, self.factory)
+        else:
+            reactor.connectSSL(url.hostname, url.port or 443, self.factory, ssl.ClientContextFactory())
+        reactor.callLater(ExchangeWsClient.STATS_LOG_INTERVAL, self._log_channel_stats)
         reactor.run(installSignalHandlers=0)
 
+    def record(self, filename):
+        """
+        Records all received frames to filename, to be replayed with WsReplay
+        """
+        self.factory.recorder = WsRecorder(filename)
+
+    def is_connected(self):
+        return self.factory.proto is not None
+
+    def set_currency_pairs(self, currency_pairs):
+        """
+        Sets the mapping of numeric pair ids to pair names, for exchanges sending ids only
+        """
+        self.factory.currency_pairs = dict(currency_pairs)
+
     def subscribe_lendingbook(self, currency):
         self.logging.debug(currency)
         self.factory.subscribe_lendingbook(currency)
@@ -62,17 +106,218 @@ class ExchangeWsClient(threading.Thread):
         book["update_time"] = self.lendingbook[currency]["update_time"]
         return book
 
+    def return_book_ages(self):
+        """
+        Returns the seconds since every lendingbook was last updated, as [({"currency": ...}, seconds), ...]
+        """
+        now = datetime.utcnow()
+        return [({"exchange": self.exchange, "currency": currency}, (now - book["update_time"]).total_seconds())
+                for currency, book in list(self.lendingbook.items()) if "update_time" in book]
+
+    def authenticate(self, api_key, api_secret):
+        self.factory.authenticate(api_key, api_secret)
+
+    def is_authenticated(self):
+        return self.authenticated
+
+    def _request(self, request_type, match, send, timeout):
+        """
+        Sends a request over the authenticated channel and waits for its confirmation, the first one whose offer
+        matches. Confirmations without an offer are taken by the oldest request waiting.
+        Returns the confirmation or None on timeout.
+        """
+        with self.requests_lock:
+            request_id = next(self.request_ids)
+            request = {"match": match, "event": threading.Event(), "confirmation": None}
+            self.pending_requests[request_type][request_id] = request
+        send()
+        if not request["event"].wait(timeout):
+            with self.requests_lock:
+                # a late confirmation is dropped instead of being taken for the one of another request
+                if self.pending_requests[request_type].pop(request_id, None) is not None:
+                    return None
+        return request["confirmation"]
+
+    def create_funding_offer(self, currency, amount, rate, period, timeout):
+        """
+        Creates a funding offer and waits for the exchange's confirmation
+        """
+        def match(offer):
+            return (offer["currency"] == currency and offer["amount"] is not None and offer["rate"] is not None
+                    and round(float(offer["amount"]), 8) == round(float(amount), 8)
+                    and math.isclose(float(offer["rate"]), float(rate), rel_tol=1e-6)
+                    and offer["period"] == int(period))
+        return self._request("fon-req", match,
+                             lambda: self.factory.submit_funding_offer(currency, amount, rate, period),
+                             timeout)
+
+    def cancel_funding_offer(self, offer_id, timeout):
+        """
+        Cancels a funding offer and waits for the exchange's confirmation
+        """
+        return self._request("foc-req",
+                             lambda offer: offer["id"] == offer_id,
+                             lambda: self.factory.cancel_funding_offer(offer_id),
+                             timeout)
+
+    def _confirm_request(self, data):
+        with self.requests_lock:
+            pending = self.pending_requests[data["type"]]
+            offer = data["funding_offer"]
+            if offer:
+                matching = [request_id for request_id, r in pending.items() if r["match"](offer)]
+            else:
+                matching = list(pending)
+            if not matching:
+                self.logging.warning("Unexpected confirmation: {}".format(data))
+                return
+            request = pending.pop(matching[0])
+        request["confirmation"] = data
+        request["event"].set()
+
+    def _cancel_requests(self):
+        with self.requests_lock:
+            pending = list(self.pending_requests["fon-req"].values()) + list(self.pending_requests["foc-req"].values())
+            self.pending_requests = {"fon-req": {}, "foc-req": {}}
+        for request in pending:
+            request["confirmation"] = {"status": "ERROR", "text": "Websocket closed", "funding_offer": None}
+            request["event"].set()
+
+    def return_wallets(self):
+        """
+        Returns the wallets as {type: {currency: wallet}} or None, if the live state is not (yet) usable
+        """
+        wallets = self.wallets
+        if not self.authenticated or wallets is None:
+            return None
+        wallets = list(wallets.values())
+        if any(w["available"] is None for w in wallets):
+            # calculation of available balance is pending
+            return None
+        result = {}
+        for wallet in wallets:
+            result.setdefault(wallet["type"], {})[wallet["currency"]] = wallet
+        return result
+
+    def return_funding_offers(self):
+        """
+        Returns the list of own funding offers or None, if the live state is not (yet) usable
+        """
+        funding_offers = self.funding_offers
+        if not self.authenticated or funding_offers is None:
+            return None
+        return list(funding_offers.values())
+
+    def return_funding_credits(self):
+        """
+        Returns the list of own funding credits or None, if the live state is not (yet) usable
+        """
+        funding_credits = self.funding_credits
+        if not self.authenticated or funding_credits is None:
+            return None
+        return list(funding_credits.values())
+
+    def return_checksum_failures(self):
+        """
+        Returns the number of failed book checksum verifications per currency
+        """
+        return dict(self.checksum_failures)
+
+    @staticmethod
+    def _memory_size(obj):
+        """
+        Estimates the memory used by an object including its content
+        """
+        size = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            size += sum(ExchangeWsClient._memory_size(k) + ExchangeWsClient._memory_size(v) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple, set)):
+            size += sum(ExchangeWsClient._memory_size(v) for v in obj)
+        return size
+
+    def return_channel_stats(self):
+        """
+        Returns the inbound messages and bytes per channel, with the memory held for its data in bytes
+        """
+        stats = {channel: dict(values) for channel, values in list(self.factory.channel_stats.items())}
+        for currency, book in list(self.lendingbook.items()):
+            stats.setdefault("book:{}".format(currency), {"messages": 0, "bytes": 0})["memory"] = \
+                self._memory_size(book)
+        for pair, ticker in list(self.ticker.items()):
+            stats.setdefault("ticker:{}".format(pair), {"messages": 0, "bytes": 0})["memory"] = \
+                self._memory_size(ticker)
+        return stats
+
+    def _log_channel_stats(self):
+        for channel, values in sorted(self.return_channel_stats().items()):
+            self.logging.info("Channel {}: {} messages, {} bytes received, {} bytes in memory"
+                              .format(channel, values["messages"], values["bytes"], values.get("memory", 0)))
+        reactor.callLater(ExchangeWsClient.STATS_LOG_INTERVAL, self._log_channel_stats)
+
+    @staticmethod
+    def _checksum_value(value):
+        """
+        Formats a number the way Javascript converts it to a string, which is what the exchange checksums.
+        """
+        if isinstance(value, int):
+            return str(value)
+        if value.is_integer() and abs(value) < 1e21:
+            return str(int(value))
+        value_str = repr(value)
+        if 'e' in value_str:
+            if 1e-7 <= abs(value) < 1e21:
+                return format(Decimal(value_str), 'f')
+            mantissa, exponent = value_str.split('e')
+            return "{}e{}{}".format(mantissa, exponent[0] if exponent[0] == '-' else '+', exponent[1:].lstrip('0'))
+        return value_str
+
+    @staticmethod
+    def lendingbook_checksum(book):
+        """
+        Calculates the signed CRC32 checksum over the top 25 bids and asks of a lendingbook
+        """
+        bids = [book["bids"][p] for p in sorted(book["bids"].keys(), reverse=True)[:25]]
+        asks = [book["asks"][p] for p in sorted(book["asks"].keys())[:25]]
+        values = []
+        for i in range(25):
+            if i < len(bids):
+                values.extend([bids[i]["rate"], -bids[i]["amount"]])
+            if i < len(asks):
+                values.extend([asks[i]["rate"], asks[i]["amount"]])
+        checksum = zlib.crc32(":".join([ExchangeWsClient._checksum_value(v) for v in values]).encode('utf8'))
+        return checksum - (1 << 32) if checksum & 0x80000000 else checksum
+
+    def _verify_checksum(self, currency, checksum):
+        if currency not in self.lendingbook:
+            return
+        if self.lendingbook_checksum(self.lendingbook[currency]) != checksum:
+            self.checksum_failures[currency] = self.checksum_failures.get(currency, 0) + 1
+            self.logging.warning("Checksum of {} lendingbook failed ({} failures), resyncing"
+                                 .format(currency, self.checksum_failures[currency]))
+            self.factory.resync_lendingbook(currency)
+
     def subscribe_ticker(self, pair):
         self.factory.subscribe_ticker(pair)
 
     def unsubscribe_ticker(self, pair):
         self.factory.unsubscribe_ticker(pair)
 
+    def seed_ticker(self, ticker):
+        """
+        Sets the ticker fetched over REST, for channels which only push the pairs that changed
+        """
+        now = datetime.utcnow()
+        for pair, entry in ticker.items():
+            self.ticker[pair] = dict(entry, pair=pair, update_time=now)
+
     def return_ticker(self):
         return self.ticker
 
+    def return_ticker_errors(self):
+        return set(self.ticker_errors)
+
     def _data_processing(self, datatype, action, data):
-        symbol = data["symbol"] if "symbol" in data else data["pair"]
+        symbol = data["symbol"] if "symbol" in data else data.get("pair")
         self.logging.debug("{}, {}, {}".format(datatype, action, symbol))
         now = datetime.utcnow()
         try:
@@ -88,6 +333,11 @@ class ExchangeWsClient(threading.Thread):
                     if data["entry"] in self.lendingbook[symbol][data["side"]]:
                         del self.lendingbook[symbol][data["side"]][data["entry"]]
                     self.lendingbook[symbol]["update_time"] = now
+                elif action == "snapshot":
+                    # replace the whole book at once, so readers never see a partial snapshot
+                    self.lendingbook[symbol] = {"asks": data["asks"], "bids": data["bids"], "update_time": now}
+                elif action == "checksum":
+                    self._verify_checksum(symbol, data["checksum"])
                 elif action == "remove":
                     if symbol in self.lendingbook:
                         del self.lendingbook[symbol]
@@ -102,5 +352,40 @@ class ExchangeWsClient(threading.Thread):
                         del self.ticker[symbol]
                 elif action == "heart_beat":
                     self.ticker[symbol]["update_time"] = now
+                elif action == "error":
+                    self.ticker_errors.add(symbol.upper())
+            elif datatype == "auth":
+                if action == "authenticated":
+                    self.authenticated = True
+                elif action == "closed":
+                    # drop the state, it can't be kept up to date anymore
+                    self.authenticated = False
+                    self.wallets = None
+                    self.funding_offers = None
+                    self.funding_credits = None
+                    self._cancel_requests()
+            elif datatype == "request":
+                if action == "confirmation":
+                    self._confirm_request(data)
+            elif datatype == "wallet":
+                if action == "snapshot":
+                    self.wallets = {(w["type"], w["currency"]): w for w in data["wallets"]}
+                elif action == "update" and self.wallets is not None:
+                    wallet = data["wallet"]
+                    self.wallets[(wallet["type"], wallet["currency"])] = wallet
+            elif datatype == "funding_offer":
+                if action == "snapshot":
+                    self.funding_offers = {o["id"]: o for o in data["funding_offers"]}
+                elif action == "update" and self.funding_offers is not None:
+                    self.funding_offers[data["funding_offer"]["id"]] = data["funding_offer"]
+                elif action == "delete" and self.funding_offers is not None:
+                    self.funding_offers.pop(data["funding_offer"]["id"], None)
+            elif datatype == "funding_credit":
+                if action == "snapshot":
+                    self.funding_credits = {c["id"]: c for c in data["funding_credits"]}
+                elif action == "update" and self.funding_credits is not None:
+                    self.funding_credits[data["funding_credit"]["id"]] = data["funding_credit"]
+                elif action == "delete" and self.funding_credits is not None:
+                    self.funding_credits.pop(data["funding_credit"]["id"], None)
         except Exception as ex:
             self.logging.error("{}: datatype={}, action={}, data={}".format(ex, datatype, action, data))
@@ -2,20 +2,27 @@ import logging
 from autobahn.twisted.websocket import WebSocketClientFactory
 from twisted.internet.protocol import ReconnectingClientFactory
 
+import coinlendingbot.Metrics as Metrics
 from coinlendingbot.websocket.WsConfig import WsConfig
 
 
 class ExchangeWsClientFactory(ReconnectingClientFactory, WebSocketClientFactory):
-    def __init__(self, exchange, data_processing):
+    def __init__(self, exchange, data_processing, ws_url=None):
         self.exchange = exchange
 
-        WebSocketClientFactory.__init__(self, WsConfig[self.exchange]["ws_url"])
+        WebSocketClientFactory.__init__(self, ws_url or WsConfig[self.exchange]["ws_url"])
 
         self.logging = logging.getLogger(__name__)
         self.data_processing = data_processing
         self.proto = None
         self.lendingbook_list = []
         self.ticker_list = []
+        self.credentials = None
+        # id to pair name, for exchanges sending numeric ids
+        self.currency_pairs = {}
+        # inbound messages and bytes per channel
+        self.channel_stats = {}
+        self.recorder = None
 
     def clientConnectionLost(self, connector, reason):
         self.logging.warn('Lost connection. Reason: {}'.format(reason))
@@ -28,15 +35,40 @@ class ExchangeWsClientFactory(ReconnectingClientFactory, WebSocketClientFactory)
     def websocket_opened(self, protocol):
         self.proto = protocol
         self.resetDelay()
+        if self.recorder:
+            self.recorder.record_open()
+        if self.credentials:
+            self.proto.authenticate(*self.credentials)
         self._resubscribe_lendingbook()
         self._resubscribe_ticker()
 
     def websocket_closed(self):
         self.proto = None
 
+    def message_received(self, channel, payload):
+        if self.recorder:
+            self.recorder.record(payload)
+        stats = self.channel_stats.setdefault(channel, {"messages": 0, "bytes": 0})
+        stats["messages"] += 1
+        stats["bytes"] += len(payload)
+        Metrics.increment('websocket_messages_total', exchange=self.exchange, channel=channel)
+
     def startedConnecting(self, connector):
         self.logging.debug('startedConnecting')
 
+    def authenticate(self, api_key, api_secret):
+        self.credentials = (api_key, api_secret)
+        if self.proto:
+            self.reactor.callFromThread(self.proto.authenticate, api_key, api_secret)
+
+    def submit_funding_offer(self, currency, amount, rate, period):
+        if self.proto:
+            self.reactor.callFromThread(self.proto.submit_funding_offer, currency, amount, rate, period)
+
+    def cancel_funding_offer(self, offer_id):
+        if self.proto:
+            self.reactor.callFromThread(self.proto.cancel_funding_offer, offer_id)
+
     def subscribe_lendingbook(self, currency):
         if self.proto:
             self.proto.subscribe_lendingbook(currency)
@@ -52,6 +84,10 @@ class ExchangeWsClientFactory(ReconnectingClientFactory, WebSocketClientFactory)
         else:
             self.reactor.callLater(1, self.unsubscribe_lendingbook, currency)
 
+    def resync_lendingbook(self, currency):
+        if self.proto:
+            self.proto.resync_lendingbook(currency)
+
     def _resubscribe_lendingbook(self):
         for currency in self.lendingbook_list:
             self.subscribe_lendingbook(currency)
@@ -0,0 +1,100 @@
+from autobahn.twisted.websocket import WebSocketClientProtocol
+import logging
+import json
+
+
+class PoloniexWsClientProtocol(WebSocketClientProtocol):
+    CHANNEL_TICKER = 1002
+    CHANNEL_HEARTBEAT = 1010
+
+    def __init__(self):
+        super(PoloniexWsClientProtocol, self).__init__()
+        self.logging = logging.getLogger(__name__)
+        self.ticker_subscribed = False
+
+    def onConnect(self, request):
+        pass
+
+    def onOpen(self):
+        self.logging.info("WS opened")
+        self.ticker_subscribed = False
+        self.factory.websocket_opened(self)
+
+    def onClose(self, wasClean, code, reason):
+        self.logging.info("WS closed: code {0}, reason: {1}".format(code, reason))
+        self.factory.websocket_closed()
+
+    def onMessage(self, payload, isBinary):
+        msg = json.loads(payload.decode('utf8'))
+        self.factory.message_received(self._channel_name(msg), payload)
+        if isinstance(msg, dict):
+            if "error" in msg:
+                self.logging.error("Error: {}".format(msg))
+            else:
+                self.logging.debug("event: {}".format(msg))
+        elif isinstance(msg, list):
+            self._received_data(msg)
+
+    @staticmethod
+    def _channel_name(msg):
+        if not isinstance(msg, list):
+            return "events"
+        if msg[0] == PoloniexWsClientProtocol.CHANNEL_TICKER:
+            return "ticker"
+        if msg[0] == PoloniexWsClientProtocol.CHANNEL_HEARTBEAT:
+            return "heartbeat"
+        return "unknown"
+
+    def _received_data(self, msg):
+        channel = msg[0]
+        if channel == PoloniexWsClientProtocol.CHANNEL_HEARTBEAT:
+            self._heart_beat()
+        elif channel == PoloniexWsClientProtocol.CHANNEL_TICKER:
+            if len(msg) > 2 and msg[2]:
+                self._update_ticker(msg[2])
+        else:
+            self.logging.debug("Channel unknown: {}".format(msg))
+
+    def _heart_beat(self):
+        for pair in self.factory.ticker_list:
+            self.factory.data_processing("ticker", "heart_beat", {"pair": pair})
+
+    def _update_ticker(self, data):
+        pair = self.factory.currency_pairs.get(data[0])
+        if pair is None or pair not in self.factory.ticker_list:
+            return
+        self.factory.data_processing('ticker', 'update', {
+            "pair": pair,
+            "id": data[0],
+            "last": data[1],
+            "lowestAsk": data[2],
+            "highestBid": data[3],
+            "percentChange": data[4],
+            "baseVolume": data[5],
+            "quoteVolume": data[6],
+            "isFrozen": data[7],
+            "high24hr": data[8],
+            "low24hr": data[9]
+        })
+
+    def _send(self, data):
+        self.logging.debug("{}".format(data))
+        self.sendMessage(json.dumps(data).encode('utf8'))
+
+    def subscribe_lendingbook(self, currency):
+        self.logging.error("Poloniex push API has no lending book channel, can't subscribe {}".format(currency))
+
+    def unsubscribe_lendingbook(self, currency):
+        pass
+
+    def subscribe_ticker(self, pair):
+        # one channel carries the ticker of all pairs
+        if not self.ticker_subscribed:
+            self.ticker_subscribed = True
+            self._send({"command": "subscribe", "channel": PoloniexWsClientProtocol.CHANNEL_TICKER})
+
+    def unsubscribe_ticker(self, pair):
+        self.factory.data_processing('ticker', 'remove', {"pair": pair})
+        if self.ticker_subscribed and self.factory.ticker_list == [pair]:
+            self.ticker_subscribed = False
+            self._send({"command": "unsubscribe", "channel": PoloniexWsClientProtocol.CHANNEL_TICKER})
@@ -1,10 +1,13 @@
 from coinlendingbot.websocket import BitfinexWsClientProtocol
+from coinlendingbot.websocket import PoloniexWsClientProtocol
 
 WsConfig = {
     "BITFINEX": {
-        "ws_host": "api.bitfinex.com",
-        "ws_port": 443,
         "ws_url": "wss://api.bitfinex.com/ws/2",
         "protocol": BitfinexWsClientProtocol
+    },
+    "POLONIEX": {
+        "ws_url": "wss://api2.poloniex.com",
+        "protocol": PoloniexWsClientProtocol
     }
 }
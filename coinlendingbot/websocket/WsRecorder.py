@@ -0,0 +1,51 @@
+import gzip
+import logging
+import time
+
+
+class WsRecorder(object):
+    """
+    Writes the received websocket frames with their receive time to a gzip compressed log.
+    Each line holds the unix timestamp and the raw frame, a new connection is marked by OPEN_MARKER.
+    """
+    OPEN_MARKER = "#open"
+    # number of frames buffered before they are flushed to disk
+    FLUSH_FRAMES = 1000
+
+    def __init__(self, filename):
+        self.logging = logging.getLogger(__name__)
+        self.filename = filename
+        # appending adds a gzip member, which is read back as one stream
+        self.file = gzip.open(filename, 'at', encoding='utf8')
+        self.frames = 0
+        self.logging.info("Recording websocket frames to {}".format(filename))
+
+    def record(self, payload):
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf8')
+        self._write(payload)
+
+    def record_open(self):
+        self._write(WsRecorder.OPEN_MARKER)
+
+    def _write(self, line):
+        self.file.write("{:.6f} {}\n".format(time.time(), line))
+        self.frames += 1
+        if self.frames % WsRecorder.FLUSH_FRAMES == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(filename):
+    """
+    Yields (timestamp, payload) of a recording, payload is None where a new connection was opened
+    """
+    with gzip.open(filename, 'rt', encoding='utf8') as f:
+        for line in f:
+            timestamp, payload = line.rstrip('\n').split(' ', 1)
+            if payload == WsRecorder.OPEN_MARKER:
+                yield float(timestamp), None
+            else:
+                yield float(timestamp), payload.encode('utf8')
@@ -0,0 +1,78 @@
+import logging
+import time
+
+from coinlendingbot.websocket.WsConfig import WsConfig
+from coinlendingbot.websocket.WsRecorder import read_recording
+from coinlendingbot.websocket import ExchangeWsClient
+
+
+class WsReplay(object):
+    """
+    Feeds a recording of WsRecorder through the exchange's protocol into an ExchangeWsClient, without network.
+    The client isn't started, its state can be read after or during the replay.
+    """
+
+    def __init__(self, exchange, filename):
+        self.logging = logging.getLogger(__name__)
+        self.exchange = exchange
+        self.filename = filename
+        self.client = ExchangeWsClient(exchange)
+        self.protocol = None
+        self.sent = []
+
+    def _new_protocol(self):
+        protocol = WsConfig[self.exchange]["protocol"]()
+        protocol.factory = self.client.factory
+        # requests of the protocol (e.g. resyncs) are collected instead of sent
+        protocol.sendMessage = lambda payload, isBinary=False: self.sent.append(payload)
+        self.client.factory.proto = protocol
+        return protocol
+
+    def run(self, realtime=False):
+        """
+        Replays the recording as fast as possible or, with realtime, at the recorded speed.
+        Returns the number of messages and bytes, the duration in seconds, the throughput in messages per
+        second and the processing latency per message in milliseconds (p50, p99, max).
+        With realtime the lag behind the recorded schedule is included in the latency.
+        """
+        self.protocol = self._new_protocol()
+        latencies = []
+        received_bytes = 0
+        start = time.time()
+        first_timestamp = None
+        for timestamp, payload in read_recording(self.filename):
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            due = start + timestamp - first_timestamp
+            if realtime:
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if payload is None:
+                # the recorded connection was reopened, the channel ids start over
+                self.protocol = self._new_protocol()
+                continue
+            begin = time.time()
+            self.protocol.onMessage(payload, False)
+            end = time.time()
+            latencies.append((end - due if realtime else end - begin) * 1000)
+            received_bytes += len(payload)
+        duration = time.time() - start
+        latencies.sort()
+        stats = {
+            "messages": len(latencies),
+            "bytes": received_bytes,
+            "seconds": duration,
+            "messages_per_second": len(latencies) / duration if duration > 0 else 0,
+            "latency_p50": self._percentile(latencies, 50),
+            "latency_p99": self._percentile(latencies, 99),
+            "latency_max": latencies[-1] if latencies else 0
+        }
+        self.logging.info("Replayed {}: {}".format(self.filename, stats))
+        return stats
+
+    @staticmethod
+    def _percentile(values, percent):
+        if not values:
+            return 0
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
@@ -1,6 +1,10 @@
 from coinlendingbot.websocket.BitfinexWsClientProtocol import BitfinexWsClientProtocol
+from coinlendingbot.websocket.PoloniexWsClientProtocol import PoloniexWsClientProtocol
 from coinlendingbot.websocket.ExchangeWsClientFactory import ExchangeWsClientFactory
 from coinlendingbot.websocket.ExchangeWsClient import ExchangeWsClient
 from coinlendingbot.websocket.WsConfig import WsConfig
+from coinlendingbot.websocket.WsRecorder import WsRecorder
+from coinlendingbot.websocket.WsReplay import WsReplay
 
-__all__ = ["BitfinexWsClientProtocol", "ExchangeWsClientFactory", "ExchangeWsClient", "WsConfig"]
+__all__ = ["BitfinexWsClientProtocol", "PoloniexWsClientProtocol", "ExchangeWsClientFactory", "ExchangeWsClient",
+           "WsConfig", "WsRecorder", "WsReplay"]
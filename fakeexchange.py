@@ -0,0 +1,41 @@
+#!/bin/env python3
+
+import click
+import logging
+
+from twisted.internet import reactor
+
+from coinlendingbot.fakeexchange import Market, FakeRestServer, FakeWsServerFactory
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', help='Interface to listen on (Default: 127.0.0.1)')
+@click.option('--port', default=8765, help='Port of the REST endpoints (Default: 8765)')
+@click.option('--ws-port', default=8766, help='Port of the websocket (Default: 8766)')
+@click.option('--currencies', default='BTC,ETH,LTC,XMR,USD', help='Lending currencies (Default: BTC,ETH,LTC,XMR,USD)')
+@click.option('--latency', default=0.0, help='Mean latency of responses and websocket messages in seconds')
+@click.option('--error-rate', default=0.0, help='Probability to answer a request with 429')
+@click.option('--rate-limit', default=0, help='Requests per second answered before 429 is returned, 0 for unlimited')
+@click.option('--interval', default=1.0, help='Seconds between two market updates (Default: 1)')
+@click.option('--day-seconds', default=86400, help='Length of a loan day in seconds, shorten it to see loans return')
+@click.option('--seed', default=None, type=int, help='Seed of the synthetic market')
+@click.option('-v', '--verbose', is_flag=True, help='Log every request')
+def main(host, port, ws_port, currencies, latency, error_rate, rate_limit, interval, day_seconds, seed, verbose):
+    """
+    Stand-in for the Poloniex and Bitfinex APIs serving a synthetic lending market, for load and soak tests.
+    Point the bot to it with url and wsUrl in the exchange's section of the configuration.
+    """
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO,
+                        format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    market = Market([c.strip().upper() for c in currencies.split(',')], seed=seed, day_seconds=day_seconds)
+    rest = FakeRestServer(market, host, port, latency, error_rate, rate_limit)
+    rest.start()
+    ws = FakeWsServerFactory(market, "ws://{}:{}".format(host, ws_port), interval, latency)
+    reactor.listenTCP(ws_port, ws, interface=host)
+    ws.start()
+    click.echo("REST: {}  websocket: ws://{}:{}".format(rest.url, host, ws_port))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
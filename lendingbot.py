@@ -4,20 +4,24 @@ import click
 import logging
 import logging.config
 import sys
-import time
 import traceback
 from decimal import Decimal
 from http.client import BadStatusLine
 from urllib.error import URLError
 
+import coinlendingbot.Clock as Clock
 import coinlendingbot.Configuration as Config
 import coinlendingbot.Data as Data
 import coinlendingbot.Lending as Lending
 import coinlendingbot.MaxToLend as MaxToLend
+import coinlendingbot.Metrics as Metrics
 from coinlendingbot.Logger import Logger
 import coinlendingbot.PluginsManager as PluginsManager
+from coinlendingbot import RequestTracker
+import coinlendingbot.Storage as Storage
 from coinlendingbot.ExchangeApiFactory import ExchangeApiFactory
-from coinlendingbot.ExchangeApi import ApiError
+from coinlendingbot.ExchangeApi import ApiError, ApiTimeoutError, AuthenticationError, CircuitOpenError, \
+    RateLimitError, TransientApiError
 import coinlendingbot.WebServer as WebServer
 
 
@@ -37,10 +41,15 @@ import coinlendingbot.WebServer as WebServer
     is_flag=True,
     help='Do not execute orders'
 )
-def main(config, logconfig, dryrun):
+@click.option(
+    '-s', '--simulate',
+    is_flag=True,
+    help='Lend on a simulated exchange on a virtual clock, configured in section [SIMULATOR]'
+)
+def main(config, logconfig, dryrun, simulate):
     logging.config.fileConfig(logconfig)
     logger = logging.getLogger('main')
-    logger.debug('config: {}, logconfig: {}, dryrun: {}'.format(config, logconfig, dryrun))
+    logger.debug('config: {}, logconfig: {}, dryrun: {}, simulate: {}'.format(config, logconfig, dryrun, simulate))
 
     Config.init(config)
 
@@ -55,26 +64,38 @@ def main(config, logconfig, dryrun):
     web_server_enabled = Config.getboolean('BOT', 'startWebServer')
     if web_server_enabled:
         logger.info('Web server enabled.')
-        if json_output_enabled is False:
-            # User wants webserver enabled. Must have JSON enabled. Force logging with defaults.
-            json_output_enabled = True
-            jsonfile = Config.get('BOT', 'jsonfile', 'www/botweblog.json')
-        WebServer.initialize_web_server(Config)
+        # The web server serves the status from memory, the file is only written if jsonfile is configured
+        json_output_enabled = True
 
     # Configure logging to display on webpage
     weblog = Logger(jsonfile, Decimal(Config.get('BOT', 'jsonlogsize', 200)), exchange)
+    if web_server_enabled:
+        WebServer.add_route('/api/status', WebServer.snapshot_route(weblog.output.snapshot))
+        status_events = WebServer.EventStream()
+        weblog.output.subscribe(WebServer.status_delta_listener(status_events))
+        WebServer.add_route('/api/events', WebServer.status_events_route(weblog.output.snapshot, status_events))
+        WebServer.add_route('/api/log', WebServer.event_log_route(weblog.output.events))
+        WebServer.initialize_web_server(Config)
 
     welcome = 'Welcome to {} on {}'.format(Config.get("BOT", "label", "Lending Bot"), exchange)
     logger.info(welcome)
     weblog.log(welcome)
 
     # initialize the remaining stuff
-    api = ExchangeApiFactory.createApi(exchange, Config, weblog)
+    if simulate:
+        from coinlendingbot.ExchangeSimulator import ExchangeSimulator
+        # sets the simulated clock, rounds follow each other without waiting for wall time
+        api = ExchangeSimulator(Config, weblog)
+    else:
+        api = ExchangeApiFactory.createApi(exchange, Config, weblog)
     MaxToLend.init(Config, weblog)
     Data.init(api, weblog)
     Config.init(config, Data)
     notify_conf = Config.get_notification_config()
-    if Config.has_option('MarketAnalysis', 'analyseCurrencies'):
+    if Config.has_option('MarketAnalysis', 'analyseCurrencies') and simulate:
+        logger.warning('MarketAnalysis records in real time, it is disabled for the simulation.')
+        analysis = None
+    elif Config.has_option('MarketAnalysis', 'analyseCurrencies'):
         logger.info('MarketAnalysis enabled.')
         from coinlendingbot.MarketAnalysis import MarketAnalysis
         # Analysis.init(Config, api, Data)
@@ -87,21 +108,34 @@ def main(config, logconfig, dryrun):
     # load plugins
     PluginsManager.init(Config, api, weblog, notify_conf)
 
+    RequestTracker.set_caller('lending')
     try:
-        while True:
+        while not (simulate and api.is_finished()):
             try:
                 logger.info('New round.')
-                Data.update_conversion_rates(output_currency, json_output_enabled)
-                PluginsManager.before_lending()
-                Lending.transfer_balances()
-                Lending.cancel_all()
-                Lending.lend_all()
-                PluginsManager.after_lending()
-                weblog.refreshStatus(Data.stringify_total_lent(*Data.get_total_lent()),
-                                     Data.get_max_duration(end_date, "status"))
-                weblog.persistStatus()
-                logger.info('Round finished.')
-                time.sleep(Lending.get_sleep_time())
+                with Metrics.span('round', breakdown=True) as round_span:
+                    with Metrics.span('phase', phase='update_conversion_rates'):
+                        Data.update_conversion_rates(output_currency, json_output_enabled)
+                    with Metrics.span('phase', phase='before_lending'):
+                        PluginsManager.before_lending()
+                    with Metrics.span('phase', phase='transfer_balances'):
+                        Lending.transfer_balances()
+                    with Metrics.span('phase', phase='cancel_all'):
+                        Lending.cancel_all()
+                    with Metrics.span('phase', phase='lend_all'):
+                        Lending.lend_all()
+                    with Metrics.span('phase', phase='after_lending'):
+                        PluginsManager.after_lending()
+                    with Metrics.span('phase', phase='refresh_status'):
+                        weblog.refreshStatus(Data.stringify_total_lent(*Data.get_total_lent()),
+                                             Data.get_max_duration(end_date, "status"))
+                    # the histograms go out with this status, so they lag persistStatus of this round
+                    weblog.addSectionLog('metrics', 'histograms', Metrics.summary())
+                    weblog.addSectionLog('metrics', 'api_usage', api.request_tracker.summary())
+                    with Metrics.span('phase', phase='persist_status'):
+                        weblog.persistStatus()
+                logger.info('Round finished in {}'.format(Metrics.describe(round_span)))
+                Clock.sleep(Lending.get_sleep_time())
             except KeyboardInterrupt:
                 # allow existing the main bot loop
                 raise
@@ -109,23 +143,18 @@ def main(config, logconfig, dryrun):
                 exc_type, exc_value, exc_traceback = sys.exc_info()
                 logger.debug(ex)
                 logger.debug(repr(traceback.format_tb(exc_traceback)))
-                weblog.log_error(ex.message)
+                # the requests already retried transient failures, see RetryPolicy
+                message = getattr(ex, 'message', None) or str(ex)
+                weblog.log_error(message)
                 weblog.persistStatus()
-                if 'Invalid API key' in ex.message:
-                    logger.critical("!!! Troubleshooting !!! Are your API keys correct? No quotation. Just plain keys.")
-                    exit(1)
-                elif 'Nonce must be greater' in ex.message:
-                    logger.critical("!!! Troubleshooting !!! Are you reusing the API key in multiple applications? "
-                                    + "Use a unique key for every application.")
-                    exit(1)
-                elif 'Permission denied' in ex.message:
-                    logger.critical("!!! Troubleshooting !!! Are you using IP filter on the key?")
+                if isinstance(ex, AuthenticationError):
+                    logger.critical("!!! Troubleshooting !!! " + ex.hint)
                     exit(1)
-                elif 'timed out' in ex.message:
+                elif isinstance(ex, ApiTimeoutError):
                     logger.warn("Timed out, will retry in " + str(Lending.get_sleep_time()) + "sec")
                 elif isinstance(ex, BadStatusLine):
                     logger.warn("Caught BadStatusLine exception from Poloniex, ignoring.")
-                elif 'Error 429' in ex.message:
+                elif isinstance(ex, RateLimitError):
                     additional_sleep = max(130.0-Lending.get_sleep_time(), 0)
                     sum_sleep = additional_sleep + Lending.get_sleep_time()
                     msg = 'IP has been banned due to many requests. Sleeping for {} seconds'.format(sum_sleep)
@@ -138,26 +167,31 @@ def main(config, logconfig, dryrun):
                                     + " {0}ms".format(api.req_period))
                         weblog.log_error('Expect this 130s ban periodically when using MarketAnalysis, '
                                          + 'it will fix itself')
-                    time.sleep(additional_sleep)
+                    Clock.sleep(additional_sleep)
                 # Ignore all 5xx errors (server error) as we can't do anything about it (https://httpstatuses.com/)
-                elif isinstance(ex, URLError):
-                    logger.error("Caught {0} from exchange, ignoring.".format(ex.message))
+                elif isinstance(ex, (URLError, TransientApiError, CircuitOpenError)):
+                    logger.error("Caught {0} from exchange, ignoring.".format(message))
                 elif isinstance(ex, ApiError):
-                    logger.error("Caught {0} reading from exchange API, ignoring.".format(ex.message))
+                    logger.error("Caught {0} reading from exchange API, ignoring.".format(message))
                 else:
                     logger.error(traceback.format_exc())
                     logger.error("v{0} Unhandled error, please open a Github issue so we can fix it!"
                                  .format(Data.get_bot_version()))
                     if notify_conf['notify_caught_exception']:
                         weblog.notify("{0}\n-------\n{1}".format(ex, traceback.format_exc()), notify_conf)
-                time.sleep(Lending.get_sleep_time())
-
+                Clock.sleep(Lending.get_sleep_time())
+        # only a simulation runs out of time
+        logger.info(api.summary())
     except KeyboardInterrupt:
-        if web_server_enabled:
-            WebServer.stop_web_server()
-        PluginsManager.on_bot_exit()
-        weblog.log('bye')
-        logger.info('bye')
+        pass
+
+    if web_server_enabled:
+        WebServer.stop_web_server()
+    PluginsManager.on_bot_exit()
+    weblog.log('bye')
+    weblog.close()
+    Storage.close_all()
+    logger.info('bye')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,206 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Clock  # nopep8
+import coinlendingbot.Storage as Storage  # nopep8
+from coinlendingbot.ExchangeApi import ExchangeApi  # nopep8
+from coinlendingbot.plugins.AccountStats import AccountStats, HistoryBackfill, DB_CREATE, DB_INSERT, \
+    DB_PATH, DB_VERSION  # nopep8
+
+# 2017-07-11 12:00:00 UTC
+NOW = 1499774400
+
+
+class FakeLog(object):
+    def __init__(self):
+        self.lines = []
+        self.notifications = []
+
+    def log(self, msg):
+        self.lines.append(msg)
+
+    def log_error(self, msg):
+        self.lines.append(msg)
+
+    def notify(self, msg, notify_conf):
+        self.notifications.append(msg)
+
+
+class FakeApi(object):
+    """
+    Answers return_lending_history from loans, the newest first, failing after fail_after requests
+    """
+    LENDING_HISTORY_PER_CURRENCY = False
+    create_time_stamp = staticmethod(ExchangeApi.create_time_stamp)
+
+    def __init__(self, loans, fail_after=None):
+        self.loans = loans
+        self.fail_after = fail_after
+        self.requests = []
+
+    def return_lending_history(self, start, stop, limit=500, currency=None):
+        if self.fail_after is not None and len(self.requests) >= self.fail_after:
+            raise IOError('connection reset')
+        self.requests.append((start, stop, limit, currency))
+        loans = [item for item in self.loans if start <= self.create_time_stamp(item['close']) <= stop
+                 and currency in (None, item['currency'])]
+        return sorted(loans, key=lambda item: item['close'], reverse=True)[:limit]
+
+
+def loan(loan_id, currency, close, earned):
+    return {'id': loan_id, 'open': close, 'close': close, 'duration': 1, 'interest': 0, 'rate': 0.0002,
+            'currency': currency, 'amount': 1, 'earned': earned, 'fee': 0}
+
+
+@pytest.fixture
+def stats(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.mkdir('market_data')
+    previous = Clock.set_clock(Clock.ManualClock(NOW))
+    plugin = AccountStats.__new__(AccountStats)
+    plugin.log = FakeLog()
+    plugin.notify_config = {}
+    plugin.all_currencies = ['BTC', 'ETH']
+    plugin.history = []
+    plugin.api = SimpleNamespace(return_lending_history=lambda start, stop, limit, currency=None: plugin.history,
+                                 create_time_stamp=ExchangeApi.create_time_stamp, LENDING_HISTORY_PER_CURRENCY=False)
+    yield plugin
+    Storage.close_all()
+    Clock.set_clock(previous)
+
+
+def daily_earnings(db):
+    return db.query("SELECT currency, day, earned, loans FROM daily_earnings ORDER BY currency, day")
+
+
+def test_fetch_history_updates_daily_earnings(stats):
+    stats.init_db()
+    stats.history = [loan(1, 'BTC', '2017-07-10 08:00:00', 0.1), loan(2, 'BTC', '2017-07-11 08:00:00', 0.2)]
+    stats.fetch_history(NOW - 86400 * 2, NOW)
+    # a loan fetched again and another one of the same day
+    stats.history = [loan(2, 'BTC', '2017-07-11 08:00:00', 0.2), loan(3, 'BTC', '2017-07-11 09:00:00', 0.3),
+                     loan(4, 'ETH', '2017-07-11 10:00:00', 2)]
+    stats.fetch_history(NOW - 86400, NOW)
+    assert daily_earnings(stats.db) == [('BTC', '2017-07-10', 0.1, 1), ('BTC', '2017-07-11', 0.5, 2),
+                                        ('ETH', '2017-07-11', 2, 1)]
+
+
+def test_daily_earnings_are_built_from_an_older_history(stats):
+    db = sqlite3.connect(DB_PATH)
+    db.execute(DB_CREATE)
+    db.execute(DB_INSERT, (1, '2017-07-10 08:00:00', '2017-07-10 08:00:00', 1, 0, 0.0002, 'BTC', 1, 0.1, 0))
+    db.commit()
+    stats.init_db()
+    assert daily_earnings(stats.db) == [('BTC', '2017-07-10', 0.1, 1)]
+
+
+def test_notify_stats(stats):
+    stats.init_db()
+    stats.set_db_version(2)
+    stats.history = [loan(1, 'BTC', '2017-07-10 08:00:00', 0.1), loan(2, 'BTC', '2017-07-11 08:00:00', 0.2),
+                     loan(3, 'XMR', '2017-07-11 08:00:00', 5)]
+    stats.fetch_history(NOW - 86400 * 2, NOW)
+    stats.notify_stats()
+    assert stats.log.notifications == ['Earnings:\n----------\n0.2 BTC Today\n0.1 BTC Yesterday\n'
+                                       '0.3 BTC in total\n']
+    assert stats.earnings == {'BTC': {'todayEarnings': 0.2, 'yesterdayEarnings': 0.1,
+                                      'totalEarnings': pytest.approx(0.3)}}
+
+
+def test_no_error_while_backfilling(stats):
+    stats.init_db()
+    stats.history = [loan(1, 'BTC', '2017-07-11 08:00:00', 0.1)]
+    stats.fetch_history(NOW - 86400, NOW)
+    stats.start_backfill(NOW - 86400)
+    stats.log.lines = []
+    stats.notify_stats()
+    assert stats.log.lines == []
+    stats.db.execute("UPDATE backfill SET done = 1")
+    stats.notify_stats()
+    assert stats.log.lines == ['AccountStats DB isn\'t ready.']
+
+
+OLD_LOANS = [loan(1, 'BTC', '2016-01-05 08:00:00', 0.1), loan(2, 'ETH', '2016-09-20 08:00:00', 1),
+             loan(3, 'BTC', '2017-05-01 08:00:00', 0.2), loan(4, 'BTC', '2017-07-11 08:00:00', 0.3)]
+
+
+def test_update_history_backfills_in_windows(stats):
+    stats.init_db()
+    stats.api = FakeApi(OLD_LOANS)
+    stats.update_history()
+    assert stats.get_db_version() == DB_VERSION
+    assert stats.db.query_one("SELECT COUNT(*) FROM history")[0] == 4
+    assert [row[:3] for row in daily_earnings(stats.db)] == [
+        ('BTC', '2016-01-05', 0.1), ('BTC', '2017-05-01', 0.2), ('BTC', '2017-07-11', 0.3),
+        ('ETH', '2016-09-20', 1)]
+    # it stopped a few windows fetched ahead after the first loan instead of going on to 2009
+    assert min(request[0] for request in stats.api.requests if request[2] > 1) > NOW - 86400 * 700
+    assert stats.db.query("SELECT stream, done FROM backfill") == [('', 1)]
+
+
+def test_backfill_per_currency(stats):
+    stats.init_db()
+    stats.api = FakeApi(OLD_LOANS)
+    stats.api.LENDING_HISTORY_PER_CURRENCY = True
+    stats.update_history()
+    assert stats.get_db_version() == DB_VERSION
+    assert stats.db.query_one("SELECT COUNT(*) FROM history")[0] == 4
+    assert set(request[3] for request in stats.api.requests) == {'BTC', 'ETH'}
+    # an empty window doesn't end a stream, the ledger limit counts entries other than loans
+    genesis = ExchangeApi.create_time_stamp('2009-01-03 18:15:05')
+    assert min(request[0] for request in stats.api.requests if request[3] == 'ETH') == genesis
+    assert all(request[2] > 1 for request in stats.api.requests)
+
+
+def test_backfill_resumes_after_a_failure(stats):
+    stats.init_db()
+    stats.api = FakeApi(OLD_LOANS, fail_after=8)
+    with pytest.raises(IOError):
+        stats.update_history()
+    assert stats.get_db_version() == 0
+    cursor = stats.db.query_one("SELECT cursor FROM backfill")[0]
+    assert cursor < NOW
+    stored = stats.db.query_one("SELECT COUNT(*) FROM history")[0]
+    assert stored >= 1
+    # the windows committed aren't fetched again
+    stats.api = FakeApi(OLD_LOANS)
+    stats.update_history()
+    assert stats.get_db_version() == DB_VERSION
+    assert stats.db.query_one("SELECT COUNT(*) FROM history")[0] == 4
+    windows = [request for request in stats.api.requests if request[2] == 5000][1:]
+    assert all(request[1] < cursor for request in windows)
+
+
+def test_backfill_pages_through_full_windows(stats, monkeypatch):
+    monkeypatch.setattr('coinlendingbot.plugins.AccountStats.BACKFILL_LIMIT', 2)
+    stats.init_db()
+    loans = [loan(i, 'BTC', '2017-07-0{0} 08:00:00'.format(i), 0.1) for i in range(1, 8)]
+    stats.api = FakeApi(loans)
+    stats.db.execute("INSERT INTO backfill(stream, cursor) VALUES ('', ?)", (NOW,))
+    assert HistoryBackfill(stats).run(60)
+    assert stats.db.query_one("SELECT COUNT(*) FROM history")[0] == 7
+
+
+def test_backfill_stops_after_its_seconds(stats):
+    stats.init_db()
+    stats.api = FakeApi(OLD_LOANS)
+    fetch = stats.api.return_lending_history
+
+    def slow_fetch(*args):
+        Clock.get_clock().advance(10)
+        return fetch(*args)
+    stats.api.return_lending_history = slow_fetch
+    stats.db.execute("INSERT INTO backfill(stream, cursor) VALUES ('', ?)", (NOW,))
+    assert not HistoryBackfill(stats).run(5)
+    assert stats.db.query_one("SELECT done FROM backfill")[0] == 0
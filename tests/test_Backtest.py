@@ -0,0 +1,133 @@
+import sqlite3 as sqlite
+import numpy
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Configuration as Config  # nopep8
+from coinlendingbot.Backtest import Backtest  # nopep8
+from coinlendingbot import Lending  # nopep8
+from coinlendingbot.ExchangeSimulator import MarketHistory  # nopep8
+from coinlendingbot.MarketAnalysis import MarketAnalysis  # nopep8
+from coinlendingbot import Sweep  # nopep8
+
+START = 1500000000
+
+BOT = """
+[API]
+exchange = Poloniex
+
+[POLONIEX]
+all_currencies = BTC
+
+[BOT]
+sleeptimeactive = 60
+sleeptimeinactive = 300
+mindailyrate = 0.005
+maxdailyrate = 5
+spreadlend = 1
+gapMode = Raw
+gapbottom = 0
+gaptop = 0
+xdaythreshold = 0.2
+xdays = 60
+minloansize = 0.01
+"""
+
+
+def config(tmp_path, extra=""):
+    cfg_file = tmp_path / 'backtest.cfg'
+    cfg_file.write_text(BOT + extra)
+    Config.config.clear()
+    with open(str(cfg_file)) as f:
+        Config.init(f)
+    return Config
+
+
+def record_books(tmp_path, rates):
+    db_con = sqlite.connect(str(tmp_path / 'POLONIEX-BTC.db'))
+    db_con.execute("CREATE TABLE loans (id INTEGER PRIMARY KEY AUTOINCREMENT, unixtime integer(4) not null, "
+                   "rate0 FLOAT, amnt0 FLOAT, rate1 FLOAT, amnt1 FLOAT)")
+    db_con.executemany("INSERT INTO loans (unixtime, rate0, amnt0, rate1, amnt1) VALUES (?, ?, 1, ?, 1)",
+                       [(START + second, rate, rate * 2) for second, rate in enumerate(rates)])
+    db_con.commit()
+    db_con.close()
+    return MarketHistory.load(str(tmp_path), 'POLONIEX', ['BTC'])
+
+
+def test_offer_fills_when_best_rate_rises(tmp_path):
+    # the best offer stays at 0.0002 for a minute, then jumps above the offer just below it
+    history = record_books(tmp_path, [0.0002] * 61 + [0.0003] * (3 * 86400))
+    results = Backtest(config(tmp_path), history, {'BTC': 1.0}, days=3).run()
+    assert len(results) == 1
+    btc = results[0]
+    assert btc["loans"] == 1
+    assert btc["average_rate"] == pytest.approx(0.0002 - 0.000001)
+    assert btc["earned"] == pytest.approx(1.0 * (0.0002 - 0.000001) * 2 * 0.85)
+
+
+def test_unfilled_offers_are_cancelled(tmp_path):
+    history = record_books(tmp_path, [0.0002] * 3600)
+    backtest = Backtest(config(tmp_path), history, {'BTC': 1.0})
+    results = backtest.run()
+    assert results[0]["loans"] == 0
+    assert backtest.available['BTC'] == pytest.approx(1.0)
+
+
+def test_thin_book_raises_the_request_limit_until_it_is_exhausted(tmp_path, monkeypatch):
+    # the gap needs more than the two recorded levels, the request limit is raised twice
+    monkeypatch.setattr(Lending, 'defaultLoanOrdersRequestLimit', 1)
+    monkeypatch.setattr(Lending, 'loanOrdersRequestLimit', {})
+    cfg_file = tmp_path / 'backtest.cfg'
+    cfg_file.write_text(BOT.replace('gapbottom = 0', 'gapbottom = 2.5').replace('gaptop = 0', 'gaptop = 2.5'))
+    Config.config.clear()
+    with open(str(cfg_file)) as f:
+        Config.init(f)
+    history = record_books(tmp_path, [0.0002] * 600)
+    Backtest(Config, history, {'BTC': 1.0}).run()
+    assert Lending.loanOrdersRequestLimit['BTC'] == 3
+
+
+def test_rate_suggestions_match_get_rate_suggestion(tmp_path):
+    cfg = config(tmp_path, "\n[MarketAnalysis]\nanalyseCurrencies = BTC\nlendingStyle = 75\n"
+                           "percentile_seconds = 3600\n")
+    rates = 0.0002 + 0.00001 * numpy.sin(numpy.arange(7200) / 100.0)
+    history = record_books(tmp_path, rates.tolist())
+    analysis = MarketAnalysis(cfg, Backtest(cfg, history, {'BTC': 1.0}))
+    suggestions = analysis.get_rate_suggestions(START + numpy.arange(7200), rates)
+    window = int(3600 * 1.1)
+    expected = analysis.get_percentile(rates[7200 - window:].tolist(), 75)
+    assert suggestions.iloc[-1] == pytest.approx(expected)
+
+
+def test_sweep_parameters():
+    assert Sweep.parse_parameter('gapbottom=10,20', BOT) == (('BOT', 'gapbottom'), ['10', '20'])
+    assert Sweep.parse_parameter('MarketAnalysis.lendingStyle=10:90', BOT) == \
+        (('MarketAnalysis', 'lendingStyle'), (10, 90))
+    parameters = {('BOT', 'gapbottom'): ['10', '20'], ('BOT', 'spreadlend'): ['1', '2', '3']}
+    assert len(Sweep.grid(parameters)) == 6
+    variants = Sweep.random_variants({('BOT', 'xdaythreshold'): (0.1, 0.5), ('BOT', 'spreadlend'): (1, 5)}, 10, 1)
+    assert all(0.1 <= v[('BOT', 'xdaythreshold')] <= 0.5 and v[('BOT', 'spreadlend')] in range(1, 6)
+               for v in variants)
+    with pytest.raises(ValueError):
+        Sweep.grid({('BOT', 'spreadlend'): (1, 5)})
+
+
+def test_sweep_ranks_variants(tmp_path):
+    history = record_books(tmp_path, [0.0002] * 61 + [0.0003] * 3600)
+    # a minimum rate above the book keeps the first variant from lending, the last one is invalid
+    variants = [{('BOT', 'mindailyrate'): '0.05'}, {('BOT', 'mindailyrate'): '0.005'},
+                {('BOT', 'mindailyrate'): '10'}]
+    ranked = Sweep.run(BOT, history, {'BTC': 1.0}, variants, workers=2)
+    assert [r["variant"] for r in ranked] == [variants[1], variants[0], variants[2]]
+    assert ranked[0]["yearly_rate"] > 0
+    assert ranked[0]["results"][0]["loans"] == 1
+    assert ranked[1]["yearly_rate"] == 0
+    assert ranked[2]["error"]
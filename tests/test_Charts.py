@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import coinlendingbot.Storage as Storage  # nopep8
+from coinlendingbot.plugins.AccountStats import DB_CREATE, DB_CREATE_DAILY_EARNINGS, DB_INSERT, \
+    update_daily_earnings  # nopep8
+from coinlendingbot.plugins.Charts import Charts, DB_PATH  # nopep8
+
+DAY = 86400
+# 2017-07-10, a Monday
+MONDAY = 1499644800
+
+
+@pytest.fixture(autouse=True)
+def close_databases():
+    yield
+    Storage.close_all()
+
+
+def add_loans(db, *loans):
+    """
+    Adds loans (id, currency, close, earned) to the history
+    """
+    def add(connection):
+        connection.executemany(DB_INSERT, [(loan_id, close, close, 1, 0, 0.0002, currency, 1, earned, 0)
+                                           for loan_id, currency, close, earned in loans])
+        update_daily_earnings(connection, set((currency, close[:10]) for loan_id, currency, close, earned in loans))
+    db.write(add)
+
+
+def create_charts(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.mkdir('market_data')
+    db = Storage.open_db(DB_PATH)
+    db.execute(DB_CREATE)
+    db.execute(DB_CREATE_DAILY_EARNINGS)
+    charts = Charts.__new__(Charts)
+    charts.db = db
+    return charts
+
+
+def test_query_since_and_resolution(tmpdir, monkeypatch):
+    charts = create_charts(tmpdir, monkeypatch)
+    add_loans(charts.db, *[(i, 'BTC', '2017-07-{:02d} 12:00:00'.format(10 + i), 1) for i in range(10)])
+    since = Charts.query_history(charts.db, 'BTC', since=MONDAY + 8 * DAY)
+    assert since == {'BTC': [[MONDAY + 8 * DAY, 1.0, 9.0], [MONDAY + 9 * DAY, 1.0, 10.0]]}
+    weeks = Charts.query_history(charts.db, resolution='week')
+    assert weeks == {'BTC': [[MONDAY, 7.0, 7.0], [MONDAY + 7 * DAY, 3.0, 10.0]]}
+    # since a day within the week starts with its week
+    assert Charts.query_history(charts.db, since=MONDAY + 9 * DAY, resolution='week')['BTC'] == [
+        [MONDAY + 7 * DAY, 3.0, 10.0]]
+    assert Charts.query_history(charts.db, until=MONDAY + DAY)['BTC'][-1] == [MONDAY + DAY, 1.0, 2.0]
+
+
+def test_charts_route(tmpdir, monkeypatch):
+    charts = create_charts(tmpdir, monkeypatch)
+    add_loans(charts.db, (1, 'BTC', '2017-07-10 08:00:00', 0.1))
+    status, headers, body = charts.charts_route({}, {'currency': 'btc'})
+    assert status == 200
+    assert json.loads(body.decode('utf-8')) == {'BTC': [[MONDAY, 0.1, 0.1]]}
+    assert charts.charts_route({}, {'resolution': 'hour'})[0] == 400
@@ -0,0 +1,66 @@
+import datetime
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Clock  # nopep8
+from coinlendingbot.ExchangeApi import ExchangeApi  # nopep8
+from coinlendingbot.RingBuffer import RingBuffer  # nopep8
+
+START = 1500000000
+
+
+@pytest.fixture
+def manual_clock():
+    clock = Clock.ManualClock(START)
+    previous = Clock.set_clock(clock)
+    yield clock
+    Clock.set_clock(previous)
+
+
+def test_manual_clock_advances_by_sleeping(manual_clock):
+    started = time.time()
+    Clock.sleep(3600)
+    assert Clock.time() == START + 3600
+    assert Clock.utcnow() == datetime.datetime(2017, 7, 14, 3, 40)
+    assert time.time() - started < 1
+
+
+def test_manual_clock_wakes_other_threads_when_advanced(manual_clock):
+    woken = []
+    sleeper = threading.Thread(target=lambda: woken.append(Clock.sleep(60) or Clock.time()))
+    sleeper.start()
+    manual_clock.advance(30)
+    sleeper.join(0.2)
+    assert sleeper.is_alive()
+    manual_clock.advance(30)
+    sleeper.join(5)
+    assert woken == [START + 60]
+
+
+def test_accelerated_clock():
+    clock = Clock.AcceleratedClock(1000, START)
+    started = time.time()
+    clock.sleep(100)
+    assert 0.05 <= time.time() - started < 1
+    assert clock.time() >= START + 100
+    with pytest.raises(ValueError):
+        Clock.AcceleratedClock(0)
+
+
+def test_request_limit_sleeps_on_the_clock(manual_clock):
+    api = SimpleNamespace(req_time_log=RingBuffer(2), req_per_period=2, req_period=1000)
+    for _ in range(3):
+        ExchangeApi.limit_request_rate(api)
+    assert Clock.time() == START + 1
@@ -0,0 +1,70 @@
+import datetime
+import json
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import EventLog  # nopep8
+from coinlendingbot import WebServer  # nopep8
+
+START = 1500000000
+
+
+def timestamp(time):
+    return datetime.datetime.fromtimestamp(time).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def test_events_render_the_log_lines():
+    log = EventLog.EventLog(10)
+    offer = log.add(EventLog.OFFER, START, 'Loan order placed.', 'BTC', amount='0.5', rate='0.0002', days='2')
+    assert offer.text() == timestamp(START) + ' Placing 0.5 BTC at 0.02% for 2 days... Loan order placed.'
+    not_lending = log.add(EventLog.NOT_LENDING, START, currency='ETH', rate=0.0001, min_rate=0.0003)
+    assert not_lending.text().endswith('Not lending ETH due to rate below 0.0300% (actual: 0.0100%)')
+    error = log.add(EventLog.ERROR, START, 'first\nsecond')
+    assert error.text() == timestamp(START) + ' Error first | second'
+    assert offer.to_dict()['rate'] == 0.0002
+    assert 'currency' not in error.to_dict()
+
+
+def test_keeps_the_last_events():
+    log = EventLog.EventLog(3)
+    for i in range(10):
+        log.add(EventLog.LOG, START + i, str(i), 'BTC' if i % 2 else None)
+    assert [event.message for event in log.latest()] == ['7', '8', '9']
+    assert [event.message for event in log.query()] == ['9', '8', '7']
+    assert [event.message for event in log.query('BTC')] == ['9', '7']
+    assert log.query('ETH') == []
+
+
+def test_query_pages_by_type_currency_and_time():
+    log = EventLog.EventLog(100)
+    for i in range(20):
+        log.add(EventLog.OFFER if i % 2 else EventLog.CANCEL, START + i, '', 'BTC' if i < 10 else 'ETH')
+    page = log.query('BTC', EventLog.OFFER, limit=3)
+    assert [event.time - START for event in page] == [9, 7, 5]
+    page = log.query('BTC', EventLog.OFFER, before=page[-1].id, limit=3)
+    assert [event.time - START for event in page] == [3, 1]
+    page = log.query(since=START + 8, until=START + 11)
+    assert [event.time - START for event in page] == [11, 10, 9, 8]
+
+
+def test_log_route():
+    log = EventLog.EventLog(100)
+    for i in range(5):
+        log.add(EventLog.CANCEL, START + i, '', 'BTC')
+    route = WebServer.event_log_route(log)
+    status, headers, body = route({}, {'currency': 'btc', 'limit': '2'})
+    assert status == 200
+    answer = json.loads(body.decode('utf-8'))
+    assert [event['id'] for event in answer['events']] == [5, 4]
+    assert answer['next'] == 4
+    answer = json.loads(route({}, {'before': '4', 'limit': '10'})[2].decode('utf-8'))
+    assert [event['id'] for event in answer['events']] == [3, 2, 1]
+    assert answer['next'] is None
+    assert route({}, {'limit': 'ten'})[0] == 400
@@ -0,0 +1,94 @@
+import sqlite3 as sqlite
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Clock  # nopep8
+from coinlendingbot import Configuration as Config  # nopep8
+from coinlendingbot.ExchangeSimulator import ExchangeSimulator, MarketHistory  # nopep8
+
+START = 1500000000
+
+
+@pytest.fixture(autouse=True)
+def real_clock():
+    # the simulator sets its clock as the one of the bot
+    yield
+    Clock.set_clock(Clock.RealClock())
+
+
+def simulator(tmp_path, demand, **options):
+    cfg_file = tmp_path / 'simulator.cfg'
+    lines = ["[API]", "exchange = Poloniex", "", "[POLONIEX]", "all_currencies = BTC,ETH", "", "[SIMULATOR]",
+             "demand = {}".format(demand), "seed = 3", "marketData = {}".format(tmp_path)]
+    lines += ["{} = {}".format(k, v) for k, v in dict({"days": 2}, **options).items()]
+    cfg_file.write_text("\n".join(lines) + "\n")
+    Config.config.clear()
+    with open(str(cfg_file)) as f:
+        Config.init(f)
+    return ExchangeSimulator(Config, None)
+
+
+def record_books(tmp_path, cur, books):
+    db_con = sqlite.connect(str(tmp_path / 'POLONIEX-{}.db'.format(cur)))
+    db_con.execute("CREATE TABLE loans (id INTEGER PRIMARY KEY AUTOINCREMENT, unixtime integer(4) not null, "
+                   "rate0 FLOAT, amnt0 FLOAT, rate1 FLOAT, amnt1 FLOAT)")
+    for unixtime, levels in books:
+        db_con.execute("INSERT INTO loans (unixtime, rate0, amnt0, rate1, amnt1) VALUES (?, ?, ?, ?, ?)",
+                       [unixtime] + [value for level in levels for value in level])
+    db_con.commit()
+    db_con.close()
+
+
+def test_synthetic_loans_return_with_interest(tmp_path):
+    api = simulator(tmp_path, 'synthetic', days=4)
+    balance = float(api.return_available_account_balances('lending')['lending']['BTC'])
+    rate = api.market.base_rates['BTC']
+    api.create_loan_offer('BTC', balance, 2, 0, rate)
+    assert api.return_available_account_balances('lending') == {'lending': {'ETH': '10.00000000'}}
+    while not api.is_finished():
+        api.clock.sleep(600)
+        api.return_open_loan_offers()
+    history = api.return_lending_history(api.start_time, api.clock.time(), 5000)
+    assert len(history) > 0
+    assert float(api.return_available_account_balances('lending')['lending']['BTC']) > balance
+    assert 'average daily rate' in api.summary()
+
+
+def test_history_levels_and_max_rate(tmp_path):
+    record_books(tmp_path, 'BTC', [(START, [(0.0002, 1), (0.0003, 2)]),
+                                   (START + 60, [(0.0004, 1), (MarketHistory.MISSING_RATE, 0)]),
+                                   (START + 120, [(0.0001, 1), (0.0002, 2)])])
+    history = MarketHistory.load(str(tmp_path), 'POLONIEX', ['BTC', 'ETH'])
+    assert list(history.books.keys()) == ['BTC']
+    assert history.levels('BTC', START - 1) == []
+    assert history.levels('BTC', START + 90) == [(0.0004, 1)]
+    assert history.max_rate('BTC', START + 60, START + 120) == 0.0004
+    assert history.max_rate('BTC', START + 120, START + 200) == 0.0001
+
+
+def test_replay_fills_offers_below_recorded_rate(tmp_path):
+    record_books(tmp_path, 'BTC', [(START + minute * 60, [(0.0002 + minute * 0.00001, 1), (0.001, 2)])
+                                   for minute in range(60)])
+    api = simulator(tmp_path, 'replay')
+    assert api.clock.time() == START
+    assert api.end_time == START + 59 * 60
+    assert api.return_loan_orders('BTC')['offers'][0]['rate'] == '0.00020000'
+    api.create_loan_offer('BTC', 0.1, 2, 0, 0.0003)
+    api.create_loan_offer('BTC', 0.1, 2, 0, 0.0009)
+    api.clock.sleep(30 * 60)
+    offers = api.return_open_loan_offers()
+    assert [o['rate'] for o in offers['BTC']] == ['0.00090000']
+    assert len(api.return_active_loans()['provided']) == 1
+
+
+def test_replay_needs_recorded_data(tmp_path):
+    with pytest.raises(Exception, match='No recorded market data'):
+        simulator(tmp_path, 'replay')
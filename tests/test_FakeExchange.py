@@ -0,0 +1,92 @@
+import base64
+import json
+import pytest
+import requests
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot.fakeexchange import Market, FakeRestServer  # nopep8
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1500000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def server():
+    server = FakeRestServer(Market(['BTC', 'USD'], seed=1))
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def poloniex(server, command, **params):
+    params["command"] = command
+    return requests.post(server.url + '/tradingApi', data=params).json()
+
+
+def bitfinex(server, command, **params):
+    params["request"] = '/v1/' + command
+    payload = base64.standard_b64encode(json.dumps(params).encode('utf8'))
+    return requests.post(server.url + '/v1/' + command, headers={"X-BFX-PAYLOAD": payload})
+
+
+def test_loan_offer_fills_and_returns():
+    clock = Clock()
+    market = Market(['BTC'], seed=1, clock=clock, demand_per_minute=60)
+    rate = round(market.base_rates['BTC'], 8)
+    offer_id = market.create_offer('BTC', 0.1, 2, 0, rate)
+    assert 0.1 == sum(o["amount"] for o in market.loan_orders('BTC')["offers"] if o["rate"] == rate)
+    clock.now += 600
+    market.step()
+    assert offer_id not in [o["id"] for o in market.open_offers()]
+    assert 0.1 == pytest.approx(sum(loan["amount"] for loan in market.active_loans()))
+    clock.now += 2 * 86400
+    market.step()
+    assert [] == market.active_loans()
+    assert 1 == len(market.lending_history(0, clock.now))
+    assert 0 < market.lending_history(0, clock.now)[0]["earned"]
+
+
+def test_poloniex_endpoints(server):
+    loan_orders = requests.get(server.url + '/public', params={"command": "returnLoanOrders", "currency": "BTC",
+                                                               "limit": 5}).json()
+    assert 5 == len(loan_orders["offers"])
+    ticker = requests.get(server.url + '/public', params={"command": "returnTicker"}).json()
+    assert {"BTC_USD", "USD_BTC"} == set(ticker.keys())
+    balance = poloniex(server, 'returnAvailableAccountBalances', account='lending')["lending"]["BTC"]
+    offer = poloniex(server, 'createLoanOffer', currency='BTC', amount=balance, duration=2, autoRenew=0,
+                     lendingRate='0.05')
+    assert 1 == offer["success"]
+    assert [offer["orderID"]] == [o["id"] for o in poloniex(server, 'returnOpenLoanOffers')["BTC"]]
+    assert "error" in poloniex(server, 'createLoanOffer', currency='BTC', amount=balance, duration=2, autoRenew=0,
+                               lendingRate='0.05')
+    assert 1 == poloniex(server, 'cancelLoanOffer', currency='BTC', orderNumber=offer["orderID"])["success"]
+
+
+def test_bitfinex_endpoints(server):
+    assert ["btcusd"] == requests.get(server.url + '/v1/symbols').json()
+    offer = bitfinex(server, 'offer/new', currency='USD', amount='100', rate='36.5', period=2, direction='lend').json()
+    assert 0.001 == pytest.approx(float(offer["rate"]) / 36500)
+    assert [offer["id"]] == [o["id"] for o in bitfinex(server, 'offers').json()]
+    deposit = [b for b in bitfinex(server, 'balances').json() if b["type"] == "deposit" and b["currency"] == "usd"]
+    assert float(deposit[0]["amount"]) - 100 == pytest.approx(float(deposit[0]["available"]))
+
+
+def test_rate_limit(server):
+    server.rate_limit = 2
+    status = [requests.get(server.url + '/v1/symbols').status_code for _ in range(5)]
+    assert 429 in status
+    assert server.stats["rejected"] == status.count(429)
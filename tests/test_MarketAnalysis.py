@@ -6,7 +6,6 @@ import csv
 import datetime
 import time
 import pytest
-import sqlite3 as sqlite
 from random import randint
 import pandas as pd
 
@@ -24,6 +23,7 @@ from coinlendingbot.Configuration import get_all_currencies  # nopep8
 from coinlendingbot.Poloniex import Poloniex  # nopep8
 import coinlendingbot.Configuration as Config  # nopep8
 import coinlendingbot.Data as Data  # nopep8
+import coinlendingbot.Storage as Storage  # nopep8
 
 Config.init(open('poloniex_test.cfg'), Data)
 api = Poloniex(Config, None)
@@ -67,13 +67,13 @@ def populated_db():
 
 
 def test_new_db():
-    assert(isinstance(new_db(), sqlite.Connection))
+    assert(isinstance(new_db(), Storage.Database))
 
 
 def test_insert_into_db(populated_db):
     db_con, rates = populated_db
     query = "SELECT rate0, amnt0, rate1, amnt1, rate2, amnt2, percentile FROM loans;"
-    db_rates = db_con.cursor().execute(query).fetchall()
+    db_rates = db_con.query(query)
     assert(len(rates) == len(db_rates))
     for db_rate, rate in zip(db_rates, rates):
         assert(len(rate) == len(db_rate))
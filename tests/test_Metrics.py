@@ -0,0 +1,102 @@
+import socket
+import threading
+import time
+import urllib.request
+
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Metrics  # nopep8
+from coinlendingbot import WebServer  # nopep8
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    Metrics.reset()
+    yield
+    Metrics.reset()
+
+
+def test_histogram_quantiles():
+    histogram = Metrics.Histogram()
+    for value in [0.02] * 90 + [3] * 10:
+        histogram.observe(value)
+    assert 0.01 < histogram.quantile(0.5) <= 0.025
+    assert histogram.quantile(0.99) == pytest.approx(3)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["max"] == 3
+    assert summary["mean"] == pytest.approx(0.318)
+
+
+def test_span_breaks_down_api_limiter_and_children():
+    with Metrics.span('round', breakdown=True) as round_span:
+        with Metrics.span('phase', phase='lend_all'):
+            with Metrics.api_call('createLoanOffer'):
+                time.sleep(0.02)
+            Metrics.limiter_wait(0.5)
+    assert [child.label() for child in round_span.children] == ['lend_all']
+    assert 0.02 <= round_span.api_seconds <= round_span.seconds
+    assert round_span.limiter_seconds == 0.5
+    assert round_span.cpu_seconds < round_span.seconds
+    assert Metrics.get_histogram('round_seconds').count == 1
+    assert Metrics.get_histogram('round_limiter_seconds').max == 0.5
+    assert Metrics.get_histogram('phase_seconds', phase='lend_all').count == 1
+    summary = Metrics.summary()
+    assert summary['api_seconds{endpoint=createLoanOffer}']['count'] == 1
+    assert 'lend_all' in Metrics.describe(round_span)
+
+
+def test_prometheus_format():
+    Metrics.increment('offers_placed_total', currency='BTC')
+    Metrics.increment('offers_placed_total', 2, currency='BTC')
+    Metrics.set_gauges('lent_amount', 'currency', {'ETH': 1.5})
+    Metrics.set_gauges('lent_amount', 'currency', {'BTC': 0.25})
+    Metrics.register_gauge('websocket_book_age_seconds', lambda: [({'currency': 'BTC'}, 3.0)])
+    Metrics.observe('round_seconds', 0.3)
+    with pytest.raises(ValueError):
+        with Metrics.api_call('returnTicker'):
+            raise ValueError()
+    lines = Metrics.prometheus().splitlines()
+    assert 'lendingbot_offers_placed_total{currency="BTC"} 3' in lines
+    assert 'lendingbot_lent_amount{currency="BTC"} 0.25' in lines
+    assert not any(line.startswith('lendingbot_lent_amount{currency="ETH"') for line in lines)
+    assert 'lendingbot_websocket_book_age_seconds{currency="BTC"} 3.0' in lines
+    assert 'lendingbot_api_requests_total{endpoint="returnTicker",status="error"} 1' in lines
+    assert '# TYPE lendingbot_round_seconds histogram' in lines
+    assert 'lendingbot_round_seconds_bucket{le="0.25"} 0' in lines
+    assert 'lendingbot_round_seconds_bucket{le="0.5"} 1' in lines
+    assert 'lendingbot_round_seconds_bucket{le="+Inf"} 1' in lines
+    assert 'lendingbot_round_seconds_count 1' in lines
+
+
+def test_web_server_serves_metrics():
+    Metrics.increment('offers_cancelled_total', currency='BTC')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    WebServer.web_server_ip = '127.0.0.1'
+    WebServer.web_server_port = str(port)
+    thread = threading.Thread(target=WebServer.start_web_server)
+    thread.start()
+    try:
+        for _ in range(50):
+            if WebServer.server is not None:
+                break
+            time.sleep(0.1)
+        with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(port)) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert 'lendingbot_offers_cancelled_total{currency="BTC"} 1' in response.read().decode('utf-8')
+    finally:
+        WebServer.server.shutdown()
+        thread.join(5)
+        WebServer.server.server_close()
+        WebServer.server = None
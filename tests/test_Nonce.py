@@ -0,0 +1,16 @@
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Nonce  # nopep8
+
+
+def test_nonces_increase_within_a_microsecond(monkeypatch):
+    monkeypatch.setattr(Nonce.time, 'time', lambda: 1500000000.0)
+    monkeypatch.setattr(Nonce, 'last', 0)
+    assert [Nonce.next_nonce() for _ in range(3)] == [1500000000000000, 1500000000000001, 1500000000000002]
@@ -0,0 +1,118 @@
+import smtplib
+import threading
+import time
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Metrics  # nopep8
+from coinlendingbot import Notify  # nopep8
+
+
+def test_burst_is_sent_as_one_digest():
+    sent = []
+    channel = Notify.Channel('test', sent.append, digest_seconds=0.2)
+    for i in range(3):
+        channel.put('loan {}'.format(i))
+    channel.flush(5)
+    assert len(sent) == 1
+    assert sent[0].startswith('3 notifications:')
+    assert 'loan 0' in sent[0] and 'loan 2' in sent[0]
+
+
+def test_full_queue_drops_notifications():
+    Metrics.reset()
+    release = threading.Event()
+    sent = []
+
+    def slow_send(msg):
+        release.wait(5)
+        sent.append(msg)
+    channel = Notify.Channel('slow', slow_send, queue_size=2, digest_seconds=0)
+    channel.put('first')
+    # wait for the worker to take the first one
+    for _ in range(100):
+        if channel.queue.empty():
+            break
+        time.sleep(0.01)
+    for i in range(4):
+        channel.put(str(i))
+    assert Metrics.get_counter('notifications_dropped_total', channel='slow') == 2
+    release.set()
+    channel.flush(5)
+    assert sent[0] == 'first'
+    assert '0' in sent[1] and '1' in sent[1]
+
+
+class FakeSMTP(object):
+    connections = 0
+
+    def __init__(self, server, port):
+        FakeSMTP.connections += 1
+        self.sent = 0
+
+    def ehlo(self):
+        pass
+
+    def login(self, address, password):
+        pass
+
+    def sendmail(self, from_address, to_addresses, text):
+        self.sent += 1
+        if self.sent > 2:
+            raise smtplib.SMTPServerDisconnected()
+
+    def quit(self):
+        pass
+
+
+def test_mailer_keeps_the_connection(monkeypatch):
+    monkeypatch.setattr(smtplib, 'SMTP_SSL', FakeSMTP)
+    mailer = Notify.Mailer('bot@example.com', 'secret', 'smtp.example.com', 465, ['me@example.com'], False)
+    for i in range(3):
+        mailer.send('loan {}'.format(i))
+    # reconnected once the server closed the connection
+    assert FakeSMTP.connections == 2
+
+
+def test_changed_configuration_replaces_the_dispatcher(monkeypatch):
+    sent = []
+    monkeypatch.setattr(Notify, 'post_to_slack', lambda msg, channels, token: sent.append((token, msg)))
+    monkeypatch.setattr(Notify, 'dispatcher', None)
+    notify_conf = {'email': False, 'slack': True, 'telegram': False, 'pushbullet': False, 'irc': False,
+                   'slack_channels': ['#bot'], 'slack_token': 'old', 'notify_digest_seconds': 0}
+    Notify.dispatch('first', notify_conf)
+    old = Notify.dispatcher
+    Notify.dispatch('second', dict(notify_conf))
+    assert Notify.dispatcher is old
+    notify_conf['slack_token'] = 'new'
+    Notify.dispatch('third', notify_conf)
+    assert Notify.dispatcher is not old
+    assert not old.channels[0].thread.is_alive()
+    Notify.flush(5)
+    assert sent[0][0] == 'old' and 'first' in sent[0][1] and 'second' in sent[0][1]
+    assert sent[-1] == ('new', 'third')
+
+
+def test_idle_channel_keeps_its_connection():
+    idle = threading.Event()
+    channel = Notify.Channel('irc', lambda msg: None, idle=idle.set, idle_seconds=0.05)
+    assert idle.wait(5)
+    channel.close(5)
+
+
+def test_close_does_not_wait_for_the_digest():
+    sent = []
+    channel = Notify.Channel('test', sent.append, digest_seconds=30)
+    channel.put('loan')
+    started = time.time()
+    channel.close(5)
+    assert time.time() - started < 5
+    assert sent == ['loan']
+    assert not channel.thread.is_alive()
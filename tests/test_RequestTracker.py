@@ -0,0 +1,60 @@
+import logging
+
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Clock  # nopep8
+from coinlendingbot import RequestTracker  # nopep8
+
+START = 1500000000
+
+
+@pytest.fixture(autouse=True)
+def manual_clock():
+    clock = Clock.ManualClock(START)
+    previous = Clock.set_clock(clock)
+    yield clock
+    Clock.set_clock(previous)
+
+
+def test_requests_are_attributed_to_callers():
+    tracker = RequestTracker.RequestTracker(6)
+    with RequestTracker.caller('analysis'):
+        tracker.record('returnLoanOrders')
+        tracker.record('returnLoanOrders')
+        tracker.record_rate_limited()
+    RequestTracker.set_caller('lending')
+    tracker.record('createLoanOffer')
+    summary = tracker.summary()
+    assert summary["callers"]["analysis"]["endpoints"] == {"returnLoanOrders": 2}
+    assert summary["callers"]["analysis"]["rate_limited"] == 1
+    assert summary["callers"]["lending"]["requests"] == 1
+    assert summary["rate"] == pytest.approx(0.3)
+    assert summary["headroom"] == pytest.approx(0.95)
+
+
+def test_warns_close_to_the_limit(manual_clock, caplog):
+    tracker = RequestTracker.RequestTracker(1, 0.8)
+    with caplog.at_level(logging.WARNING):
+        for _ in range(7):
+            tracker.record('returnTicker', 'lending')
+            manual_clock.advance(1)
+        assert not caplog.records
+        # 8 requests in 10 seconds
+        tracker.record('returnTicker', 'analysis')
+        assert len(caplog.records) == 1
+        assert 'lending 7, analysis 1' in caplog.records[0].getMessage()
+        # only once a minute
+        tracker.record('returnTicker', 'analysis')
+        assert len(caplog.records) == 1
+    # the old requests left the window
+    manual_clock.advance(60)
+    assert tracker.summary()["rate"] == 0
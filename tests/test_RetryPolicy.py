@@ -0,0 +1,111 @@
+import socket
+import urllib.error
+
+import pytest
+import requests
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Clock  # nopep8
+from coinlendingbot.ExchangeApi import ApiError, ApiTimeoutError, AuthenticationError, CircuitOpenError, \
+    ConnectionFailedError, RateLimitError, ServerError, classify_error  # nopep8
+from coinlendingbot.RetryPolicy import RetryPolicy  # nopep8
+
+START = 1500000000
+
+
+@pytest.fixture(autouse=True)
+def manual_clock():
+    clock = Clock.ManualClock(START)
+    previous = Clock.set_clock(clock)
+    yield clock
+    Clock.set_clock(previous)
+
+
+def failing(*errors):
+    """
+    Returns a function raising the errors one after the other, then returning 'ok'
+    """
+    errors = list(errors)
+    calls = []
+
+    def function():
+        calls.append(Clock.time())
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    function.calls = calls
+    return function
+
+
+def test_classify_error():
+    assert isinstance(classify_error(ApiError('Invalid API key/secret pair.')), AuthenticationError)
+    assert 'IP filter' in classify_error(ApiError('Permission denied.')).hint
+    assert isinstance(classify_error(urllib.error.HTTPError('url', 429, 'Too Many', {}, None)), RateLimitError)
+    assert isinstance(classify_error(urllib.error.HTTPError('url', 502, 'Bad Gateway', {}, None)), ServerError)
+    assert isinstance(classify_error(requests.exceptions.ReadTimeout('read timed out')), ApiTimeoutError)
+    assert isinstance(classify_error(socket.timeout()), ApiTimeoutError)
+    assert isinstance(classify_error(requests.exceptions.ConnectionError('refused')), ConnectionFailedError)
+    not_found = urllib.error.HTTPError('url', 404, 'Not Found', {}, None)
+    assert classify_error(not_found) is not_found
+    refused = ApiError('Not enough BTC.')
+    assert classify_error(refused) is refused
+
+
+def test_transient_failures_are_retried_with_backoff():
+    policy = RetryPolicy(retries=3, delay=1, seed=1)
+    function = failing(ApiTimeoutError('timed out'), ServerError('502'))
+    assert policy.call('returnLoanOrders', function) == 'ok'
+    assert len(function.calls) == 3
+    # jittered between half and all of 1 s, then of 2 s
+    assert 0.5 <= function.calls[1] - function.calls[0] <= 1
+    assert 1 <= function.calls[2] - function.calls[1] <= 2
+
+
+def test_gives_up_after_the_retries():
+    policy = RetryPolicy(retries=2, breaker_failures=10)
+    function = failing(*[ApiTimeoutError('timed out')] * 5)
+    with pytest.raises(ApiTimeoutError):
+        policy.call('returnTicker', function)
+    assert len(function.calls) == 3
+
+
+def test_writes_are_retried_only_when_rate_limited():
+    policy = RetryPolicy(write_endpoints=['createLoanOffer'])
+    function = failing(ApiTimeoutError('timed out'))
+    with pytest.raises(ApiTimeoutError):
+        policy.call('createLoanOffer', function)
+    assert len(function.calls) == 1
+    function = failing(RateLimitError('Error 429'))
+    assert policy.call('createLoanOffer', function) == 'ok'
+    # the rate limit waits longer
+    assert function.calls[1] - function.calls[0] >= 5
+
+
+def test_other_errors_are_not_retried():
+    policy = RetryPolicy()
+    function = failing(ApiError('Not enough BTC.'))
+    with pytest.raises(ApiError):
+        policy.call('createLoanOffer', function)
+    assert len(function.calls) == 1
+
+
+def test_circuit_breaker_opens_per_endpoint(manual_clock):
+    policy = RetryPolicy(retries=0, breaker_failures=2, breaker_seconds=60)
+    for _ in range(2):
+        with pytest.raises(ServerError):
+            policy.call('returnLoanOrders', failing(ServerError('502')))
+    function = failing()
+    with pytest.raises(CircuitOpenError):
+        policy.call('returnLoanOrders', function)
+    assert function.calls == []
+    assert policy.call('returnTicker', function) == 'ok'
+    manual_clock.advance(60)
+    assert policy.call('returnLoanOrders', function) == 'ok'
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import coinlendingbot.Metrics as Metrics  # nopep8
+import coinlendingbot.Storage as Storage  # nopep8
+
+
+@pytest.fixture
+def db(tmp_path):
+    Metrics.reset()
+    database = Storage.open_db(str(tmp_path / 'test.db'), 'test')
+    database.execute("CREATE TABLE numbers (value INTEGER)")
+    yield database
+    Storage.close_all()
+
+
+def test_one_database_per_file(db, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert Storage.open_db('test.db') is db
+    assert db.query_one("PRAGMA journal_mode")[0] == 'wal'
+    assert Storage.open_db(':memory:') is not Storage.open_db(':memory:')
+
+
+def test_writes_from_many_threads(db):
+    def write(start):
+        for value in range(start, start + 50):
+            db.execute("INSERT INTO numbers VALUES (?)", (value,))
+            db.query("SELECT COUNT(*) FROM numbers")
+
+    threads = [threading.Thread(target=write, args=(i * 50,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db.query_one("SELECT COUNT(*), SUM(value) FROM numbers") == (400, sum(range(400)))
+    assert Metrics.get_histogram('sqlite_write_seconds', db='test').count == 401
+    assert Metrics.get_histogram('sqlite_query_seconds', db='test').count == 401
+
+
+def test_failed_write_is_rolled_back(db):
+    def write(connection):
+        connection.execute("INSERT INTO numbers VALUES (1)")
+        raise ValueError('no')
+
+    with pytest.raises(ValueError):
+        db.write(write)
+    assert db.query("SELECT * FROM numbers") == []
+    with pytest.raises(Exception):
+        # queries can't write
+        with db.reader() as connection:
+            connection.execute("INSERT INTO numbers VALUES (1)")
+
+
+def test_memory_database():
+    db = Storage.open_db(':memory:')
+    db.execute("CREATE TABLE numbers (value INTEGER)")
+    db.executemany("INSERT INTO numbers VALUES (?)", [(1,), (2,)])
+    assert db.query("SELECT value FROM numbers ORDER BY value") == [(1,), (2,)]
+    db.close()
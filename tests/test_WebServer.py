@@ -0,0 +1,194 @@
+import gzip
+import http.client
+import json
+import socket
+import threading
+import time
+import urllib.request
+
+import pytest
+
+# Hack to get relative imports - probably need to fix the dir structure instead but we need this at the minute for
+# pytest to work
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from coinlendingbot import Clock  # nopep8
+from coinlendingbot import WebServer  # nopep8
+from coinlendingbot.Logger import JsonOutput  # nopep8
+
+
+def messages(log):
+    """
+    Returns the lines of log without their timestamps
+    """
+    return [line.split(' ', 2)[2] for line in log]
+
+
+@pytest.fixture(autouse=True)
+def manual_clock():
+    clock = Clock.ManualClock(1500000000)
+    previous = Clock.set_clock(clock)
+    yield clock
+    Clock.set_clock(previous)
+
+
+def test_publish_counts_changes_only():
+    output = JsonOutput(None, 10, 'POLONIEX')
+    output.printline('Placing 1 BTC')
+    output.publish()
+    version, body = output.snapshot()
+    assert messages(json.loads(body.decode('ascii'))['log']) == ['Placing 1 BTC']
+    output.publish()
+    assert output.snapshot()[0] == version
+    output.statusValue('BTC', 'averageLendingRate', 0.01)
+    output.publish()
+    assert output.snapshot()[0] == version + 1
+
+
+def test_status_route_etag_and_gzip():
+    output = JsonOutput(None, 10)
+    output.publish()
+    route = WebServer.snapshot_route(output.snapshot)
+    status, headers, body = route({'Accept-Encoding': 'gzip, deflate'}, {})
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == output.snapshot()[1]
+    assert route({'If-None-Match': headers['ETag']}, {})[0] == 304
+    output.printline('Canceling BTC order')
+    output.publish()
+    status, unused, body = route({'If-None-Match': headers['ETag']}, {})
+    assert status == 200
+    assert b'Canceling BTC order' in body
+
+
+def test_file_writes_are_throttled(tmpdir, manual_clock):
+    path = str(tmpdir.join('botlog.json'))
+    output = JsonOutput(path, 10)
+    output.fileInterval = 60
+    output.printline('first')
+    output.publish()
+    output.printline('second')
+    output.publish()
+    output.close()
+    assert messages(json.load(open(path))['log']) == ['first']
+    manual_clock.advance(60)
+    output.publish()
+    output.close()
+    assert messages(json.load(open(path))['log']) == ['first', 'second']
+    assert os.listdir(str(tmpdir)) == ['botlog.json']
+
+
+def test_unchanged_status_is_not_written(tmpdir):
+    path = str(tmpdir.join('botlog.json'))
+    output = JsonOutput(path, 10)
+    output.publish()
+    output.close()
+    os.remove(path)
+    output.publish()
+    output.close()
+    assert not os.path.exists(path)
+    output.printline('changed')
+    output.publish()
+    output.close()
+    assert messages(json.load(open(path))['log']) == ['changed']
+
+
+def test_delta_holds_the_changes():
+    output = JsonOutput(None, 10)
+    deltas = []
+    output.subscribe(lambda version, delta: deltas.append(delta))
+    output.statusValue('BTC', 'lentSum', 1)
+    output.statusValue('ETH', 'lentSum', 2)
+    output.printline('first')
+    output.publish()
+    output.clearStatusValues()
+    output.statusValue('BTC', 'lentSum', 3)
+    output.printline('second')
+    output.publish()
+    assert deltas[0]['version'] == 1
+    assert deltas[1]['version'] == 2
+    assert messages(deltas[1]['log']) == ['second']
+    assert deltas[1]['coins'] == {'BTC': {'lentSum': '3'}}
+    assert deltas[1]['removedCoins'] == ['ETH']
+    assert 'label' not in deltas[1]['set']
+
+
+def test_event_stream_pushes_deltas():
+    output = JsonOutput(None, 10)
+    stream = WebServer.EventStream(queue_size=2, heartbeat=0.01)
+    output.subscribe(WebServer.status_delta_listener(stream))
+    output.publish()
+    status, headers, events = WebServer.status_events_route(output.snapshot, stream)({}, {})
+    assert headers['Content-Type'] == 'text/event-stream'
+    assert next(events).startswith(b'id: 1\nevent: snapshot\ndata: {')
+    output.printline('Placing 1 BTC')
+    output.publish()
+    event = next(events)
+    assert event.startswith(b'id: 2\nevent: delta\n')
+    assert messages(json.loads(event.decode('ascii').split('data: ')[1])['log']) == ['Placing 1 BTC']
+    assert next(events) == b': heartbeat\n\n'
+    # a client falling behind is dropped
+    for i in range(3):
+        output.printline(str(i))
+        output.publish()
+    assert len(stream.clients) == 0
+    assert list(events) == []
+
+
+@pytest.fixture
+def web_server(tmpdir, monkeypatch):
+    tmpdir.mkdir('www').join('lendingbot.js').write('var refreshRate = 30\n')
+    monkeypatch.chdir(tmpdir)
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    monkeypatch.setattr(WebServer, 'web_server_ip', '127.0.0.1')
+    monkeypatch.setattr(WebServer, 'web_server_port', str(port))
+    monkeypatch.setattr(WebServer, 'web_server_workers', 4)
+    monkeypatch.setattr(WebServer, 'web_server_timeout', 2)
+    thread = threading.Thread(target=WebServer.start_web_server)
+    thread.start()
+    for _ in range(50):
+        if WebServer.server is not None:
+            break
+        time.sleep(0.1)
+    yield port
+    WebServer.server.shutdown()
+    thread.join(5)
+    WebServer.server.server_close()
+    WebServer.server = None
+
+
+def test_keep_alive_and_static_caching(web_server):
+    connection = http.client.HTTPConnection('127.0.0.1', web_server, timeout=5)
+    connection.request('GET', '/lendingbot.js')
+    response = connection.getresponse()
+    assert response.read() == b'var refreshRate = 30\n'
+    assert response.getheader('Cache-Control') == 'max-age={}'.format(WebServer.STATIC_MAX_AGE)
+    # the same connection serves the next request
+    connection.request('GET', '/lendingbot.js', headers={'If-Modified-Since': response.getheader('Last-Modified')})
+    response = connection.getresponse()
+    assert response.status == 304
+    response.read()
+    connection.request('GET', '/missing.js')
+    response = connection.getresponse()
+    assert response.status == 404
+    assert response.getheader('Cache-Control') is None
+    connection.close()
+
+
+def test_idle_clients_do_not_block_others(web_server):
+    idle = [socket.create_connection(('127.0.0.1', web_server)) for _ in range(3)]
+    try:
+        started = time.time()
+        with urllib.request.urlopen('http://127.0.0.1:{}/lendingbot.js'.format(web_server), timeout=5) as response:
+            assert response.status == 200
+        assert time.time() - started < 1
+    finally:
+        for s in idle:
+            s.close()
@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, parentdir)
+
+
+from coinlendingbot.websocket import ExchangeWsClient, BitfinexWsClientProtocol  # nopep8
+
+OFFER = [41237, "fUSD", 1526000000000, 1526000000000, 150, 150, "LIMIT", None, None, 0, "ACTIVE",
+         None, None, None, 0.0002, 2, 0, 0, None, 0, None]
+
+
+def new_protocol():
+    ws = ExchangeWsClient('BITFINEX')
+    proto = BitfinexWsClientProtocol()
+    proto.factory = ws.factory
+    proto.sent = []
+    proto.sendMessage = lambda payload, isBinary=False: proto.sent.append(json.loads(payload.decode('utf8')))
+    return ws, proto
+
+
+def receive(proto, msg):
+    proto.onMessage(json.dumps(msg).encode('utf8'), False)
+
+
+def test_state_requires_authentication():
+    ws, proto = new_protocol()
+    receive(proto, [0, "fos", [OFFER]])
+    assert ws.return_funding_offers() is None
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    receive(proto, [0, "fos", [OFFER]])
+    assert 0.0002 == ws.return_funding_offers()[0]["rate"]
+
+
+def test_funding_offer_lifecycle():
+    ws, proto = new_protocol()
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    receive(proto, [0, "fos", []])
+    receive(proto, [0, "fon", OFFER])
+    assert [41237] == [o["id"] for o in ws.return_funding_offers()]
+    receive(proto, [0, "foc", OFFER])
+    assert [] == ws.return_funding_offers()
+
+
+def test_wallet_waits_for_available_balance():
+    ws, proto = new_protocol()
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    receive(proto, [0, "ws", [["funding", "USD", 300, 0, None]]])
+    assert ws.return_wallets() is None
+    assert [0, "calc", None, [["wallet_funding_USD"]]] == proto.sent[-1]
+    receive(proto, [0, "wu", ["funding", "USD", 300, 0, 150]])
+    assert 150 == ws.return_wallets()["funding"]["USD"]["available"]
+
+
+def test_state_dropped_on_close():
+    ws, proto = new_protocol()
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    receive(proto, [0, "fcs", []])
+    assert [] == ws.return_funding_credits()
+    proto.onClose(False, 1006, "test")
+    assert ws.return_funding_credits() is None
+
+
+def create_funding_offer(ws, result, rate='0.00020000', timeout=5):
+    waiting = len(ws.pending_requests["fon-req"])
+    thread = threading.Thread(target=lambda: result.update(ws.create_funding_offer('USD', '150.00000000', rate, 2,
+                                                                                   timeout) or {}))
+    thread.start()
+    while len(ws.pending_requests["fon-req"]) == waiting:
+        time.sleep(0.01)
+    return thread
+
+
+def offer_notification(offer_id, rate, status="SUCCESS"):
+    offer = list(OFFER)
+    offer[0] = offer_id
+    offer[14] = rate
+    # the message id of a fon-req notification is always null
+    return [0, "n", [1526000000000, "fon-req", None, None, offer, None, status, "Submitting offer"]]
+
+
+def test_funding_offer_request_confirmation():
+    ws, proto = new_protocol()
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    result = {}
+    thread = create_funding_offer(ws, result)
+    receive(proto, offer_notification(41237, 0.0002))
+    thread.join()
+    assert "SUCCESS" == result["status"]
+    assert 41237 == result["funding_offer"]["id"]
+
+
+def test_funding_offer_request_timeout():
+    ws, proto = new_protocol()
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    assert ws.cancel_funding_offer(41237, 0.1) is None
+    assert {} == ws.pending_requests["foc-req"]
+
+
+def test_confirmations_of_equal_amounts_matched_by_rate():
+    ws, proto = new_protocol()
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    low, high = {}, {}
+    low_thread = create_funding_offer(ws, low, '0.0002000000')
+    high_thread = create_funding_offer(ws, high, '0.0003000000')
+    receive(proto, offer_notification(41238, 0.0003))
+    high_thread.join()
+    assert 41238 == high["funding_offer"]["id"]
+    assert not low
+    receive(proto, offer_notification(41237, 0.0002))
+    low_thread.join()
+    assert 41237 == low["funding_offer"]["id"]
+
+
+def test_late_confirmation_not_taken_by_next_request():
+    ws, proto = new_protocol()
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    assert ws.create_funding_offer('USD', '150.00000000', '0.0003000000', 2, 0.1) is None
+    assert {} == ws.pending_requests["fon-req"]
+    result = {}
+    thread = create_funding_offer(ws, result)
+    receive(proto, offer_notification(41237, 0.0003))
+    assert 1 == len(ws.pending_requests["fon-req"])
+    receive(proto, offer_notification(41238, 0.0002))
+    thread.join()
+    assert 41238 == result["funding_offer"]["id"]
+
+
+def test_rejection_without_offer_taken_by_oldest_request():
+    ws, proto = new_protocol()
+    receive(proto, {"event": "auth", "status": "OK", "chanId": 0, "userId": 1})
+    first, second = {}, {}
+    first_thread = create_funding_offer(ws, first, '0.0002000000')
+    create_funding_offer(ws, second, '0.0003000000', timeout=0.5)
+    receive(proto, [0, "n", [1526000000000, "fon-req", None, None, None, None, "ERROR", "Invalid offer"]])
+    first_thread.join()
+    assert "ERROR" == first["status"]
+    assert not second
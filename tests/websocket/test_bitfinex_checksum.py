@@ -0,0 +1,56 @@
+import zlib
+
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, parentdir)
+
+
+from coinlendingbot.websocket import ExchangeWsClient  # nopep8
+
+
+class FactoryStub(object):
+    def __init__(self):
+        self.resynced = []
+
+    def resync_lendingbook(self, currency):
+        self.resynced.append(currency)
+
+
+def new_client():
+    ws = ExchangeWsClient('BITFINEX')
+    ws.factory = FactoryStub()
+    ws._data_processing('lendingbook', 'snapshot', {
+        "symbol": "USD",
+        "asks": {"0.000210000000_02": {"rate": 0.00021, "amount": 1500.5, "period": 2},
+                 "0.000230000000_30": {"rate": 0.00023, "amount": 200, "period": 30}},
+        "bids": {"0.000200000000_02": {"rate": 0.0002, "amount": 3000, "period": 2},
+                 "0.000001230000_02": {"rate": 1.23e-06, "amount": 10, "period": 2}}
+    })
+    return ws
+
+
+def test_checksum_string():
+    ws = new_client()
+    expected = zlib.crc32(b"0.0002:-3000:0.00021:1500.5:0.00000123:-10:0.00023:200")
+    expected = expected - (1 << 32) if expected & 0x80000000 else expected
+    assert expected == ExchangeWsClient.lendingbook_checksum(ws.lendingbook['USD'])
+
+
+def test_checksum_match():
+    ws = new_client()
+    checksum = ExchangeWsClient.lendingbook_checksum(ws.lendingbook['USD'])
+    ws._data_processing('lendingbook', 'checksum', {"symbol": "USD", "checksum": checksum})
+    assert {} == ws.return_checksum_failures()
+    assert [] == ws.factory.resynced
+
+
+def test_checksum_mismatch_resyncs_currency():
+    ws = new_client()
+    checksum = ExchangeWsClient.lendingbook_checksum(ws.lendingbook['USD'])
+    ws._data_processing('lendingbook', 'delete', {"symbol": "USD", "entry": "0.000230000000_30", "side": "asks"})
+    ws._data_processing('lendingbook', 'checksum', {"symbol": "USD", "checksum": checksum})
+    assert {'USD': 1} == ws.return_checksum_failures()
+    assert ['USD'] == ws.factory.resynced
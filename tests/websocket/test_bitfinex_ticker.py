@@ -1,5 +1,6 @@
 import pytest
 import logging
+import json
 
 import os
 import sys
@@ -10,7 +11,7 @@ parentdir = os.path.dirname(os.path.dirname(currentdir))
 sys.path.insert(0, parentdir)
 
 
-from coinlendingbot.websocket import ExchangeWsClient  # nopep8
+from coinlendingbot.websocket import ExchangeWsClient, BitfinexWsClientProtocol  # nopep8
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
 
@@ -31,3 +32,12 @@ def test_ticker_subscribe(websocket):
     time.sleep(2)
     ticker = websocket.return_ticker()
     assert {} == ticker
+
+
+def test_ticker_subscribe_error():
+    ws = ExchangeWsClient('BITFINEX')
+    proto = BitfinexWsClientProtocol()
+    proto.factory = ws.factory
+    proto.onMessage(json.dumps({"event": "error", "msg": "symbol: invalid", "code": 10300,
+                                "channel": "ticker", "symbol": "tXYZBTC"}).encode('utf8'), False)
+    assert {'XYZBTC'} == ws.return_ticker_errors()
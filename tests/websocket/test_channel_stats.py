@@ -0,0 +1,29 @@
+import json
+
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, parentdir)
+
+
+from coinlendingbot.websocket import ExchangeWsClient, BitfinexWsClientProtocol  # nopep8
+
+
+def receive(proto, msg):
+    proto.onMessage(json.dumps(msg).encode('utf8'), False)
+
+
+def test_channel_stats():
+    ws = ExchangeWsClient('BITFINEX')
+    proto = BitfinexWsClientProtocol()
+    proto.factory = ws.factory
+    receive(proto, {"event": "subscribed", "channel": "book", "chanId": 7, "symbol": "fUSD", "currency": "USD"})
+    receive(proto, [7, [[0.0002, 2, 1, -3000], [0.00021, 2, 1, 1500]]])
+    receive(proto, [7, [0.00022, 2, 1, 100]])
+    stats = ws.return_channel_stats()
+    assert 1 == stats["events"]["messages"]
+    assert 2 == stats["book:USD"]["messages"]
+    assert len(json.dumps([7, [0.00022, 2, 1, 100]])) < stats["book:USD"]["bytes"]
+    assert 0 < stats["book:USD"]["memory"]
@@ -0,0 +1,66 @@
+import pytest
+import logging
+import json
+
+import os
+import sys
+import inspect
+import time
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, parentdir)
+
+from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory  # nopep8
+from twisted.internet import reactor  # nopep8
+
+from coinlendingbot.websocket import ExchangeWsClient  # nopep8
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+
+TICKER = [148, "0.03100000", "0.03120000", "0.03090000", "0.01000000", "100.0", "3000.0", 0,
+          "0.03200000", "0.03000000"]
+
+
+class StandInPoloniexProtocol(WebSocketServerProtocol):
+    def onMessage(self, payload, isBinary):
+        msg = json.loads(payload.decode('utf8'))
+        if msg == {"command": "subscribe", "channel": 1002}:
+            self.sendMessage(json.dumps([1002, 1]).encode('utf8'))
+            self.sendMessage(json.dumps([1002, None, TICKER]).encode('utf8'))
+            self.sendMessage(json.dumps([1010]).encode('utf8'))
+
+
+@pytest.fixture
+def websocket():
+    factory = WebSocketServerFactory()
+    factory.protocol = StandInPoloniexProtocol
+    port = reactor.listenTCP(0, factory, interface='127.0.0.1')
+    ws = ExchangeWsClient('POLONIEX', 'ws://127.0.0.1:{}'.format(port.getHost().port))
+    ws.set_currency_pairs({148: 'BTC_ETH'})
+    ws.start()
+    return ws
+
+
+def test_ticker_subscribe(websocket):
+    websocket.subscribe_ticker('BTC_ETH')
+    for _ in range(50):
+        if 'BTC_ETH' in websocket.return_ticker():
+            break
+        time.sleep(0.1)
+    ticker = websocket.return_ticker()
+    assert "0.03090000" == ticker['BTC_ETH']['highestBid']
+    assert ticker['BTC_ETH']['update_time']
+
+
+def test_ticker_keeps_seeded_pairs(websocket):
+    websocket.seed_ticker({'BTC_ETH': {'id': 148, 'highestBid': '0.03000000'},
+                           'BTC_LTC': {'id': 50, 'highestBid': '0.01000000'}})
+    websocket.subscribe_ticker('BTC_ETH')
+    for _ in range(50):
+        if websocket.return_ticker()['BTC_ETH']['highestBid'] != '0.03000000':
+            break
+        time.sleep(0.1)
+    ticker = websocket.return_ticker()
+    assert "0.03090000" == ticker['BTC_ETH']['highestBid']
+    assert 148 == ticker['BTC_ETH']['id']
+    assert "0.01000000" == ticker['BTC_LTC']['highestBid']
@@ -0,0 +1,69 @@
+import json
+
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, parentdir)
+
+
+from coinlendingbot.websocket import WsRecorder, WsReplay  # nopep8
+
+FRAMES = [
+    {"event": "info", "version": 2},
+    {"event": "subscribed", "channel": "book", "chanId": 7, "symbol": "fUSD", "currency": "USD"},
+    [7, [[0.0002, 2, 1, -3000], [0.00021, 2, 1, 1500]]],
+    [7, [0.00022, 2, 1, 100]],
+    [7, "hb"],
+]
+
+
+def record(filename, frames):
+    recorder = WsRecorder(str(filename))
+    recorder.record_open()
+    for frame in frames:
+        recorder.record(json.dumps(frame).encode('utf8'))
+    recorder.close()
+
+
+def test_replay_builds_lendingbook(tmpdir):
+    filename = tmpdir.join("bitfinex.log.gz")
+    record(filename, FRAMES)
+    replay = WsReplay('BITFINEX', str(filename))
+    stats = replay.run()
+    assert len(FRAMES) == stats["messages"]
+    book = replay.client.return_lendingbook('USD')
+    assert [0.00021, 0.00022] == [a["rate"] for a in book["asks"]]
+    assert [3000] == [b["amount"] for b in book["bids"]]
+
+
+def test_replay_checksum_resync(tmpdir):
+    filename = tmpdir.join("bitfinex.log.gz")
+    record(filename, FRAMES[:3] + [[7, "cs", 1234]])
+    replay = WsReplay('BITFINEX', str(filename))
+    replay.run()
+    assert {'USD': 1} == replay.client.return_checksum_failures()
+    # the resync unsubscribes the channel and subscribes it again
+    assert {"event": "unsubscribe", "chanId": 7} == json.loads(replay.sent[0].decode('utf8'))
+
+
+def test_reopen_resets_channels(tmpdir):
+    filename = tmpdir.join("bitfinex.log.gz")
+    recorder = WsRecorder(str(filename))
+    for frame in FRAMES[:3]:
+        recorder.record(json.dumps(frame).encode('utf8'))
+    recorder.record_open()
+    recorder.record(json.dumps([7, [0.00022, 2, 1, 100]]).encode('utf8'))
+    recorder.close()
+    replay = WsReplay('BITFINEX', str(filename))
+    replay.run()
+    assert 1 == len(replay.client.return_lendingbook('USD')["asks"])
+
+
+def test_recorder_appends(tmpdir):
+    filename = tmpdir.join("bitfinex.log.gz")
+    record(filename, FRAMES[:2])
+    record(filename, FRAMES[2:3])
+    stats = WsReplay('BITFINEX', str(filename)).run()
+    assert 3 == stats["messages"]
@@ -0,0 +1,43 @@
+#!/bin/env python3
+
+import click
+import logging
+
+from coinlendingbot.websocket import WsReplay
+
+
+@click.command()
+@click.argument('exchange')
+@click.argument('recording', type=click.Path(exists=True))
+@click.option(
+    '-r', '--realtime',
+    is_flag=True,
+    help='Replay at the recorded speed instead of as fast as possible'
+)
+@click.option(
+    '-v', '--verbose',
+    is_flag=True,
+    help='Log the processing of every frame'
+)
+def main(exchange, recording, realtime, verbose):
+    """
+    Replays a websocket RECORDING of EXCHANGE (Bitfinex or Poloniex) without network
+    """
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.WARNING,
+                        format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    replay = WsReplay(exchange.upper(), recording)
+    stats = replay.run(realtime)
+    click.echo("{} messages, {} bytes in {:.3f} s: {:.0f} messages/s".format(
+        stats["messages"], stats["bytes"], stats["seconds"], stats["messages_per_second"]))
+    click.echo("latency ms: p50 {:.3f}, p99 {:.3f}, max {:.3f}".format(
+        stats["latency_p50"], stats["latency_p99"], stats["latency_max"]))
+    for currency in sorted(replay.client.return_lendingbook_list()):
+        book = replay.client.lendingbook[currency]
+        click.echo("book {}: {} asks, {} bids".format(currency, len(book["asks"]), len(book["bids"])))
+    failures = replay.client.return_checksum_failures()
+    if failures:
+        click.echo("checksum failures: {}".format(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,11 @@ var Week = new Timespan('Week', 7)
 var Month = new Timespan('Month', 30)
 var Year = new Timespan('Year', 365)
 var refreshRate = 30
+// the status served from memory by the web server of the bot
+var statusUrl = 'api/status'
+// the status pushed by the web server of the bot, kept up to date with its deltas
+var statusEvents, statusData, statusVersion
+var statusPush = Boolean(window.EventSource)
 var timespans = []
 var summaryCoinRate, summaryCoin
 var earningsOutputCoinRate, earningsOutputCoin
@@ -249,18 +254,78 @@ function updateRawValues (rawData) {
   }
 }
 
+function applyDelta (delta) {
+  $.each(delta.set, function (key, value) {
+    statusData[key] = value
+  })
+  $.each(delta.coins, function (coin, values) {
+    statusData.raw_data[coin] = values
+  })
+  $.each(delta.removedCoins, function (i, coin) {
+    delete statusData.raw_data[coin]
+  })
+  statusData.log = statusData.log.concat(delta.log).slice(-delta.logLimit)
+}
+
+function listenData () {
+  var received = false
+  statusEvents = new window.EventSource('api/events')
+  statusEvents.addEventListener('snapshot', function (e) {
+    received = true
+    statusData = JSON.parse(e.data)
+    statusVersion = parseInt(e.lastEventId)
+    updateJson(statusData)
+  })
+  statusEvents.addEventListener('delta', function (e) {
+    var delta = JSON.parse(e.data)
+    if (delta.version <= statusVersion) {
+      // already in the snapshot
+      return
+    }
+    if (delta.version !== statusVersion + 1) {
+      // missed a delta, start over with a snapshot
+      statusEvents.close()
+      listenData()
+      return
+    }
+    applyDelta(delta)
+    statusVersion = delta.version
+    updateJson(statusData)
+  })
+  statusEvents.onerror = function () {
+    if (!received) {
+      // not pushed by the bot, poll instead
+      statusEvents.close()
+      statusEvents = null
+      statusPush = false
+      loadData()
+    }
+  }
+}
+
 function loadData () {
   if (localFile) {
     reader.readAsText(localFile, 'utf-8')
     setTimeout(loadData, refreshRate * 1000)
+  } else if (statusEvents) {
+    // pushed, render it again with the changed settings
+    if (statusData) {
+      updateJson(statusData)
+    }
+  } else if (statusPush) {
+    listenData()
   } else {
-    // expect the botlog.json to be in the same folder on the webserver
-    var file = 'botlog.json'
-    $.getJSON(file, function (data) {
+    $.getJSON(statusUrl, function (data) {
       updateJson(data)
       // reload every 30sec
       setTimeout(loadData, refreshRate * 1000)
     }).fail(function (d, textStatus, error) {
+      if (statusUrl !== 'botlog.json' && d.status === 404) {
+        // not served by the bot, expect the botlog.json to be in the same folder on the webserver
+        statusUrl = 'botlog.json'
+        loadData()
+        return
+      }
       $('#status').text('getJSON failed, status: ' + textStatus + ', error: ' + error)
       // retry after 60sec
       setTimeout(loadData, 60000)